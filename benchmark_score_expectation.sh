@@ -0,0 +1,43 @@
+# !/bin/bash
+# Compare 4-pass sampled averaging (avg4) with single-pass logprob expectations on EditReward-Bench.
+# Both runs use the same vLLM backbone; the "Scored N pairs in ... seconds" lines give the decode cost,
+# and the final table compares the accuracies with bootstrap confidence intervals.
+SHELL_FOLDER=$(cd "$(dirname "$0")";pwd)
+cd $SHELL_FOLDER
+
+MODEL=Qwen/Qwen3-VL-4B-Instruct
+LORA=EditScore/EditScore-Qwen3-VL-4B-Instruct
+
+python evaluation.py \
+--benchmark_dir EditScore/EditReward-Bench \
+--result_dir results/EditScore-Qwen3-VL-4B-vllm-avg4 \
+--backbone qwen3vl_vllm \
+--model_name_or_path $MODEL \
+--lora_path $LORA \
+--score_range 25 \
+--max_workers 1 \
+--max_model_len 4096 \
+--max_num_seqs 1 \
+--max_num_batched_tokens 4096 \
+--tensor_parallel_size 1 \
+--num_pass 4 \
+--skip_image_export
+
+python evaluation.py \
+--benchmark_dir EditScore/EditReward-Bench \
+--result_dir results/EditScore-Qwen3-VL-4B-vllm-expectation \
+--backbone qwen3vl_vllm \
+--model_name_or_path $MODEL \
+--lora_path $LORA \
+--score_range 25 \
+--max_workers 1 \
+--max_model_len 4096 \
+--max_num_seqs 1 \
+--max_num_batched_tokens 4096 \
+--tensor_parallel_size 1 \
+--num_pass 1 \
+--score_expectation \
+--skip_image_export
+
+python calculate_statistics.py \
+--result_dir results/EditScore-Qwen3-VL-4B-vllm-avg4/qwen3vl_vllm results/EditScore-Qwen3-VL-4B-vllm-expectation/qwen3vl_vllm
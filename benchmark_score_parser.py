@@ -0,0 +1,143 @@
+"""
+Compare the single-pass `parse_score_output` with the repair cascades it short-circuits
+(`mllm_output_to_dict` and `parse_vlm_output_to_dict`) on recorded scorer outputs: check that
+they agree on every output the single-pass parser accepts, and time both.
+
+Recorded outputs are read from the string fields ending in `raw_output` of json/jsonl files
+(e.g. saved `batch_evaluate` results), or from plain text files with one output per line.
+A built-in set covering the known malformations, and outputs the single-pass parser must
+reject, is always included.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+from editscore.json_parser import parse_vlm_output_to_dict
+from editscore.score_parser import parse_score_output
+from editscore.utils import mllm_output_to_dict
+
+BUILTIN_OUTPUTS = [
+    '{\n"reasoning" : "The background was replaced by a glass wall as requested.",\n"score" : [21, 19]\n}',
+    '```json\n{"reasoning": "Clean edit, no artifacts.", "score": [23, 22]}\n```',
+    '{"reasoning": "The sign now reads "OPEN" as instructed.", "score": [20, 18]}',
+    "{'reasoning': 'Colors match the instruction.', 'score': [18, 20]}",
+    '{reasoning: "Unquoted keys but otherwise fine.", score: [12, 15]}',
+    '{“reasoning”: “Smart quotes around keys and value.”, “score”: [9, 11]}',
+    '{"reasoning": "Trailing comma after the list.", "score": [17, 16],}',
+    '{"reasoning": "Closing brace is missing.", "score": [14, 13]',
+    '{"reasoning": "Score given as a single number.", "score": 7}',
+    '{"reasoning": "Scores are quoted.", "score": ["15", "10"]}',
+    '{"reasoning": "Escaped \\"quotes\\" and a\\nnewline.", "score": [25, 24]}',
+    '{"score": [6, 8], "reasoning": "Keys in the other order."}',
+    '{"reasoning": "Python literal fields.", "confident": True, "score": [11, 12]}',
+    '{"reasoning": "Fractional scores.", "score": [7.5, 8.0]}',
+    # rejected by the single-pass parser: wrong number of scores or out of range
+    '{"reasoning": "Only one score in the list.", "score": [7]}',
+    '{"reasoning": "Three scores, one above the range.", "score": [99, 3, 4]}',
+    '{"reasoning": "A negative score.", "score": [-3, 4]}',
+]
+
+
+def load_outputs(paths):
+    outputs = list(BUILTIN_OUTPUTS)
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if os.path.splitext(path)[1] not in (".json", ".jsonl"):
+                outputs.extend(line.rstrip("\n").replace("\\n", "\n") for line in f if line.strip())
+                continue
+            content = f.read()
+        records = [json.loads(content)] if path.endswith(".json") else [json.loads(line) for line in content.splitlines() if line.strip()]
+
+        def _collect(value):
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    if key.endswith("raw_output") and isinstance(item, str):
+                        outputs.append(item)
+                    else:
+                        _collect(item)
+            elif isinstance(value, list):
+                for item in value:
+                    _collect(item)
+
+        _collect(records)
+    return outputs
+
+
+def normalize(parsed):
+    """Scores as floats and reasoning without whitespace or quote-style differences."""
+    if not isinstance(parsed, dict):
+        return None
+    scores = parsed.get("score")
+    scores = scores if isinstance(scores, list) else [scores]
+    try:
+        scores = [float(score) for score in scores]
+    except (TypeError, ValueError):
+        return None
+    reasoning = parsed.get("reasoning") or ""
+    reasoning = "".join(str(reasoning).split()).replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    return scores, reasoning
+
+
+def time_parser(parser, outputs, repeat):
+    # the cascades print on every repair attempt, keep that out of the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results = [parser(output) for output in outputs]
+        elapsed = time.perf_counter() - start
+    return results, elapsed / (repeat * max(len(outputs), 1))
+
+
+def main(args):
+    outputs = load_outputs(args.corpus)
+    print(f"{len(outputs)} outputs ({len(BUILTIN_OUTPUTS)} built-in)")
+
+    parsers = {
+        "single_pass": lambda output: parse_score_output(output, args.score_range),
+        "mllm_output_to_dict": lambda output: mllm_output_to_dict(output, score_range=args.score_range),
+        "parse_vlm_output_to_dict": parse_vlm_output_to_dict,
+    }
+    results = dict()
+    for name, parser in parsers.items():
+        results[name], per_output = time_parser(parser, outputs, args.repeat)
+        print(f"{name}: {per_output * 1e6:.1f} us per output")
+
+    accepted = [idx for idx, parsed in enumerate(results["single_pass"]) if parsed is not None]
+    print(f"single_pass accepted {len(accepted)}/{len(outputs)} outputs, the rest fall back to the cascade")
+
+    for name in ("mllm_output_to_dict", "parse_vlm_output_to_dict"):
+        score_mismatches, reasoning_mismatches = [], []
+        for idx in accepted:
+            expected = normalize(results[name][idx])
+            actual = normalize(results["single_pass"][idx])
+            if expected is None or expected[0] != actual[0]:
+                score_mismatches.append(idx)
+            elif expected[1] != actual[1]:
+                reasoning_mismatches.append(idx)
+        print(
+            f"vs {name}: {len(accepted) - len(score_mismatches) - len(reasoning_mismatches)} identical, "
+            f"{len(score_mismatches)} score mismatches, {len(reasoning_mismatches)} reasoning-only mismatches"
+        )
+        for idx in (score_mismatches + reasoning_mismatches)[:args.show]:
+            print(f"  output:      {outputs[idx]!r}")
+            print(f"  single_pass: {results['single_pass'][idx]}")
+            print(f"  {name}: {results[name][idx]}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", type=str, nargs="*", default=[],
+                        help="json/jsonl files with *raw_output fields, or text files with one output per line.")
+    parser.add_argument("--score_range", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--show", type=int, default=5, help="Number of mismatching outputs to print per cascade.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -1,5 +1,4 @@
 import os
-import glob
 import json
 import numpy as np
 
@@ -9,116 +8,171 @@ PROMPT_FOLLOWING = "prompt_following"
 CONSISTENCY = "consistency"
 OVERALL = "overall"
 SCORE_CATEGORIES = [PROMPT_FOLLOWING, CONSISTENCY, OVERALL]
+CATEGORY_NAMES = {PROMPT_FOLLOWING: "Prompt Following", CONSISTENCY: "Consistency", OVERALL: "Overall"}
+
+TASK_TYPES = [
+    'background_change', 'color_alter', 'style_change', 'subject-add', 'subject-remove', 'subject-replace', 'material_alter',
+    'motion_change', 'ps_human', 'text_change', 'tone_transfer', 'extract', 'compose'
+]
+
+GROUPS = {
+    'object': ['subject-add', 'subject-remove', 'subject-replace'],
+    'appearance': ['color_alter', 'material_alter', 'style_change', 'tone_transfer'],
+    'scene': ['background_change', 'extract'],
+    'advanced': ['ps_human', 'text_change', 'motion_change', 'compose'],
+}
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--result_dir", type=str, required=True)
+    parser.add_argument("--result_dir", type=str, nargs="+", required=True,
+                        help="One or more result directories (each holding one sub-directory per task type) to compare.")
     parser.add_argument("--backbone", type=str, default="qwen25vl", choices=["qwen25vl", "openai", "internvl3_5"])
+    parser.add_argument("--ties", type=str, default="incorrect", choices=["incorrect", "half", "drop"],
+                        help="How pairs with equal scores count: as wrong (default), as half correct, or excluded.")
+    parser.add_argument("--num_bootstrap", type=int, default=1000,
+                        help="Number of bootstrap resamples for the confidence intervals, 0 disables them.")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
     return parser.parse_args()
 
-def main(args):
-    task_types = sorted(os.listdir(args.result_dir))
-
-    print(task_types)
-
-    prompt_following_results = dict()
-    consistency_results = dict()
-    overall_results = dict()
-
-    all_prompt_following_scores = []
-    all_consistency_scores = []
-    all_overall_scores = []
-
-    for task_type in task_types:
-        task_type_dir = os.path.join(args.result_dir, task_type)
-        prompt_following_json_file = os.path.join(task_type_dir, f"{PROMPT_FOLLOWING}.jsonl")
-        consistency_json_file = os.path.join(task_type_dir, f"{CONSISTENCY}.jsonl")
-        overall_json_file = os.path.join(task_type_dir, f"{OVERALL}.jsonl")
-
-        total_num = 0
-        correct_num = 0
-        with open(prompt_following_json_file, 'r') as f:
-            for line in f:
-                json_line = json.loads(line)
-                if json_line['score'][0] > json_line['score'][1]:
-                    correct_num += 1
-                total_num += 1
-                all_prompt_following_scores.append(json_line['score'][0])
-                all_prompt_following_scores.append(json_line['score'][1])
-        prompt_following_results[task_type] = correct_num / total_num
-        
-        total_num = 0
-        correct_num = 0
-        with open(consistency_json_file, 'r') as f:
-            for line in f:
-                json_line = json.loads(line)
-                if json_line['score'][0] > json_line['score'][1]:
-                    correct_num += 1
-                total_num += 1
-                all_consistency_scores.append(json_line['score'][0])
-                all_consistency_scores.append(json_line['score'][1])
-        consistency_results[task_type] = correct_num / total_num
-        
-        total_num = 0
-        correct_num = 0
-        with open(overall_json_file, 'r') as f:
-            for line in f:
-                json_line = json.loads(line)
-                if json_line['score'][0] > json_line['score'][1]:
-                    correct_num += 1
-                total_num += 1
-                all_overall_scores.append(json_line['score'][0])
-                all_overall_scores.append(json_line['score'][1])
-        overall_results[task_type] = correct_num / total_num
-
-    prompt_following_results['average'] = sum(prompt_following_results.values()) / len(prompt_following_results)
-    consistency_results['average'] = sum(consistency_results.values()) / len(consistency_results)
-    overall_results['average'] = sum(overall_results.values()) / len(overall_results)
-
-    print(overall_results.keys())
-
-    task_types = [
-        'background_change', 'color_alter', 'style_change', 'subject-add', 'subject-remove', 'subject-replace', 'material_alter',
-        'motion_change', 'ps_human', 'text_change', 'tone_transfer', 'extract', 'compose', 'average'
-    ]
+def load_scores(result_dir, task_types):
+    """
+    Load the pair scores of every task type into columns. Returns, per score category, an
+    (N, 2) float array of scores and an (N,) int array of task type indices.
+    """
+    columns = dict()
+    for category in SCORE_CATEGORIES:
+        scores = []
+        task_idx = []
+        for i, task_type in enumerate(task_types):
+            with open(os.path.join(result_dir, task_type, f"{category}.jsonl"), 'r') as f:
+                task_scores = [json.loads(line)['score'] for line in f if line.strip()]
+            scores.extend(task_scores)
+            task_idx.append(np.full(len(task_scores), i, dtype=np.int64))
+        columns[category] = (np.asarray(scores, dtype=np.float64).reshape(-1, 2), np.concatenate(task_idx))
+    return columns
+
+def pair_outcomes(scores, ties):
+    """Per-pair correctness (1, 0 or 0.5 for a tie under `half`) and a mask of the pairs that count."""
+    correct = (scores[:, 0] > scores[:, 1]).astype(np.float64)
+    tied = scores[:, 0] == scores[:, 1]
+    valid = np.ones(len(scores), dtype=bool)
+    if ties == "half":
+        correct[tied] = 0.5
+    elif ties == "drop":
+        valid = ~tied
+    return correct, valid
+
+def task_accuracies(correct, valid, task_idx, num_tasks):
+    totals = np.bincount(task_idx, weights=valid.astype(np.float64), minlength=num_tasks)
+    hits = np.bincount(task_idx, weights=correct * valid, minlength=num_tasks)
+    return hits / np.maximum(totals, 1)
+
+def bootstrap_task_accuracies(correct, valid, task_idx, num_tasks, num_bootstrap, rng):
+    """
+    (num_tasks, num_bootstrap) accuracies, resampling pairs with replacement within each task
+    type so that every resample keeps the per-task sizes of the benchmark.
+    """
+    samples = np.zeros((num_tasks, num_bootstrap))
+    for t in range(num_tasks):
+        rows = np.flatnonzero((task_idx == t) & valid)
+        if len(rows) == 0:
+            continue
+        draws = rows[rng.integers(0, len(rows), size=(num_bootstrap, len(rows)))]
+        samples[t] = correct[draws].mean(axis=1)
+    return samples
+
+def compute_statistics(columns, task_types, ties, num_bootstrap, rng):
+    """
+    Accuracy of every task type, group and the macro average for each score category. With
+    `num_bootstrap` > 0, the same aggregates are also computed over bootstrap resamples.
+    """
+    num_tasks = len(task_types)
+    task_index = {task_type: i for i, task_type in enumerate(task_types)}
+    aggregates = {task_type: [i] for i, task_type in enumerate(task_types)}
+    aggregates.update({
+        group_name: [task_index[task_type] for task_type in group_task_types if task_type in task_index]
+        for group_name, group_task_types in GROUPS.items()
+    })
+    aggregates['average'] = list(range(num_tasks))
+
+    stats = dict()
+    for category, (scores, task_idx) in columns.items():
+        correct, valid = pair_outcomes(scores, ties)
+        accuracies = task_accuracies(correct, valid, task_idx, num_tasks)
+        samples = None
+        if num_bootstrap > 0:
+            samples = bootstrap_task_accuracies(correct, valid, task_idx, num_tasks, num_bootstrap, rng)
+
+        stats[category] = {
+            'accuracy': {name: float(np.mean(accuracies[rows])) for name, rows in aggregates.items() if rows},
+            'bootstrap': None if samples is None else {
+                name: samples[rows].mean(axis=0) for name, rows in aggregates.items() if rows
+            },
+            'scores': scores.ravel(),
+            'num_ties': int(np.sum(scores[:, 0] == scores[:, 1])),
+        }
+    return stats
+
+def confidence_interval(samples, confidence):
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(samples, [alpha, 1 - alpha])
+    return low, high
+
+def print_statistics(stats, confidence):
+    task_types = TASK_TYPES + ['average']
 
     print(" & ".join(task_types))
-    print("Prompt Following: " + " & ".join([f"{prompt_following_results[task_type]:.3f}" for task_type in task_types]))
-    print("Consistency: " + " & ".join([f"{consistency_results[task_type]:.3f}" for task_type in task_types]))
-    print("Overall: " + " & ".join([f"{overall_results[task_type]:.3f}" for task_type in task_types]))
-    
-    groups = {
-        'object': ['subject-add', 'subject-remove', 'subject-replace'],
-        'appearance': ['color_alter', 'material_alter', 'style_change', 'tone_transfer'],
-        'scene': ['background_change', 'extract'],
-        'advanced': ['ps_human', 'text_change', 'motion_change', 'compose'],
-    }
+    for category in SCORE_CATEGORIES:
+        accuracy = stats[category]['accuracy']
+        print(f"{CATEGORY_NAMES[category]}: " + " & ".join([f"{accuracy[task_type]:.3f}" for task_type in task_types]))
 
     print("--------------------------------")
     print("--------------------------------")
 
-    for group_name, group_task_types in groups.items():
-        print(group_name + ":")
+    for group_name in list(GROUPS) + ['average']:
+        print(("Average" if group_name == 'average' else group_name) + ":")
         print("Prompt Following & Consistency & Overall")
-        prompt_following_mean = np.mean([prompt_following_results[task_type] for task_type in group_task_types])
-        consistency_mean = np.mean([consistency_results[task_type] for task_type in group_task_types])
-        overall_mean = np.mean([overall_results[task_type] for task_type in group_task_types])
-        print(f"{prompt_following_mean:.3f} & {consistency_mean:.3f} & {overall_mean:.3f}")
-    
-    print("Average:")
-    print("Prompt Following & Consistency & Overall")
-    print(f"{prompt_following_results['average']:.3f} & {consistency_results['average']:.3f} & {overall_results['average']:.3f}")
-
-    print("Prompt Following Scores:")
-    print("Min & Max & Mean & Std")
-    print(f"{np.min(all_prompt_following_scores):.3f} & {np.max(all_prompt_following_scores):.3f} & {np.mean(all_prompt_following_scores):.3f} & {np.std(all_prompt_following_scores):.3f}")
-    print("Consistency Scores:")
-    print("Min & Max & Mean & Std")
-    print(f"{np.min(all_consistency_scores):.3f} & {np.max(all_consistency_scores):.3f} & {np.mean(all_consistency_scores):.3f} & {np.std(all_consistency_scores):.3f}")
-    print("Overall Scores:")
-    print("Min & Max & Mean & Std")
-    print(f"{np.min(all_overall_scores):.3f} & {np.max(all_overall_scores):.3f} & {np.mean(all_overall_scores):.3f} & {np.std(all_overall_scores):.3f}")
+        print(" & ".join([f"{stats[category]['accuracy'][group_name]:.3f}" for category in SCORE_CATEGORIES]))
+        if stats[OVERALL]['bootstrap'] is not None:
+            intervals = [confidence_interval(stats[category]['bootstrap'][group_name], confidence) for category in SCORE_CATEGORIES]
+            print(f"{confidence:.0%} CI: " + " & ".join([f"[{low:.3f}, {high:.3f}]" for low, high in intervals]))
+
+    for category in SCORE_CATEGORIES:
+        scores = stats[category]['scores']
+        print(f"{CATEGORY_NAMES[category]} Scores:")
+        print("Min & Max & Mean & Std & Ties")
+        print(f"{np.min(scores):.3f} & {np.max(scores):.3f} & {np.mean(scores):.3f} & {np.std(scores):.3f} & {stats[category]['num_ties']}")
+
+def print_comparison(all_stats, confidence):
+    print("================================")
+    print("Result Dir & Prompt Following & Consistency & Overall")
+    for result_dir, stats in all_stats.items():
+        cells = []
+        for category in SCORE_CATEGORIES:
+            cell = f"{stats[category]['accuracy']['average']:.3f}"
+            if stats[category]['bootstrap'] is not None:
+                low, high = confidence_interval(stats[category]['bootstrap']['average'], confidence)
+                cell += f" [{low:.3f}, {high:.3f}]"
+            cells.append(cell)
+        print(f"{result_dir} & " + " & ".join(cells))
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+
+    all_stats = dict()
+    for result_dir in args.result_dir:
+        task_types = sorted(os.listdir(result_dir))
+        print(result_dir)
+        print(task_types)
+
+        columns = load_scores(result_dir, task_types)
+        all_stats[result_dir] = compute_statistics(columns, task_types, args.ties, args.num_bootstrap, rng)
+        print_statistics(all_stats[result_dir], args.confidence)
+
+    if len(all_stats) > 1:
+        print_comparison(all_stats, args.confidence)
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
@@ -1,16 +1,50 @@
 import sys
 sys.path.insert(0, 'editscore')
 
-from typing import Optional
+from typing import Dict, Optional, Union
+from collections import defaultdict
+import threading
+from PIL import Image
 from .utils import (
     mllm_output_to_dict
 )
 import math
+import json
 from . import vie_prompts
 import numpy as np
 from .json_parser import parse_vlm_output_to_dict
+from .score_parser import parse_score_output
+from .mllm_tools.utils import image_hash
+from .logprob_scores import score_moments
+
+REFUSAL_RESPONSES = ["I'm sorry, but I can't assist with that request."]
+
+# assistant turn prefilled in score-only mode, so that the next tokens are the first score
+SCORE_ONLY_PREFILL = '{\n"reasoning" : "",\n"score" : ['
+NUM_SCORES = 2
+
+
+def score_json_schema(score_range: int, max_reasoning_chars: int) -> dict:
+    """JSON schema of a scorer output: bounded reasoning, then the list of integer scores."""
+    return {
+        "type": "object",
+        "properties": {
+            "reasoning": {"type": "string", "maxLength": max_reasoning_chars},
+            "score": {
+                "type": "array",
+                "items": {"type": "integer", "minimum": 0, "maximum": score_range},
+                "minItems": NUM_SCORES,
+                "maxItems": NUM_SCORES,
+            },
+        },
+        "required": ["reasoning", "score"],
+        "additionalProperties": False,
+    }
 
 class EditScore:
+    # digit strings less likely than this are not expanded further in score-only mode
+    min_score_mass = 1e-3
+
     def __init__(
         self,
         backbone="gpt-4.1",
@@ -26,14 +60,63 @@ class EditScore:
         num_pass: int=1,
         reduction: str="average_last",
         seed: int=42,
-        lora_path: Optional[str]=None,
+        lora_path: Optional[Union[str, Dict[str, str]]]=None,
         cache_dir: Optional[str]=None,
+        image_cache_bytes: int=1 << 30,
+        vision_cache_bytes: int=0,
+        vision_cache_dir: Optional[str]=None,
+        adaptive_pass: bool=False,
+        min_pass: int=2,
+        pass_std_threshold: float=0.5,
+        score_only: bool=False,
+        score_expectation: bool=False,
+        score_top_k: int=20,
+        guided_decoding: bool=False,
+        max_reasoning_chars: int=1024,
+        merge_lora: bool=False,
     ) -> None:
-        self.backbone = backbone
-        self.score_range = score_range
-        self.reduction = reduction
-        self.seed = seed
-        self.num_pass = num_pass
+        """
+        With `adaptive_pass`, `num_pass` becomes a cap: each sample first runs `min_pass`
+        passes, then one more at a time until the standard deviation of its per-pass overall
+        scores (on the 0-10 scale) is at most `pass_std_threshold`.
+
+        With `score_only` (vLLM backends), no reasoning is generated: the assistant turn is
+        prefilled up to the score list and each score is the expectation of the model's
+        distribution over 0..`score_range`, read from next-token probabilities. `num_pass`
+        is ignored since the result is deterministic.
+
+        With `score_expectation` (vLLM backends), outputs are generated as usual but every
+        score is replaced by the expectation of its distribution, read from the `score_top_k`
+        logprobs at the score tokens, and its variance is reported alongside. A single pass
+        then gives the averaged scores that otherwise take several sampled passes.
+
+        With `guided_decoding` (vLLM backends), generation is constrained to the
+        `score_json_schema` object with at most `max_reasoning_chars` of reasoning, so
+        outputs always parse and are never retried or guessed.
+
+        With the vLLM backbones, `lora_path` may be a `{name: path}` dict: every adapter is
+        served by one engine over the shared base weights and picked per `evaluate` /
+        `batch_evaluate` call with `lora=<name>`. `merge_lora` restores the previous behaviour
+        of merging a single adapter into an on-disk copy of the base model.
+        """
+        json_schema = self._init_scoring(
+            backbone, score_range, reduction, seed, num_pass,
+            adaptive_pass, min_pass, pass_std_threshold, guided_decoding, max_reasoning_chars,
+        )
+        vllm_kwargs = dict(
+            model_name_or_path=model_name_or_path,
+            tensor_parallel_size=tensor_parallel_size,
+            max_model_len=max_model_len,
+            max_num_batched_tokens=max_num_batched_tokens,
+            max_num_seqs=max_num_seqs,
+            temperature=temperature,
+            seed=seed,
+            lora_path=lora_path,
+            cache_dir=cache_dir,
+            image_cache_bytes=image_cache_bytes,
+            json_schema=json_schema,
+            merge_lora=merge_lora,
+        )
 
         if self.backbone == 'openai':
             from .mllm_tools.openai import GPT4o
@@ -45,20 +128,13 @@ class EditScore:
                 temperature=temperature,
                 seed=seed,
                 lora_path=lora_path,
+                image_cache_bytes=image_cache_bytes,
+                vision_cache_bytes=vision_cache_bytes,
+                vision_cache_dir=vision_cache_dir,
             )
         elif self.backbone == "qwen25vl_vllm":
             from .mllm_tools.qwen25vl_vllm import Qwen25VL
-            self.model = Qwen25VL(
-                vlm_model=model_name_or_path,
-                tensor_parallel_size=tensor_parallel_size,
-                max_model_len=max_model_len,
-                max_num_seqs=max_num_seqs,
-                max_num_batched_tokens=max_num_batched_tokens,
-                temperature=temperature,
-                seed=seed,
-                lora_path=lora_path,
-                cache_dir=cache_dir,
-            )
+            self.model = self._vllm_model(Qwen25VL, **vllm_kwargs)
         elif self.backbone == "qwen3vl":
             from .mllm_tools.qwen3vl import Qwen3VL
             self.model = Qwen3VL(
@@ -66,30 +142,206 @@ class EditScore:
                 temperature=temperature,
                 seed=seed,
                 lora_path=lora_path,
+                image_cache_bytes=image_cache_bytes,
+                vision_cache_bytes=vision_cache_bytes,
+                vision_cache_dir=vision_cache_dir,
             )
         elif self.backbone == "qwen3vl_vllm":
             from .mllm_tools.qwen3vl_vllm import Qwen3VL
-            self.model = Qwen3VL(
-                vlm_model=model_name_or_path,
-                tensor_parallel_size=tensor_parallel_size,
-                max_model_len=max_model_len,
-                max_num_seqs=max_num_seqs,
-                max_num_batched_tokens=max_num_batched_tokens,
-                temperature=temperature,
-                seed=seed,
-                lora_path=lora_path,
-                cache_dir=cache_dir,
-            )
+            self.model = self._vllm_model(Qwen3VL, **vllm_kwargs)
         elif self.backbone == "internvl3_5":
             from .mllm_tools.internvl35_lmdeploy import InternVL35
             self.model = InternVL35(model=model_name_or_path, tensor_parallel_size=tensor_parallel_size)
-            
+
+        self._init_score_modes(score_only, score_expectation, score_top_k)
+
+    def _init_scoring(
+        self, backbone, score_range, reduction, seed, num_pass,
+        adaptive_pass, min_pass, pass_std_threshold, guided_decoding, max_reasoning_chars,
+    ):
+        """Settings shared by `EditScore` and `AsyncEditScore`, returns the guided decoding schema (None when off)."""
+        self.backbone = backbone
+        self.score_range = score_range
+        self.reduction = reduction
+        self.seed = seed
+        self.num_pass = num_pass
+        self._init_pass_control(adaptive_pass, min_pass, pass_std_threshold)
+        self.guided_decoding = guided_decoding
+        if guided_decoding and self.backbone not in ("qwen25vl_vllm", "qwen3vl_vllm"):
+            raise ValueError(f"guided_decoding needs a vLLM backbone (qwen25vl_vllm, qwen3vl_vllm), got {self.backbone}")
+        return score_json_schema(score_range, max_reasoning_chars) if guided_decoding else None
+
+    @staticmethod
+    def _vllm_model(
+        model_class, model_name_or_path, tensor_parallel_size, max_model_len, max_num_batched_tokens, max_num_seqs,
+        temperature, seed, lora_path, cache_dir, image_cache_bytes, json_schema, merge_lora,
+    ):
+        """Build one of the (sync or async) vLLM backends."""
+        return model_class(
+            vlm_model=model_name_or_path,
+            tensor_parallel_size=tensor_parallel_size,
+            max_model_len=max_model_len,
+            max_num_seqs=max_num_seqs,
+            max_num_batched_tokens=max_num_batched_tokens,
+            temperature=temperature,
+            seed=seed,
+            lora_path=lora_path,
+            cache_dir=cache_dir,
+            merge_lora_weights=merge_lora,
+            image_cache_bytes=image_cache_bytes,
+            json_schema=json_schema,
+        )
+
+    def _init_score_modes(self, score_only, score_expectation, score_top_k):
+        """Check that the backend supports the requested logprob-based scoring, then build the prompts."""
+        self.score_only = score_only
+        if self.score_only and not hasattr(self.model, "next_token_logprobs"):
+            raise ValueError(f"score_only needs a backend exposing next-token logprobs (qwen25vl_vllm, qwen3vl_vllm), got {self.backbone}")
+        self.score_expectation = score_expectation
+        self.score_top_k = score_top_k
+        if self.score_expectation and not hasattr(self.model, "batch_inference_with_logprobs"):
+            raise ValueError(f"score_expectation needs a backend returning token logprobs (qwen25vl_vllm, qwen3vl_vllm), got {self.backbone}")
+        self._build_prompts()
+
+    def _build_prompts(self):
         self.context = vie_prompts._context_no_delimit_reasoning_first
     
         self.SC_prompt = "\n".join([self.context, vie_prompts._prompts_0shot_two_image_edit_rule, vie_prompts._prompts_0shot_tie_rule_SC.replace('10', str(self.score_range))])
         self.PQ_prompt = "\n".join([self.context, vie_prompts._prompts_0shot_rule_PQ.replace('10', str(self.score_range))])
 
-    def evaluate(self, image_prompts, text_prompt):
+    def _parse_guided_output(self, result):
+        """Read a schema-constrained output directly, None if it was cut short by `max_tokens`."""
+        try:
+            output = json.loads(result)
+            return {"score": [float(score) for score in output["score"]], "reasoning": output["reasoning"]}
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            return None
+
+    def _parse_output(self, result, give_up_parsing, text_prompt):
+        if self.guided_decoding:
+            output = self._parse_guided_output(result)
+            if output is not None:
+                return output
+        # the repairing cascade only runs for outputs the single-pass parser cannot read
+        output = parse_score_output(result, self.score_range, NUM_SCORES)
+        if output is not None:
+            return output
+        if result in REFUSAL_RESPONSES:
+            give_up_parsing = True
+        return mllm_output_to_dict(result, give_up_parsing=give_up_parsing, text_prompt=text_prompt, score_range=self.score_range)
+
+    def _lora_kwargs(self, lora):
+        """Keyword selecting a LoRA adapter of the backend, only passed when one is requested."""
+        if lora is None:
+            return {}
+        if not hasattr(self.model, "lora_requests"):
+            raise ValueError(f"Selecting a LoRA adapter per call needs a vLLM backbone (qwen25vl_vllm, qwen3vl_vllm), got {self.backbone}")
+        return {"lora": lora}
+
+    def _batch_generate(self, prompts, seed, lora=None):
+        """
+        `batch_inference`, plus the generated tokens with their top-k probabilities when
+        `score_expectation` is on (None otherwise).
+        """
+        if not self.score_expectation:
+            return self.model.batch_inference(prompts, seed=seed, **self._lora_kwargs(lora)), [None] * len(prompts)
+        results = self.model.batch_inference_with_logprobs(prompts, seed=seed, top_k=self.score_top_k, **self._lora_kwargs(lora))
+        return [response for response, _ in results], [tokens for _, tokens in results]
+
+    def _apply_score_moments(self, evaluation, tokens):
+        """Replace the sampled scores of a parsed output by their expectations, and add `score_var`."""
+        if tokens is None or not isinstance(evaluation, dict) or not evaluation.get("score"):
+            return evaluation
+        moments = score_moments(tokens, self.score_range)
+        if moments is None or len(moments[0]) != len(evaluation["score"]):
+            return evaluation
+        evaluation["score"], evaluation["score_var"] = moments
+        return evaluation
+
+    def _init_pass_control(self, adaptive_pass, min_pass, pass_std_threshold):
+        self.adaptive_pass = adaptive_pass
+        self.min_pass = min(max(min_pass, 1), self.num_pass)
+        self.pass_std_threshold = pass_std_threshold
+        self._pass_lock = threading.Lock()
+        self._pass_counts = {"num_samples": 0, "num_passes": 0}
+
+    def _first_passes(self):
+        return range(self.min_pass if self.adaptive_pass else self.num_pass)
+
+    def _pass_overall(self, SC_dict, PQ_dict):
+        SC_score = min(SC_dict['score']) / (self.score_range / 10)
+        PQ_score = min(PQ_dict['score']) / (self.score_range / 10)
+        return math.sqrt(SC_score * PQ_score)
+
+    def _needs_more_passes(self, SC_dicts, PQ_dicts):
+        if not self.adaptive_pass or len(SC_dicts) >= self.num_pass:
+            return False
+        try:
+            overall = [self._pass_overall(SC_dict, PQ_dict) for SC_dict, PQ_dict in zip(SC_dicts, PQ_dicts)]
+        except (TypeError, KeyError, ValueError):
+            # unusable output (e.g. rate limit), let _reduce_passes report it
+            return False
+        return np.std(overall) > self.pass_std_threshold
+
+    def _record_passes(self, num_passes):
+        with self._pass_lock:
+            self._pass_counts["num_samples"] += 1
+            self._pass_counts["num_passes"] += num_passes
+
+    def pass_stats(self):
+        """Number of scored samples and passes run, and the mean passes per sample."""
+        with self._pass_lock:
+            counts = dict(self._pass_counts)
+        counts["mean_passes"] = counts["num_passes"] / counts["num_samples"] if counts["num_samples"] else 0.0
+        return counts
+
+    def _sequential_inference(self, SC_prompt_final, PQ_prompt_final, text_prompt, passes, lora=None):
+        SC_dicts, PQ_dicts = [], []
+        for i in passes:
+            SC_dict = False
+            PQ_dict = False
+            tries = 0
+            max_tries = 2
+            while SC_dict is False or PQ_dict is False:
+                tries += 1
+                give_up_parsing = True if tries > max_tries else False
+
+                result_SC = self.model.inference(SC_prompt_final, seed=self.seed + i, **self._lora_kwargs(lora))
+                result_PQ = self.model.inference(PQ_prompt_final, seed=self.seed + i, **self._lora_kwargs(lora))
+
+                if result_SC in REFUSAL_RESPONSES or result_PQ in REFUSAL_RESPONSES:
+                    give_up_parsing = True
+
+                SC_dict = self._parse_output(result_SC, give_up_parsing, text_prompt)
+                PQ_dict = self._parse_output(result_PQ, give_up_parsing, text_prompt)
+            SC_dicts.append(SC_dict)
+            PQ_dicts.append(PQ_dict)
+        return SC_dicts, PQ_dicts
+
+    def _fused_inference(self, SC_prompt_final, PQ_prompt_final, text_prompt, passes, lora=None):
+        """
+        Submit the SC and PQ prompts of the given passes in one `batch_inference` call,
+        each pass keeping its own seed, and re-issue only the unparsable outputs.
+        """
+        passes = list(passes)
+        prompts = [SC_prompt_final] * len(passes) + [PQ_prompt_final] * len(passes)
+        seeds = [self.seed + i for i in passes] * 2
+
+        dicts = [False] * len(prompts)
+        pending = list(range(len(prompts)))
+        tries = 0
+        max_tries = 2
+        while pending:
+            tries += 1
+            give_up_parsing = True if tries > max_tries else False
+
+            results, tokens = self._batch_generate([prompts[j] for j in pending], seed=[seeds[j] for j in pending], lora=lora)
+            for j, result, _tokens in zip(pending, results, tokens):
+                dicts[j] = self._apply_score_moments(self._parse_output(result, give_up_parsing, text_prompt), _tokens)
+            pending = [j for j in pending if dicts[j] is False]
+        return dicts[:len(passes)], dicts[len(passes):]
+
+    def _prepare_prompts(self, image_prompts, text_prompt):
         if not isinstance(image_prompts, list):
             image_prompts = [image_prompts]
 
@@ -100,27 +352,44 @@ class EditScore:
         
         SC_prompt_final = self.model.prepare_input(image_prompts, _SC_prompt)
         PQ_prompt_final = self.model.prepare_input(image_prompts[-1], self.PQ_prompt) # assume the last image is the edited image
+        return SC_prompt_final, PQ_prompt_final
 
-        outputs_multi_pass = []
+    def _run_passes(self, SC_prompt_final, PQ_prompt_final, text_prompt, passes, lora=None):
+        if hasattr(self.model, "batch_inference"):
+            return self._fused_inference(SC_prompt_final, PQ_prompt_final, text_prompt, passes, lora)
+        return self._sequential_inference(SC_prompt_final, PQ_prompt_final, text_prompt, passes, lora)
 
-        for i in range(self.num_pass):
-            SC_dict = False
-            PQ_dict = False
-            tries = 0
-            max_tries = 2
-            while SC_dict is False or PQ_dict is False:
-                tries += 1
-                give_up_parsing = True if tries > max_tries else False
+    def evaluate(self, image_prompts, text_prompt, lora=None):
+        """
+        Score one edit. `lora` names the LoRA adapter of a vLLM backbone to score with,
+        the default adapter when None.
+        """
+        SC_prompt_final, PQ_prompt_final = self._prepare_prompts(image_prompts, text_prompt)
 
-                result_SC = self.model.inference(SC_prompt_final, seed=self.seed + i)
-                result_PQ = self.model.inference(PQ_prompt_final, seed=self.seed + i)
+        if self.score_only:
+            output = self._score_only_outputs([SC_prompt_final], [PQ_prompt_final], lora)[0]
+            return {
+                "prompt_following": output["SC_scores"][0],
+                "consistency": output["SC_scores"][1],
+                "perceptual_quality": output["PQ_score"],
+                "overall": output["O_score"],
+                "SC_reasoning": "",
+                "PQ_reasoning": "",
+                "num_pass_used": 1,
+            }
 
-                if result_SC in ["I'm sorry, but I can't assist with that request."] or result_PQ in ["I'm sorry, but I can't assist with that request."]:
-                    give_up_parsing = True
-                    
-                SC_dict = mllm_output_to_dict(result_SC, give_up_parsing=give_up_parsing, text_prompt=text_prompt, score_range=self.score_range)
-                PQ_dict = mllm_output_to_dict(result_PQ, give_up_parsing=give_up_parsing, text_prompt=text_prompt, score_range=self.score_range)
+        SC_dicts, PQ_dicts = self._run_passes(SC_prompt_final, PQ_prompt_final, text_prompt, self._first_passes(), lora)
+        while self._needs_more_passes(SC_dicts, PQ_dicts):
+            SC_dict, PQ_dict = self._run_passes(SC_prompt_final, PQ_prompt_final, text_prompt, [len(SC_dicts)], lora)
+            SC_dicts += SC_dict
+            PQ_dicts += PQ_dict
+        self._record_passes(len(SC_dicts))
+        return self._reduce_passes(SC_dicts, PQ_dicts)
 
+    def _reduce_passes(self, SC_dicts, PQ_dicts):
+        outputs_multi_pass = []
+
+        for SC_dict, PQ_dict in zip(SC_dicts, PQ_dicts):
             if SC_dict == "rate_limit_exceeded" or PQ_dict == "rate_limit_exceeded":
                 print("rate_limit_exceeded") 
                 raise ValueError("rate_limit_exceeded")
@@ -149,28 +418,155 @@ class EditScore:
                     "consistency": np.mean([output_per_pass["consistency"] for output_per_pass in outputs_multi_pass]),
                     "perceptual_quality": np.mean([output_per_pass["perceptual_quality"] for output_per_pass in outputs_multi_pass]),
                     "overall": np.mean([output_per_pass["overall"] for output_per_pass in outputs_multi_pass]),
-                    "SC_reasoning": SC_dict["reasoning"],
-                    "PQ_reasoning": PQ_dict["reasoning"],
+                    "SC_reasoning": SC_dicts[-1]["reasoning"],
+                    "PQ_reasoning": PQ_dicts[-1]["reasoning"],
+                    "num_pass_used": len(outputs_multi_pass),
                 }
+        if all("score_var" in SC_dict and "score_var" in PQ_dict for SC_dict, PQ_dict in zip(SC_dicts, PQ_dicts)):
+            scale = (10 / self.score_range) ** 2
+            output["prompt_following_var"] = np.mean([SC_dict["score_var"][0] for SC_dict in SC_dicts]) * scale
+            output["consistency_var"] = np.mean([SC_dict["score_var"][1] for SC_dict in SC_dicts]) * scale
+            output["perceptual_quality_var"] = np.mean(
+                [PQ_dict["score_var"][int(np.argmin(PQ_dict["score"]))] for PQ_dict in PQ_dicts]
+            ) * scale
         if self.reduction == "average_first":
             output["overall"] = math.sqrt(output["prompt_following"] * output["perceptual_quality"])
         return output
 
 
-    def batch_evaluate(self, image_prompts, text_prompt):
-        SC_prompt = [self.SC_prompt.replace("<instruction>", _text_prompt) for _text_prompt in text_prompt]
+    def _prefix_groups(self, image_prompts):
+        """
+        Group sample indices by source image. SC prompts of a group share the chat header and
+        the source image tokens, so scheduling them together lets the backend reuse that prefix.
+        """
+        groups = defaultdict(list)
+        for idx, image_prompt in enumerate(image_prompts):
+            if isinstance(image_prompt, list) and len(image_prompt) > 1 and isinstance(image_prompt[0], Image.Image):
+                groups[image_hash(image_prompt[0])].append(idx)
+            else:
+                groups[idx].append(idx)
+        return list(groups.values())
 
-        SC_prompt = [self.model.prepare_input(image_prompt, _SC_prompt) for image_prompt, _SC_prompt in zip(image_prompts, SC_prompt)]
-        PQ_prompt = [self.model.prepare_input(image_prompt, self.PQ_prompt) for image_prompt in image_prompts]
+    def prefix_cache_stats(self):
+        """Prompt / cached token counters and prefix-hit rate of the backend, if it reports them."""
+        if not hasattr(self.model, "prefix_stats"):
+            return {}
+        return {**self.model.prefix_stats, "prefix_hit_rate": self.model.prefix_hit_rate()}
+
+    def vision_cache_stats(self):
+        """Counters of the backend's vision-embedding cache, if enabled."""
+        if getattr(self.model, "vision_cache", None) is None:
+            return {}
+        return self.model.vision_cache.stats()
+
+    def image_cache_stats(self):
+        """Hit / miss / eviction counters of the backend's image preprocessing cache, if it has one."""
+        if not hasattr(self.model, "image_cache"):
+            return {}
+        return self.model.image_cache.stats()
 
-        outputs_multi_pass = [[] for _ in range(len(image_prompts))]
+    def _score_distributions(self, messages, prefills, lora=None):
+        """
+        Distribution over the integer scores 0..`score_range` of the number following each
+        prefill. Numbers are read token by token: every digit string still holding at least
+        `min_score_mass` probability is extended by the digit tokens the model predicts next,
+        and keeps the mass it puts on anything else as the probability of ending there.
+        """
+        max_digits = len(str(self.score_range))
+        distributions = np.zeros((len(messages), self.score_range + 1))
+        frontier = [(idx, "", 1.0) for idx in range(len(messages))]
+        while frontier:
+            next_token_probs = self.model.next_token_logprobs(
+                [messages[idx] for idx, _, _ in frontier], [prefills[idx] + digits for idx, digits, _ in frontier],
+                **self._lora_kwargs(lora),
+            )
+            next_frontier = []
+            for (idx, digits, mass), token_probs in zip(frontier, next_token_probs):
+                digit_mass = 0.0
+                for token, prob in token_probs.items():
+                    if not token or not token.isdigit():
+                        continue
+                    digit_mass += prob
+                    number = digits + token
+                    if len(number) > max_digits or (len(number) > 1 and number[0] == "0") or int(number) > self.score_range:
+                        continue
+                    if len(number) == max_digits:
+                        distributions[idx, int(number)] += mass * prob
+                    elif mass * prob >= self.min_score_mass:
+                        next_frontier.append((idx, number, mass * prob))
+                if digits:
+                    distributions[idx, int(digits)] += mass * max(1.0 - digit_mass, 0.0)
+            frontier = next_frontier
+
+        totals = distributions.sum(axis=1, keepdims=True)
+        # no score in reach of the model: fall back to a uniform distribution
+        return np.where(totals > 0, distributions / np.maximum(totals, 1e-12), 1.0 / (self.score_range + 1))
+
+    def _score_only_outputs(self, SC_prompt, PQ_prompt, lora=None):
+        """
+        Expected SC and PQ scores of each sample without generating reasoning. The two scores
+        of a prompt are read one after the other, the second one following the most likely
+        value of the first.
+        """
+        messages = list(SC_prompt) + list(PQ_prompt)
+        prefills = [SCORE_ONLY_PREFILL] * len(messages)
+        values = np.arange(self.score_range + 1) / (self.score_range / 10)
+        expected = [[] for _ in messages]
+        for position in range(NUM_SCORES):
+            distributions = self._score_distributions(messages, prefills, lora)
+            for idx, distribution in enumerate(distributions):
+                expected[idx].append(float(distribution @ values))
+                prefills[idx] += f"{int(np.argmax(distribution))}" + (", " if position < NUM_SCORES - 1 else "]")
+
+        outputs = []
+        num_samples = len(SC_prompt)
+        for idx in range(num_samples):
+            SC_scores, PQ_scores = expected[idx], expected[num_samples + idx]
+            SC_score = min(SC_scores)
+            PQ_score = min(PQ_scores)
+            outputs.append(
+                {
+                    "SC_scores": SC_scores,
+                    "PQ_scores": PQ_scores,
+                    "SC_score": SC_score,
+                    "PQ_score": PQ_score,
+                    "O_score": math.sqrt(SC_score * PQ_score),
+                    "SC_raw_output": prefills[idx] + "\n}",
+                    "PQ_raw_output": prefills[num_samples + idx] + "\n}",
+                }
+            )
+            self._record_passes(1)
+        return outputs
+
+    def _multi_pass_outputs(self, SC_prompt, PQ_prompt, lora=None):
+        outputs_multi_pass = [[] for _ in range(len(SC_prompt))]
         for i in range(self.num_pass):
-            results = self.model.batch_inference(SC_prompt + PQ_prompt, seed=self.seed + i)
+            # with adaptive_pass, passes beyond min_pass only re-run the samples whose
+            # per-pass overall scores still disagree
+            active = [
+                idx for idx, outputs_per_prompt in enumerate(outputs_multi_pass)
+                if i < self.min_pass or not self.adaptive_pass
+                or np.std([output_per_pass["O_score"] for output_per_pass in outputs_per_prompt]) > self.pass_std_threshold
+            ]
+            if not active:
+                break
+            results, tokens = self._batch_generate(
+                [SC_prompt[idx] for idx in active] + [PQ_prompt[idx] for idx in active], seed=self.seed + i, lora=lora
+            )
 
-            SC_evaluations = [parse_vlm_output_to_dict(results[i]) for i in range(len(results) // 2)]
-            PQ_evaluations = [parse_vlm_output_to_dict(results[i]) for i in range(len(results) // 2, len(results))]
+            evaluations = [
+                self._apply_score_moments(
+                    (self.guided_decoding and self._parse_guided_output(result))
+                    or parse_score_output(result, self.score_range, NUM_SCORES)
+                    or parse_vlm_output_to_dict(result),
+                    _tokens,
+                )
+                for result, _tokens in zip(results, tokens)
+            ]
+            SC_evaluations = evaluations[:len(results) // 2]
+            PQ_evaluations = evaluations[len(results) // 2:]
 
-            for idx, (SC_evaluation, PQ_evaluation) in enumerate(zip(SC_evaluations, PQ_evaluations)):
+            for j, (idx, SC_evaluation, PQ_evaluation) in enumerate(zip(active, SC_evaluations, PQ_evaluations)):
                 SC_scores = SC_evaluation["score"]
                 PQ_scores = PQ_evaluation["score"]
 
@@ -194,10 +590,14 @@ class EditScore:
                         "O_score": O_score,
                         "SC_score_reasoning": SC_evaluation["reasoning"],
                         "PQ_score_reasoning": PQ_evaluation["reasoning"],
-                        "SC_raw_output": results[idx],
-                        "PQ_raw_output": results[len(results) // 2 + idx],
+                        "SC_raw_output": results[j],
+                        "PQ_raw_output": results[len(results) // 2 + j],
                     }
                 )
+                if "score_var" in SC_evaluation and "score_var" in PQ_evaluation:
+                    scale = (10 / self.score_range) ** 2
+                    outputs_multi_pass[idx][-1]["SC_score_var"] = SC_evaluation["score_var"][int(np.argmin(SC_scores))] * scale
+                    outputs_multi_pass[idx][-1]["PQ_score_var"] = PQ_evaluation["score_var"][int(np.argmin(PQ_scores))] * scale
         
         outputs = []
         for idx, outputs_per_prompt in enumerate(outputs_multi_pass):
@@ -210,8 +610,58 @@ class EditScore:
                     "PQ_score_reasoning": outputs_per_prompt[0]["PQ_score_reasoning"],
                     "SC_raw_output": outputs_per_prompt[0]["SC_raw_output"],
                     "PQ_raw_output": outputs_per_prompt[0]["PQ_raw_output"],
+                    "num_pass_used": len(outputs_per_prompt),
                 }
             )
+            if all("SC_score_var" in output_per_pass for output_per_pass in outputs_per_prompt):
+                outputs[-1]["SC_score_var"] = np.mean([output_per_pass["SC_score_var"] for output_per_pass in outputs_per_prompt])
+                outputs[-1]["PQ_score_var"] = np.mean([output_per_pass["PQ_score_var"] for output_per_pass in outputs_per_prompt])
+            self._record_passes(len(outputs_per_prompt))
             if self.reduction == "average_first":
                 outputs[-1]["O_score"] = math.sqrt(outputs[-1]["SC_score"] * outputs[-1]["PQ_score"])
-        return outputs
\ No newline at end of file
+        return outputs
+
+    def batch_evaluate(self, image_prompts, text_prompt, lora=None):
+        """Score a batch of edits, with the LoRA adapter named by `lora` as in `evaluate`."""
+        groups = self._prefix_groups(image_prompts)
+        order = [idx for group in groups for idx in group]
+        image_prompts = [image_prompts[idx] for idx in order]
+        text_prompt = [text_prompt[idx] for idx in order]
+
+        SC_prompt = [self.SC_prompt.replace("<instruction>", _text_prompt) for _text_prompt in text_prompt]
+
+        SC_prompt = [self.model.prepare_input(image_prompt, _SC_prompt) for image_prompt, _SC_prompt in zip(image_prompts, SC_prompt)]
+        PQ_prompt = [self.model.prepare_input(image_prompt, self.PQ_prompt) for image_prompt in image_prompts]
+
+        if hasattr(self.model, "warm_prefix"):
+            group_starts = np.cumsum([0] + [len(group) for group in groups[:-1]])
+            shared_prefix_prompts = [SC_prompt[start] for start, group in zip(group_starts, groups) if len(group) > 1]
+            if shared_prefix_prompts:
+                self.model.warm_prefix(shared_prefix_prompts, **self._lora_kwargs(lora))
+
+        if self.score_only:
+            outputs = []
+            for output in self._score_only_outputs(SC_prompt, PQ_prompt, lora):
+                outputs.append(
+                    {
+                        "SC_score": output["SC_score"],
+                        "PQ_score": output["PQ_score"],
+                        "O_score": output["O_score"],
+                        "SC_score_reasoning": "",
+                        "PQ_score_reasoning": "",
+                        "SC_raw_output": output["SC_raw_output"],
+                        "PQ_raw_output": output["PQ_raw_output"],
+                        "num_pass_used": 1,
+                    }
+                )
+        else:
+            outputs = self._multi_pass_outputs(SC_prompt, PQ_prompt, lora)
+
+        # restore the caller's sample order
+        reordered_outputs = [None] * len(outputs)
+        for output, idx in zip(outputs, order):
+            reordered_outputs[idx] = output
+        return reordered_outputs
+
+
+from .async_editscore import AsyncEditScore
@@ -0,0 +1,120 @@
+import asyncio
+from typing import Dict, Optional, Union
+
+from . import EditScore
+
+
+class AsyncEditScore(EditScore):
+    """
+    asyncio counterpart of `EditScore`.
+
+    `await scorer.evaluate(...)` submits the SC and PQ prompts of every pass to an async
+    engine without blocking, so concurrent callers are coalesced by the engine's continuous
+    batching instead of serializing on a blocking `LLM.generate`. `await scorer.batch_evaluate(...)`
+    gathers `evaluate` over a batch of samples.
+
+    Args:
+        engine: Optional pre-built async engine (e.g. `FakeAsyncEngine` for CPU tests). It must
+            provide `prepare_input(images, text_prompt)` and `async inference(messages, seed)`.
+            When omitted, the async vLLM backend matching `backbone` is created.
+    """
+    def __init__(
+        self,
+        backbone="qwen3vl_vllm",
+        model_name_or_path="",
+        score_range: int=25,
+        temperature: float=0.7,
+        tensor_parallel_size: int=1,
+        max_model_len: int=1536,
+        max_num_batched_tokens: int=1536,
+        max_num_seqs: int=32,
+        num_pass: int=1,
+        reduction: str="average_last",
+        seed: int=42,
+        lora_path: Optional[Union[str, Dict[str, str]]]=None,
+        cache_dir: Optional[str]=None,
+        image_cache_bytes: int=1 << 30,
+        engine=None,
+        adaptive_pass: bool=False,
+        min_pass: int=2,
+        pass_std_threshold: float=0.5,
+        guided_decoding: bool=False,
+        max_reasoning_chars: int=1024,
+        merge_lora: bool=False,
+    ) -> None:
+        json_schema = self._init_scoring(
+            backbone, score_range, reduction, seed, num_pass,
+            adaptive_pass, min_pass, pass_std_threshold, guided_decoding, max_reasoning_chars,
+        )
+
+        if engine is not None:
+            self.model = engine
+        elif self.backbone in ("qwen25vl_vllm", "qwen3vl_vllm"):
+            if self.backbone == "qwen25vl_vllm":
+                from .mllm_tools.qwen25vl_vllm import AsyncQwen25VL as model_class
+            else:
+                from .mllm_tools.qwen3vl_vllm import AsyncQwen3VL as model_class
+            self.model = self._vllm_model(
+                model_class,
+                model_name_or_path=model_name_or_path,
+                tensor_parallel_size=tensor_parallel_size,
+                max_model_len=max_model_len,
+                max_num_batched_tokens=max_num_batched_tokens,
+                max_num_seqs=max_num_seqs,
+                temperature=temperature,
+                seed=seed,
+                lora_path=lora_path,
+                cache_dir=cache_dir,
+                image_cache_bytes=image_cache_bytes,
+                json_schema=json_schema,
+                merge_lora=merge_lora,
+            )
+        else:
+            raise ValueError(f"AsyncEditScore does not support backbone {self.backbone}, use qwen25vl_vllm or qwen3vl_vllm")
+
+        # the logprob-based modes need the synchronous backends
+        self._init_score_modes(score_only=False, score_expectation=False, score_top_k=0)
+
+    async def _async_inference(self, SC_prompt_final, PQ_prompt_final, text_prompt, passes, lora=None):
+        passes = list(passes)
+        prompts = [SC_prompt_final] * len(passes) + [PQ_prompt_final] * len(passes)
+        seeds = [self.seed + i for i in passes] * 2
+
+        dicts = [False] * len(prompts)
+        pending = list(range(len(prompts)))
+        tries = 0
+        max_tries = 2
+        while pending:
+            tries += 1
+            give_up_parsing = True if tries > max_tries else False
+
+            results = await asyncio.gather(
+                *[self.model.inference(prompts[j], seed=seeds[j], **self._lora_kwargs(lora)) for j in pending]
+            )
+            for j, result in zip(pending, results):
+                dicts[j] = self._parse_output(result, give_up_parsing, text_prompt)
+            pending = [j for j in pending if dicts[j] is False]
+        return dicts[:len(passes)], dicts[len(passes):]
+
+    async def batch_evaluate(self, image_prompts, text_prompt, lora=None):
+        """
+        `evaluate` every sample concurrently and return its results in input order, the
+        engine batches the prompts of all samples together.
+        """
+        return await asyncio.gather(
+            *[self.evaluate(_image_prompts, _text_prompt, lora=lora) for _image_prompts, _text_prompt in zip(image_prompts, text_prompt)]
+        )
+
+    async def evaluate(self, image_prompts, text_prompt, lora=None):
+        # image preprocessing is CPU bound, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        SC_prompt_final, PQ_prompt_final = await loop.run_in_executor(
+            None, self._prepare_prompts, image_prompts, text_prompt
+        )
+        SC_dicts, PQ_dicts = await self._async_inference(SC_prompt_final, PQ_prompt_final, text_prompt, self._first_passes(), lora)
+        while self._needs_more_passes(SC_dicts, PQ_dicts):
+            SC_dict, PQ_dict = await self._async_inference(SC_prompt_final, PQ_prompt_final, text_prompt, [len(SC_dicts)], lora)
+            SC_dicts += SC_dict
+            PQ_dicts += PQ_dict
+        self._record_passes(len(SC_dicts))
+        return self._reduce_passes(SC_dicts, PQ_dicts)
@@ -0,0 +1,93 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def score_token_spans(tokens: List[Tuple[str, Dict[str, float]]]) -> List[List[int]]:
+    """
+    Positions of the digit tokens of every number in the `"score" : [...]` list of a generated
+    output. `tokens` holds, per generated token, its text and the top-k `{token text: probability}`
+    at that position. Returns one list of token positions per number, in list order.
+    """
+    offsets = []
+    text = ""
+    for token, _ in tokens:
+        offsets.append(len(text))
+        text += token
+
+    key_start = text.rfind("score")
+    if key_start < 0:
+        return []
+    list_start = text.find("[", key_start)
+    if list_start < 0:
+        return []
+    list_end = text.find("]", list_start)
+    if list_end < 0:
+        list_end = len(text)
+
+    spans = []
+    previous = None
+    for idx, ((token, _), offset) in enumerate(zip(tokens, offsets)):
+        if offset <= list_start or offset >= list_end or not token.isdigit():
+            continue
+        if previous is not None and previous == idx - 1:
+            spans[-1].append(idx)
+        else:
+            spans.append([idx])
+        previous = idx
+    return spans
+
+
+def number_distribution(digit_probs: List[Dict[str, float]], score_range: int) -> Optional[np.ndarray]:
+    """
+    Distribution over the integers 0..`score_range` of a number generated one digit per token.
+
+    `digit_probs[k]` is the top-k distribution at the k-th digit of the sampled number, followed
+    by the distribution at the position after its last digit when it was generated. Only the
+    sampled path is known, so every alternative prefix is assumed to continue like the sampled
+    one: P(12) = P(1 first) * P(2 second | sampled first digit). Returns None when no valid
+    number has any probability.
+    """
+    max_digits = len(str(score_range))
+    distribution = np.zeros(score_range + 1)
+    frontier = {"": 1.0}
+    for k in range(max_digits + 1):
+        probs = digit_probs[k] if k < len(digit_probs) and k < max_digits else dict()
+        digits = {token: prob for token, prob in probs.items() if len(token) == 1 and token.isdigit()}
+        continue_mass = sum(digits.values())
+
+        next_frontier = dict()
+        for prefix, mass in frontier.items():
+            if prefix:
+                distribution[int(prefix)] += mass * max(1.0 - continue_mass, 0.0)
+            for token, prob in digits.items():
+                number = prefix + token
+                if (len(number) > 1 and number[0] == "0") or int(number) > score_range:
+                    continue
+                next_frontier[number] = next_frontier.get(number, 0.0) + mass * prob
+        frontier = next_frontier
+
+    total = distribution.sum()
+    if total <= 0:
+        return None
+    return distribution / total
+
+
+def score_moments(tokens: List[Tuple[str, Dict[str, float]]], score_range: int) -> Optional[Tuple[List[float], List[float]]]:
+    """
+    Expectation and variance, in 0..`score_range` units, of every score of a generated output,
+    or None when the score list cannot be located in the tokens.
+    """
+    values = np.arange(score_range + 1)
+    means, variances = [], []
+    for span in score_token_spans(tokens):
+        positions = span + [span[-1] + 1] if span[-1] + 1 < len(tokens) else span
+        distribution = number_distribution([tokens[idx][1] for idx in positions], score_range)
+        if distribution is None:
+            return None
+        mean = float(distribution @ values)
+        means.append(mean)
+        variances.append(float(distribution @ (values - mean) ** 2))
+    if not means:
+        return None
+    return means, variances
@@ -0,0 +1,109 @@
+from typing import Any, Callable, Hashable, List, Optional
+import os
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import torch
+
+from .utils import ProcessedImageCache
+
+
+def _to_device(value, device):
+    if isinstance(value, torch.Tensor):
+        return value.to(device)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_device(v, device) for v in value)
+    return value
+
+
+def _concat(outputs: List[Any]):
+    """Concatenate per-image vision tower outputs: a tensor, or (nested) tuples/lists of tensors."""
+    first = outputs[0]
+    if isinstance(first, torch.Tensor):
+        return torch.cat(outputs, dim=0)
+    return type(first)(_concat([output[i] for output in outputs]) for i in range(len(first)))
+
+
+class VisionEmbeddingCache:
+    """
+    Cache of vision tower outputs keyed by image content hash, with an in-memory LRU and an
+    optional on-disk store that is memory-mapped on load.
+
+    `wrap(visual)` patches a Qwen-VL vision tower so that, while image keys are bound with
+    `bind(keys)`, each image's embeddings are looked up in the cache and the ViT only runs on
+    misses. Images are encoded independently by the tower (per-image attention windows), so
+    encoding them one at a time gives the same result as the batched call.
+
+    Args:
+        max_bytes: Upper bound of the in-memory LRU.
+        cache_dir: Optional directory for the on-disk store, shared across processes and runs.
+        namespace: Prefix of every key, identifying the model (and LoRA) that produced the embeddings.
+    """
+    def __init__(self, max_bytes: int = 1 << 29, cache_dir: Optional[str] = None, namespace: str = "") -> None:
+        self.memory = ProcessedImageCache(max_bytes)
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self.disk_hits = 0
+        self._local = threading.local()
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @contextmanager
+    def bind(self, keys: Optional[List[Hashable]]):
+        """Bind the keys of the images encoded by the wrapped tower during this block, in order."""
+        self._local.keys = keys
+        try:
+            yield
+        finally:
+            self._local.keys = None
+
+    def _path(self, key: Hashable) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        # keys are content hashes in the Qwen backends, hash them again so that any key is a flat file name
+        key_hash = hashlib.blake2b(str(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, f"{self.namespace}_{key_hash}.pt")
+
+    def get_or_compute(self, key: Hashable, compute_fn: Callable[[], Any], device) -> Any:
+        def load_or_compute():
+            path = self._path(key)
+            if path is not None and os.path.exists(path):
+                self.disk_hits += 1
+                return _to_device(torch.load(path, map_location="cpu", mmap=True), device)
+
+            value = compute_fn()
+            if path is not None:
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                torch.save(_to_device(value, "cpu"), tmp_path)
+                os.replace(tmp_path, path)
+            return value
+
+        return self.memory.get_or_compute(f"{self.namespace}_{key}", load_or_compute)
+
+    def wrap(self, visual: torch.nn.Module) -> torch.nn.Module:
+        original_forward = visual.forward
+
+        def forward(hidden_states, grid_thw, **kwargs):
+            keys = getattr(self._local, "keys", None)
+            if keys is None or len(keys) != len(grid_thw):
+                return original_forward(hidden_states, grid_thw=grid_thw, **kwargs)
+
+            patches_per_image = grid_thw.prod(-1).tolist()
+            outputs = []
+            for key, pixels, image_grid_thw in zip(keys, hidden_states.split(patches_per_image), grid_thw):
+                outputs.append(
+                    self.get_or_compute(
+                        key,
+                        lambda: original_forward(pixels, grid_thw=image_grid_thw[None], **kwargs),
+                        device=hidden_states.device,
+                    )
+                )
+            return _concat(outputs)
+
+        visual.forward = forward
+        return visual
+
+    def stats(self):
+        return {**self.memory.stats(), "disk_hits": self.disk_hits}
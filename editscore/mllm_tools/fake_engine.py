@@ -0,0 +1,69 @@
+from typing import Callable, List, Optional, Union
+import asyncio
+import json
+import random
+
+
+class FakeAsyncEngine():
+    """
+    CPU-only stand-in for the async vLLM backends, used to exercise `AsyncEditScore`
+    without a GPU. It mimics continuous batching: requests that arrive while a step
+    is running join the next step, up to `max_num_seqs` requests per step.
+
+    Args:
+        response_fn: Maps (prepared input, seed) to the raw model output. Defaults to a
+            well-formed JSON answer with random scores drawn from the seed.
+        step_latency: Simulated duration of one engine step in seconds.
+        max_num_seqs: Maximum number of requests served by one step.
+        score_range: Upper bound of the scores produced by the default `response_fn`.
+    """
+    def __init__(
+        self,
+        response_fn: Optional[Callable[[dict, Optional[int]], str]] = None,
+        step_latency: float = 0.01,
+        max_num_seqs: int = 32,
+        score_range: int = 25,
+    ) -> None:
+        self.response_fn = response_fn or self._default_response
+        self.step_latency = step_latency
+        self.max_num_seqs = max_num_seqs
+        self.score_range = score_range
+
+        self.batch_sizes: List[int] = []
+        self._waiting = None
+        self._step_task = None
+
+    def _default_response(self, messages, seed: Optional[int] = None) -> str:
+        rng = random.Random(seed)
+        scores = [rng.randint(0, self.score_range), rng.randint(0, self.score_range)]
+        return json.dumps({"reasoning": "fake engine output", "score": scores})
+
+    def prepare_input(self, images, text_prompt: str = ""):
+        if not isinstance(images, list):
+            images = [images]
+        return {"prompt": text_prompt, "multi_modal_data": {"image": images}}
+
+    async def _step_loop(self):
+        while not self._waiting.empty():
+            batch = []
+            while not self._waiting.empty() and len(batch) < self.max_num_seqs:
+                batch.append(self._waiting.get_nowait())
+            await asyncio.sleep(self.step_latency)
+            self.batch_sizes.append(len(batch))
+            for messages, seed, future in batch:
+                if not future.done():
+                    future.set_result(self.response_fn(messages, seed))
+        self._step_task = None
+
+    async def inference(self, messages, seed: Optional[int] = None):
+        if self._waiting is None:
+            self._waiting = asyncio.Queue()
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.put_nowait((messages, seed, future))
+        if self._step_task is None:
+            self._step_task = asyncio.ensure_future(self._step_loop())
+        return await future
+
+    async def batch_inference(self, messages, seed: Optional[Union[int, List[int]]] = None):
+        seeds = seed if isinstance(seed, list) else [seed] * len(messages)
+        return await asyncio.gather(*[self.inference(_messages, seed=_seed) for _messages, _seed in zip(messages, seeds)])
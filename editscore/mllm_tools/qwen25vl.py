@@ -1,11 +1,17 @@
 from typing import Optional
+import hashlib
 import random
+from contextlib import nullcontext
 import numpy as np
 import torch
 
 from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
 from qwen_vl_utils import process_vision_info
 from peft import PeftModel
+from PIL import Image
+
+from .utils import ProcessedImageCache, image_hash, load_image
+from .embedding_cache import VisionEmbeddingCache
 
 
 def set_seed(seed: int):
@@ -37,6 +43,9 @@ class Qwen25VL():
         temperature: float = 0.7,
         seed: Optional[int] = None,
         lora_path: Optional[str] = None,
+        image_cache_bytes: int = 1 << 30,
+        vision_cache_bytes: int = 0,
+        vision_cache_dir: Optional[str] = None,
     ) -> None:
         self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
             vlm_model, torch_dtype=torch.bfloat16, device_map="auto"
@@ -48,29 +57,38 @@ class Qwen25VL():
         self.processor = AutoProcessor.from_pretrained(vlm_model)
         self.temperature = temperature
         self.seed = seed
+        self.image_cache = ProcessedImageCache(image_cache_bytes)
+
+        self.vision_cache = None
+        if vision_cache_bytes > 0 or vision_cache_dir is not None:
+            namespace = hashlib.md5(f"{vlm_model}|{lora_path}".encode()).hexdigest()[:8]
+            self.vision_cache = VisionEmbeddingCache(vision_cache_bytes, cache_dir=vision_cache_dir, namespace=namespace)
+            self.vision_cache.wrap(self.model.visual)
     
+    def _process_image(self, image, key):
+        """`process_vision_info` for a single image, cached by image content."""
+        return self.image_cache.get_or_compute(
+            key, lambda: process_vision_info([{"role": "user", "content": [{"type": "image", "image": image}]}])[0][0]
+        )
+
     def prepare_input(self, images, text_prompt: str = ""):
         if not isinstance(images, list):
             images = [images]
+        # key by content, a path is loaded first so that a file overwritten in place is not served stale
+        images = [image if isinstance(image, Image.Image) else load_image(image) for image in images]
+        image_keys = [image_hash(image) for image in images]
 
-        messages = [
-            {
-                "role": "user",
-                "content": [{"type": "image", "image": image} for image in images]
-                + [{"type": "text", "text": text_prompt}],
-            }
-        ]
         text = apply_chat_template(text_prompt, num_images=len(images))
-        image_inputs, video_inputs = process_vision_info(messages)
+        image_inputs = [self._process_image(image, key) for image, key in zip(images, image_keys)]
 
         inputs = self.processor(
             text=[text],
             images=image_inputs,
-            videos=video_inputs,
             padding=True,
             return_tensors="pt",
         )
         inputs = inputs.to("cuda")
+        inputs.image_keys = image_keys
 
         return inputs
 
@@ -78,14 +96,16 @@ class Qwen25VL():
         seed = self.seed if seed is None else seed
 
         set_seed(seed)
-        generated_ids = self.model.generate(
-            **inputs,
-            max_new_tokens=512,
-            do_sample=True,
-            temperature=self.temperature,
-            top_p=0.9,
-            top_k=20,
-        )
+        vision_cache_context = self.vision_cache.bind(inputs.image_keys) if self.vision_cache is not None else nullcontext()
+        with vision_cache_context:
+            generated_ids = self.model.generate(
+                **inputs,
+                max_new_tokens=512,
+                do_sample=True,
+                temperature=self.temperature,
+                top_p=0.9,
+                top_k=20,
+            )
         generated_ids_trimmed = [
             out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
         ]
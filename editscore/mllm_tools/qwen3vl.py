@@ -1,10 +1,17 @@
 from typing import Optional
+import hashlib
 import random
+from contextlib import nullcontext
 import numpy as np
 import torch
 
 from transformers import Qwen3VLForConditionalGeneration, AutoProcessor
+from transformers.image_utils import load_image
 from peft import PeftModel
+from PIL import Image
+
+from .utils import ProcessedImageCache, image_hash
+from .embedding_cache import VisionEmbeddingCache
 
 
 def set_seed(seed: int):
@@ -36,6 +43,9 @@ class Qwen3VL():
         temperature: float = 0.7,
         seed: Optional[int] = None,
         lora_path: Optional[str] = None,
+        image_cache_bytes: int = 1 << 30,
+        vision_cache_bytes: int = 0,
+        vision_cache_dir: Optional[str] = None,
     ) -> None:
         self.model = Qwen3VLForConditionalGeneration.from_pretrained(
             vlm_model, torch_dtype=torch.bfloat16, device_map="auto"
@@ -47,10 +57,26 @@ class Qwen3VL():
         self.processor = AutoProcessor.from_pretrained(vlm_model)
         self.temperature = temperature
         self.seed = seed
+        self.image_cache = ProcessedImageCache(image_cache_bytes)
+
+        self.vision_cache = None
+        if vision_cache_bytes > 0 or vision_cache_dir is not None:
+            namespace = hashlib.md5(f"{vlm_model}|{lora_path}".encode()).hexdigest()[:8]
+            self.vision_cache = VisionEmbeddingCache(vision_cache_bytes, cache_dir=vision_cache_dir, namespace=namespace)
+            self.vision_cache.wrap(self.model.visual)
     
+    def _process_image(self, image, key):
+        """Pixel values and patch grid of a single image from the image processor, cached by image content."""
+        return self.image_cache.get_or_compute(
+            key, lambda: dict(self.processor.image_processor(images=[load_image(image)], return_tensors="pt"))
+        )
+
     def prepare_input(self, images, text_prompt: str = ""):
         if not isinstance(images, list):
             images = [images]
+        # key by content, a path is loaded first so that a file overwritten in place is not served stale
+        images = [image if isinstance(image, Image.Image) else load_image(image) for image in images]
+        image_keys = [image_hash(image) for image in images]
 
         messages = [
             {
@@ -59,16 +85,22 @@ class Qwen3VL():
                 + [{"type": "text", "text": text_prompt}],
             }
         ]
+        text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        image_features = [self._process_image(image, key) for image, key in zip(images, image_keys)]
 
-        inputs = self.processor.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_dict=True,
-            return_tensors="pt"
-        )
+        # expand each image pad token to the number of merged patches of its image, as the processor does
+        merge_length = self.processor.image_processor.merge_size ** 2
+        for features in image_features:
+            num_image_tokens = int(features["image_grid_thw"].prod()) // merge_length
+            text = text.replace(self.processor.image_token, "<|placeholder|>" * num_image_tokens, 1)
+        text = text.replace("<|placeholder|>", self.processor.image_token)
+
+        inputs = self.processor.tokenizer([text], return_tensors="pt")
+        inputs["pixel_values"] = torch.cat([features["pixel_values"] for features in image_features])
+        inputs["image_grid_thw"] = torch.cat([features["image_grid_thw"] for features in image_features])
 
         inputs = inputs.to("cuda")
+        inputs.image_keys = image_keys
 
         return inputs
 
@@ -76,14 +108,16 @@ class Qwen3VL():
         seed = self.seed if seed is None else seed
 
         set_seed(seed)
-        generated_ids = self.model.generate(
-            **inputs,
-            max_new_tokens=512,
-            do_sample=True,
-            temperature=self.temperature,
-            top_p=0.9,
-            top_k=20,
-        )
+        vision_cache_context = self.vision_cache.bind(inputs.image_keys) if self.vision_cache is not None else nullcontext()
+        with vision_cache_context:
+            generated_ids = self.model.generate(
+                **inputs,
+                max_new_tokens=512,
+                do_sample=True,
+                temperature=self.temperature,
+                top_p=0.9,
+                top_k=20,
+            )
         generated_ids_trimmed = [
             out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
         ]
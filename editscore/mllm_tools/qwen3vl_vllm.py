@@ -1,19 +1,28 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 import os
+import json
+import math
 import hashlib
 import random
 import time
+import uuid
+import asyncio
 import numpy as np
 import torch
 
-from vllm import LLM
-from vllm.sampling_params import SamplingParams
+from vllm import LLM, AsyncEngineArgs, AsyncLLMEngine
+from vllm.lora.request import LoRARequest
+from vllm.sampling_params import GuidedDecodingParams, SamplingParams
 
 from transformers import Qwen3VLForConditionalGeneration, AutoProcessor
 from peft import PeftModel
+from huggingface_hub import snapshot_download
 
 from qwen_vl_utils import process_vision_info
+from PIL import Image
+
+from .utils import ProcessedImageCache, image_hash, load_image
 
 
 def set_seed(seed: int):
@@ -38,7 +47,58 @@ def apply_chat_template(prompt, num_images: int = 2):
     return template
 
 
-class Qwen3VL():
+VISION_END = "<|vision_end|>"
+
+
+def merge_lora(vlm_model: str, lora_path: str, cache_dir: Optional[str] = None) -> str:
+    """
+    Merge `lora_path` into `vlm_model` once and return the directory of the merged weights.
+    """
+    if cache_dir is None:
+        root_dir = torch.hub.get_dir() # default: ~/.cache/torch/hub
+
+        lora_filename = os.path.splitext(os.path.basename(lora_path))[0]
+        lora_hash = hashlib.md5(lora_path.encode()).hexdigest()[:8]
+        lora_identifier = f"{lora_filename}_{lora_hash}"
+
+        cache_dir = os.path.join(root_dir, "EditScore", f"{os.path.basename(vlm_model)}_merged_lora_{lora_identifier}")
+
+    if not os.path.exists(cache_dir):
+        print(f"Merging LORA to {vlm_model} and saving to {cache_dir}", flush=True)
+        start_time = time.time()
+        model = Qwen3VLForConditionalGeneration.from_pretrained(
+            vlm_model, torch_dtype=torch.bfloat16, device_map="cpu"
+        )
+        model = PeftModel.from_pretrained(model, lora_path)
+        model = model.merge_and_unload()
+        model.save_pretrained(cache_dir)
+
+        processor = AutoProcessor.from_pretrained(vlm_model)
+        processor.save_pretrained(cache_dir)
+
+        print(f"Merging LORA to {vlm_model} and saving to {cache_dir} took {time.time() - start_time} seconds", flush=True)
+    else:
+        print(f"Skipping merging LORA, as merged model already exists in {cache_dir}", flush=True)
+
+    return cache_dir
+
+
+LORA_RANKS = (8, 16, 32, 64, 128, 256, 320, 512)
+
+
+def resolve_lora(lora_path: str) -> Tuple[str, int]:
+    """Local directory of a LoRA adapter, downloaded from the Hub if needed, and its rank."""
+    local_path = lora_path if os.path.isdir(lora_path) else snapshot_download(lora_path)
+    with open(os.path.join(local_path, "adapter_config.json"), "r") as f:
+        rank = json.load(f)["r"]
+    return local_path, rank
+
+
+class _Qwen3VLBase():
+    """
+    Input preparation, LoRA selection and sampling settings shared by `Qwen3VL` and
+    `AsyncQwen3VL`, which build the engine in `_build_engine` and drive it.
+    """
     def __init__(
         self,
         vlm_model,
@@ -48,52 +108,74 @@ class Qwen3VL():
         max_num_batched_tokens=1536,
         temperature: float = 0.7,
         seed: Optional[int] = None,
-        lora_path: Optional[str] = None,
+        lora_path: Optional[Union[str, Dict[str, str]]] = None,
         cache_dir: Optional[str] = None,
+        image_cache_bytes: int = 1 << 30,
+        json_schema: Optional[dict] = None,
+        merge_lora_weights: bool = False,
     ) -> None:
-        if lora_path:
-            if cache_dir is None:
-                root_dir = torch.hub.get_dir() # default: ~/.cache/torch/hub
-
-                lora_filename = os.path.splitext(os.path.basename(lora_path))[0]
-                lora_hash = hashlib.md5(lora_path.encode()).hexdigest()[:8]
-                lora_identifier = f"{lora_filename}_{lora_hash}"
-
-                cache_dir = os.path.join(root_dir, "EditScore", f"{os.path.basename(vlm_model)}_merged_lora_{lora_identifier}")
+        """
+        With `json_schema`, generation is constrained to JSON objects matching it, so every
+        response parses and decoding stops once the object is closed.
 
-            if not os.path.exists(cache_dir):
-                print(f"Merging LORA to {vlm_model} and saving to {cache_dir}", flush=True)
-                start_time = time.time()
-                model = Qwen3VLForConditionalGeneration.from_pretrained(
-                    vlm_model, torch_dtype=torch.bfloat16, device_map="cpu"
-                )
-                model = PeftModel.from_pretrained(model, lora_path)
-                model = model.merge_and_unload()
-                model.save_pretrained(cache_dir)
+        `lora_path` is one LoRA adapter or a `{name: path}` dict of adapters (local directories
+        or Hub repos). They are applied on top of the base weights at request time, selected
+        per call with `lora=<name>`, the first one being the default (named `default` when a
+        single path is given). With `merge_lora_weights`, a single adapter is instead merged
+        into a copy of the base model saved under `cache_dir`.
+        """
+        loras = {"default": lora_path} if isinstance(lora_path, str) else dict(lora_path or {})
+        self.lora_requests = dict()
+        engine_kwargs = dict()
+        if merge_lora_weights and loras:
+            if len(loras) > 1:
+                raise ValueError("merge_lora_weights supports a single LoRA adapter, serve several without merging")
+            vlm_model = merge_lora(vlm_model, next(iter(loras.values())), cache_dir)
+        elif loras:
+            ranks = []
+            for lora_id, (name, path) in enumerate(loras.items(), start=1):
+                local_path, rank = resolve_lora(path)
+                self.lora_requests[name] = LoRARequest(name, lora_id, local_path)
+                ranks.append(rank)
+            max_lora_rank = next((rank for rank in LORA_RANKS if rank >= max(ranks)), max(ranks))
+            engine_kwargs.update(enable_lora=True, max_loras=len(loras), max_lora_rank=max_lora_rank)
+        self.default_lora = next(iter(self.lora_requests), None)
 
-                processor = AutoProcessor.from_pretrained(vlm_model)
-                processor.save_pretrained(cache_dir)
-
-                print(f"Merging LORA to {vlm_model} and saving to {cache_dir} took {time.time() - start_time} seconds", flush=True)
-            else:
-                print(f"Skipping merging LORA, as merged model already exists in {cache_dir}", flush=True)
-
-            vlm_model = cache_dir
-
-        self.model = LLM(
-            model=vlm_model,
+        self.model = self._build_engine(
+            vlm_model,
             max_model_len=max_model_len,
             tensor_parallel_size=tensor_parallel_size,
             max_num_seqs=max_num_seqs,
             max_num_batched_tokens=max_num_batched_tokens,
-            limit_mm_per_prompt={"image": 2},
-            enable_prefix_caching=True,
+            **engine_kwargs,
         )
 
         self.processor = AutoProcessor.from_pretrained(vlm_model)
         self.temperature = temperature
         self.seed = seed
-    
+        self.json_schema = json_schema
+        self.image_cache = ProcessedImageCache(image_cache_bytes)
+        self.prefix_stats = {"num_prompt_tokens": 0, "num_cached_tokens": 0, "num_warmup_tokens": 0}
+
+    def _lora_request(self, lora: Optional[str] = None) -> Optional[LoRARequest]:
+        """Request of the named LoRA adapter, or of the default one when `lora` is None."""
+        if lora is None:
+            lora = self.default_lora
+            if lora is None:
+                return None
+        if lora not in self.lora_requests:
+            raise ValueError(f"Unknown LoRA adapter {lora}, available: {list(self.lora_requests)}")
+        return self.lora_requests[lora]
+
+    def _process_image(self, image):
+        """`process_vision_info` for a single image, cached by image content."""
+        # a path is loaded first so that a file overwritten in place is not served stale
+        if not isinstance(image, Image.Image):
+            image = load_image(image)
+        return self.image_cache.get_or_compute(
+            image_hash(image), lambda: process_vision_info([{"role": "user", "content": [{"type": "image", "image": image}]}])[0][0]
+        )
+
     def prepare_input(self, images, text_prompt: str = ""):
         if not isinstance(images, list):
             images = [images]
@@ -107,7 +189,7 @@ class Qwen3VL():
         ]
         # text = apply_chat_template(text_prompt, num_images=len(images))
         text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        image_inputs, _ = process_vision_info(messages)
+        image_inputs = [self._process_image(image) for image in images]
 
         messages = {
             "prompt": text,
@@ -115,10 +197,60 @@ class Qwen3VL():
         }
         return messages
 
-    def inference(self, messages, seed: Optional[int] = None):
+    def _record_prefix_stats(self, outputs):
+        for output in outputs:
+            self.prefix_stats["num_prompt_tokens"] += len(output.prompt_token_ids or [])
+            self.prefix_stats["num_cached_tokens"] += getattr(output, "num_cached_tokens", None) or 0
+
+    def prefix_hit_rate(self) -> float:
+        """Fraction of prompt tokens served from vLLM's prefix cache so far."""
+        return self.prefix_stats["num_cached_tokens"] / max(self.prefix_stats["num_prompt_tokens"], 1)
+
+    def _sampling_params(self, seed: Optional[Union[int, List[int]]] = None):
         seed = self.seed if seed is None else seed
-        sampling_params = SamplingParams(max_tokens=512, temperature=self.temperature, top_p=0.9, top_k=20, seed=seed)
-        outputs = self.model.generate(messages, sampling_params, use_tqdm=False)
+        if isinstance(seed, list):
+            return [self._sampling_params(_seed) for _seed in seed]
+        guided_decoding = GuidedDecodingParams(json=self.json_schema) if self.json_schema is not None else None
+        return SamplingParams(
+            max_tokens=512, temperature=self.temperature, top_p=0.9, top_k=20, seed=seed, guided_decoding=guided_decoding
+        )
+
+
+class Qwen3VL(_Qwen3VLBase):
+    def _build_engine(self, vlm_model, **engine_kwargs):
+        return LLM(
+            model=vlm_model,
+            limit_mm_per_prompt={"image": 2},
+            enable_prefix_caching=True,
+            **engine_kwargs,
+        )
+
+    def prefix_input(self, messages):
+        """
+        The part of a prepared input shared by every prompt of a group: the chat header
+        and the first (source) image, up to its closing vision token.
+        """
+        end = messages["prompt"].index(VISION_END) + len(VISION_END)
+        return {
+            "prompt": messages["prompt"][:end],
+            "multi_modal_data": {"image": messages["multi_modal_data"]["image"][:1]},
+        }
+
+    def warm_prefix(self, messages, lora: Optional[str] = None):
+        """
+        Prefill the shared prefix of each input once, so that the prompts of the group
+        scheduled afterwards hit the prefix cache instead of recomputing it concurrently.
+        """
+        prefixes = [self.prefix_input(_messages) for _messages in messages]
+        outputs = self.model.generate(prefixes, SamplingParams(max_tokens=1), use_tqdm=False, lora_request=self._lora_request(lora))
+        # warm-up prompts are cold by design, keep them out of the hit rate
+        for output in outputs:
+            self.prefix_stats["num_warmup_tokens"] += len(output.prompt_token_ids or [])
+
+    def inference(self, messages, seed: Optional[int] = None, lora: Optional[str] = None):
+        sampling_params = self._sampling_params(seed)
+        outputs = self.model.generate(messages, sampling_params, use_tqdm=False, lora_request=self._lora_request(lora))
+        self._record_prefix_stats(outputs)
 
         responses = []
         for output in outputs:
@@ -127,15 +259,102 @@ class Qwen3VL():
 
         return responses[0]
 
+    def batch_inference(self, messages, seed: Optional[Union[int, List[int]]] = None, lora: Optional[str] = None):
+        """
+        Generate responses for a batch of prompts in a single `LLM.generate` call.
 
-    def batch_inference(self, messages, seed: Optional[int] = None):
-        seed = self.seed if seed is None else seed
-        sampling_params = SamplingParams(max_tokens=512, temperature=self.temperature, top_p=0.9, top_k=20, seed=seed)
-        outputs = self.model.generate(messages, sampling_params, use_tqdm=False)
+        Args:
+            messages: List of prepared inputs from `prepare_input`.
+            seed: A single seed shared by all prompts, or one seed per prompt.
+            lora: Name of the LoRA adapter to score with, the default one when None.
+        """
+        sampling_params = self._sampling_params(seed)
+        outputs = self.model.generate(messages, sampling_params, use_tqdm=False, lora_request=self._lora_request(lora))
+        self._record_prefix_stats(outputs)
 
         responses = []
         for output in outputs:
             instruction = output.outputs[0].text.strip()
             responses.append(instruction)
 
-        return responses
\ No newline at end of file
+        return responses
+
+    def batch_inference_with_logprobs(
+        self, messages, seed: Optional[Union[int, List[int]]] = None, top_k: int = 20, lora: Optional[str] = None
+    ):
+        """
+        `batch_inference` that also returns, for every generated token, its text and the
+        `{token text: probability}` of the `top_k` most likely tokens at its position.
+        Returns one `(response, tokens)` pair per prompt.
+        """
+        sampling_params = self._sampling_params(seed)
+        for _sampling_params in (sampling_params if isinstance(sampling_params, list) else [sampling_params]):
+            _sampling_params.logprobs = top_k
+        outputs = self.model.generate(messages, sampling_params, use_tqdm=False, lora_request=self._lora_request(lora))
+        self._record_prefix_stats(outputs)
+
+        responses = []
+        for output in outputs:
+            completion = output.outputs[0]
+            tokens = []
+            for token_id, position_logprobs in zip(completion.token_ids, completion.logprobs):
+                distribution = dict()
+                for logprob in position_logprobs.values():
+                    distribution[logprob.decoded_token] = distribution.get(logprob.decoded_token, 0.0) + math.exp(logprob.logprob)
+                tokens.append((position_logprobs[token_id].decoded_token, distribution))
+            responses.append((completion.text.strip(), tokens))
+        return responses
+
+    def next_token_logprobs(self, messages, continuations, top_k: int = 20, lora: Optional[str] = None):
+        """
+        Probabilities of the `top_k` most likely next tokens after each prepared input, with
+        the matching continuation appended to its assistant turn. Returns one
+        `{token text: probability}` dict per input. Inputs repeating an earlier prompt only
+        prefill their continuation, the rest is served from the prefix cache.
+        """
+        inputs = [
+            dict(_messages, prompt=_messages["prompt"] + continuation)
+            for _messages, continuation in zip(messages, continuations)
+        ]
+        sampling_params = SamplingParams(max_tokens=1, temperature=0, logprobs=top_k)
+        outputs = self.model.generate(inputs, sampling_params, use_tqdm=False, lora_request=self._lora_request(lora))
+        self._record_prefix_stats(outputs)
+
+        distributions = []
+        for output in outputs:
+            distribution = dict()
+            for logprob in output.outputs[0].logprobs[0].values():
+                distribution[logprob.decoded_token] = distribution.get(logprob.decoded_token, 0.0) + math.exp(logprob.logprob)
+            distributions.append(distribution)
+        return distributions
+
+
+class AsyncQwen3VL(_Qwen3VLBase):
+    """
+    Qwen3VL driven by vLLM's `AsyncLLMEngine`. Every `inference` call is submitted to the
+    engine as soon as it is awaited, so concurrent callers are merged into the running
+    batch by vLLM's continuous batching scheduler.
+    """
+    def _build_engine(self, vlm_model, **engine_kwargs):
+        engine_args = AsyncEngineArgs(
+            model=vlm_model,
+            limit_mm_per_prompt={"image": 2},
+            enable_prefix_caching=True,
+            **engine_kwargs,
+        )
+        return AsyncLLMEngine.from_engine_args(engine_args)
+
+    async def inference(self, messages, seed: Optional[int] = None, lora: Optional[str] = None):
+        final_output = None
+        async for output in self.model.generate(
+            messages, self._sampling_params(seed), uuid.uuid4().hex, lora_request=self._lora_request(lora)
+        ):
+            final_output = output
+        self._record_prefix_stats([final_output])
+        return final_output.outputs[0].text.strip()
+
+    async def batch_inference(self, messages, seed: Optional[Union[int, List[int]]] = None, lora: Optional[str] = None):
+        seeds = seed if isinstance(seed, list) else [seed] * len(messages)
+        return await asyncio.gather(
+            *[self.inference(_messages, seed=_seed, lora=lora) for _messages, _seed in zip(messages, seeds)]
+        )
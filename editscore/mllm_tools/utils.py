@@ -1,5 +1,8 @@
-from typing import List
+from typing import Any, Callable, Dict, Hashable, List
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 from io import BytesIO
 from PIL import Image
 import requests
@@ -10,6 +13,79 @@ def pil_image_to_base64(pil_image, format="PNG"):
     img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')  # Encode the buffer's content to base64
     return img_str
 
+def image_hash(image: Image.Image) -> str:
+    """
+    Content hash of a PIL image, identical for images with the same mode, size and pixels.
+    Copied as `image_key` in examples/OmniGen2-RL/omnigen2/grpo/reward_wire.py, keep both in sync.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{image.mode}|{image.size[0]}x{image.size[1]}|".encode())
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+def _nbytes(value) -> int:
+    if isinstance(value, Image.Image):
+        return value.size[0] * value.size[1] * len(value.getbands())
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    if hasattr(value, "element_size") and hasattr(value, "nelement"): # torch.Tensor
+        return value.element_size() * value.nelement()
+    return getattr(value, "nbytes", 0)
+
+class ProcessedImageCache:
+    """
+    Thread-safe LRU cache for preprocessed images, keyed by image content hash and bounded
+    by the total size of the cached values.
+
+    Args:
+        max_bytes: Upper bound on the summed size of cached values. 0 disables caching.
+    """
+    def __init__(self, max_bytes: int = 1 << 30):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute_fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = compute_fn()
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, nbytes)
+                self.num_bytes += nbytes
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_nbytes
+                self.evictions += 1
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.num_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
 def load_image(image_file):
     if image_file.startswith("http"):
         response = requests.get(image_file)
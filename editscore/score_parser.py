@@ -0,0 +1,205 @@
+"""
+Single-pass parser for scorer outputs of the form `{"reasoning": "...", "score": [...]}`.
+
+The text is scanned once, key by key, instead of being re-parsed after each repair like
+the `json_repair` / regex cascade in `utils.py` and `json_parser.py`. The malformations
+seen in scorer outputs are handled during the scan: single, smart or missing quotes around
+keys, unescaped quotes inside the reasoning, Python literals, trailing commas, a missing
+closing brace and scores given as quoted numbers.
+
+`parse_score_output` returns None when it cannot read exactly the expected number of scores,
+each within 0..score_range. Callers then fall back to the cascade for the rarer formats it
+knows about, or re-issue the prompt.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import json
+
+REASONING_KEYS = ("reasoning", "reason", "rationale")
+SCORE_KEYS = ("score",)
+QUOTES = {'"': '"', "'": "'", "“": "”", "‘": "’", "”": "”"}
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+KEY_SEPARATORS = ":："
+NUMBER_CHARS = "+-.0123456789eE"
+
+
+def _skip_whitespace(text: str, i: int) -> int:
+    while i < len(text) and text[i].isspace():
+        i += 1
+    return i
+
+
+def _read_key(text: str, i: int) -> Tuple[Optional[str], int]:
+    """Read a quoted or bare key followed by a colon. Returns (key, index after the colon)."""
+    i = _skip_whitespace(text, i)
+    if i >= len(text):
+        return None, i
+    if text[i] in QUOTES:
+        end = text.find(QUOTES[text[i]], i + 1)
+        if end < 0:
+            return None, len(text)
+        key, i = text[i + 1:end], end + 1
+    else:
+        start = i
+        while i < len(text) and (text[i].isalnum() or text[i] == "_"):
+            i += 1
+        key = text[start:i]
+    i = _skip_whitespace(text, i)
+    if not key or i >= len(text) or text[i] not in KEY_SEPARATORS:
+        return None, i
+    return key.strip().lower(), i + 1
+
+
+def _is_next_key(text: str, i: int) -> bool:
+    """Whether a closing quote at `i - 1` ends the value: a `}`, the end, or `, <key>:` follows."""
+    i = _skip_whitespace(text, i)
+    if i >= len(text) or text[i] == "}":
+        return True
+    if text[i] != ",":
+        return False
+    i = _skip_whitespace(text, i + 1)
+    if i >= len(text) or text[i] == "}":
+        return True
+    key, _ = _read_key(text, i)
+    return key is not None
+
+
+def _unescape(raw: str) -> str:
+    if "\\" not in raw:
+        return raw
+    try:
+        return json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        return raw.replace('\\"', '"').replace("\\'", "'").replace("\\n", "\n").replace("\\\\", "\\")
+
+
+def _read_string(text: str, i: int) -> Tuple[str, int]:
+    """
+    Read a string value. A quoted value ends at the first matching quote that is followed by
+    the next key, a closing brace or the end of the text, so unescaped quotes inside it are kept.
+    """
+    if text[i] not in QUOTES:
+        end = i
+        while end < len(text) and not (text[end] in ",}" and _is_next_key(text, end)):
+            end += 1
+        return text[i:end].strip(), end
+
+    closing = QUOTES[text[i]]
+    start = i + 1
+    j = start
+    while j < len(text):
+        if text[j] == "\\":
+            j += 2
+            continue
+        if text[j] in (closing, '"') and _is_next_key(text, j + 1):
+            return _unescape(text[start:j]), j + 1
+        j += 1
+    # unterminated string: keep everything up to a trailing brace
+    return _unescape(text[start:].rstrip().rstrip("}").rstrip().rstrip("\"'”")), len(text)
+
+
+def _read_number(text: str, i: int) -> Tuple[Optional[float], int]:
+    quote = None
+    if i < len(text) and text[i] in QUOTES:
+        quote = text[i]
+        i += 1
+    start = i
+    while i < len(text) and text[i] in NUMBER_CHARS:
+        i += 1
+    try:
+        number = float(text[start:i])
+    except ValueError:
+        return None, i
+    if quote is not None and i < len(text) and text[i] == QUOTES[quote]:
+        i += 1
+    return number, i
+
+
+def _read_scores(text: str, i: int) -> Tuple[Optional[List[float]], int]:
+    i = _skip_whitespace(text, i)
+    if i < len(text) and text[i] != "[":
+        number, i = _read_number(text, i)
+        return (None if number is None else [number]), i
+
+    scores = []
+    i += 1
+    while i < len(text):
+        i = _skip_whitespace(text, i)
+        if i >= len(text) or text[i] == "]":
+            return scores, i + 1
+        if text[i] == ",":
+            i += 1
+            continue
+        number, i = _read_number(text, i)
+        if number is None:
+            return None, i
+        scores.append(number)
+    # unterminated list: keep the numbers read so far
+    return scores, i
+
+
+def _skip_value(text: str, i: int) -> int:
+    """Skip a value of a key we do not use, up to the next top-level comma or closing brace."""
+    depth = 0
+    quote = None
+    while i < len(text):
+        char = text[i]
+        if quote is not None:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            if depth == 0:
+                return i
+            depth -= 1
+        elif char == "," and depth == 0:
+            return i
+        i += 1
+    return i
+
+
+def parse_score_output(text: str, score_range: int, num_scores: int = 2) -> Optional[Dict[str, Any]]:
+    """
+    Parse a scorer output into `{"score": [float, ...], "reasoning": str}` in one scan of the
+    object starting at its first `{`. Returns None unless the score list holds exactly
+    `num_scores` numbers, each within 0..`score_range`.
+    """
+    if not text:
+        return None
+    i = text.find("{")
+    if i < 0:
+        return None
+    i += 1
+
+    reasoning = None
+    scores = None
+    while i < len(text):
+        i = _skip_whitespace(text, i)
+        if i >= len(text) or text[i] == "}":
+            break
+        if text[i] == ",":
+            i += 1
+            continue
+        key, i = _read_key(text, i)
+        if key is None:
+            return None
+        i = _skip_whitespace(text, i)
+        if i >= len(text):
+            break
+        if key in SCORE_KEYS:
+            scores, i = _read_scores(text, i)
+            if scores is None:
+                return None
+        elif key in REASONING_KEYS and reasoning is None:
+            reasoning, i = _read_string(text, i)
+        else:
+            i = _skip_value(text, i)
+
+    if scores is None or len(scores) != num_scores or not all(0 <= score <= score_range for score in scores):
+        return None
+    return {"score": scores, "reasoning": (reasoning or "").translate(SMART_QUOTES)}
@@ -3,22 +3,23 @@ import dotenv
 dotenv.load_dotenv(override=True)
 
 import argparse
-import glob
+import asyncio
 import hashlib
 import json
-import logging
 import os
+import queue
+import sqlite3
 import time
 import threading
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
-from typing import List, Tuple, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Any, Iterator, Optional, Set
 
 import dotenv
 from PIL import Image
 from tqdm import tqdm
 from datasets import Dataset, load_dataset
 
-from editscore import EditScore
+from editscore import EditScore, AsyncEditScore
 
 PROMPT_FOLLOWING = "prompt_following"
 CONSISTENCY = "consistency"
@@ -27,103 +28,289 @@ SCORE_CATEGORIES = [PROMPT_FOLLOWING, CONSISTENCY, OVERALL]
 
 
 class CacheManager:
-    def __init__(self, cache_file: str):
+    """
+    Result cache stored in a SQLite database.
+
+    Lookups are indexed, so nothing is loaded on startup. Writes are committed in batches of
+    `commit_every`, and WAL journaling lets several processes on the same host read and
+    write the same file concurrently. For nodes sharing a network filesystem, use one cache
+    file per node, since SQLite locking is not reliable there. Re-scoring a pair overwrites
+    its entry, so the table never holds duplicates.
+
+    Keys are derived from the pair key and `scorer_config` (model, LoRA, score range,
+    temperature, seed, ...), so results of a different scorer configuration never hit.
+    """
+    def __init__(self, cache_file: str, scorer_config: Dict[str, Any], commit_every: int = 32):
         self.cache_file = cache_file
+        self.scorer_config = scorer_config
+        self.commit_every = commit_every
         self.lock = threading.Lock()
-        self.cache = self._load()
+        self._num_uncommitted = 0
 
-    def _load(self) -> Dict[str, Any]:
-        cache = {}
-        if not os.path.exists(self.cache_file):
-            print(
-                f"Cache file not found at {self.cache_file}. A new one will be created."
-            )
-            return cache
-
-        with open(self.cache_file, "r", encoding="utf-8") as f:
-            for i, line in enumerate(f):
-                try:
-                    data = json.loads(line)
-                    cache[data["key"]] = data["result"]
-                except json.JSONDecodeError:
-                    logging.warning(
-                        f"Skipping corrupted line {i + 1} in cache file: {line.strip()}"
-                    )
-        print(f"Loaded {len(cache)} items from {self.cache_file}.")
-        return cache
+        self.conn = sqlite3.connect(cache_file, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+        self.conn.commit()
+        print(f"Opened cache {self.cache_file} with {len(self)} items.")
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def key(self, pair_key: str) -> str:
+        return generate_cache_key(pair_key, self.scorer_config)
 
     def get(self, key: str) -> Optional[Any]:
-        return self.cache.get(key)
+        with self.lock:
+            row = self.conn.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
 
     def append(self, key: str, result: Any):
         with self.lock:
-            self.cache[key] = result
-            with open(self.cache_file, "a", encoding="utf-8") as f:
-                f.write(
-                    json.dumps({"key": key, "result": result}, ensure_ascii=False)
-                    + "\n"
-                )
-
-def generate_cache_key(pair_key):
-    return hashlib.sha256(pair_key.encode("utf-8")).hexdigest()
-
-def load_pairs_dataset(dataset: Dataset) -> Dict[str, Tuple[str, Image.Image, Image.Image]]:
-    pairs = {}
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (key, result) VALUES (?, ?)",
+                (key, json.dumps(result, ensure_ascii=False)),
+            )
+            self._num_uncommitted += 1
+            if self._num_uncommitted >= self.commit_every:
+                self.conn.commit()
+                self._num_uncommitted = 0
+
+    def flush(self):
+        with self.lock:
+            self.conn.commit()
+            self._num_uncommitted = 0
+
+    def compact(self):
+        """Commit pending writes and reclaim the space of overwritten entries."""
+        self.flush()
+        with self.lock:
+            self.conn.execute("VACUUM")
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def generate_cache_key(pair_key: str, scorer_config: Dict[str, Any]) -> str:
+    key_string = json.dumps({"pair_key": pair_key, **scorer_config}, sort_keys=True)
+    return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
+
+
+def find_pending_rows(row_keys: List[List[str]], cache_manager: CacheManager) -> Tuple[List[int], Set[str]]:
+    """
+    Find the rows holding at least one pair that is not cached yet from the `key` column alone,
+    so that no image is decoded. Each pending pair is assigned to the first row it appears in.
+    """
+    pending_indices = []
+    pending_keys = set()
+    for idx, (key1, key2) in enumerate(row_keys):
+        missing = [
+            pair_key
+            for pair_key in (key1, key2)
+            if pair_key not in pending_keys and cache_manager.get(cache_manager.key(pair_key)) is None
+        ]
+        if missing:
+            pending_indices.append(idx)
+            pending_keys.update(missing)
+    return pending_indices, pending_keys
+
+
+def decode_pairs(dataset: Dataset, pending_keys: Set[str]) -> Iterator[Tuple[str, Tuple[str, Image.Image, Image.Image]]]:
+    """Decode and preprocess the pending pairs one row at a time."""
     for data in dataset:
         key1, key2 = data["key"]
         instruction = data["instruction"]
         input_image = data["input_image"].convert("RGB")
 
-        pairs[key1] = (instruction, input_image, data["output_images"][0].convert("RGB"))
-        pairs[key2] = (instruction, input_image, data["output_images"][1].convert("RGB"))
-    return pairs
-
-def _load_item(data: dict) -> list[tuple[str, tuple[str, Image.Image, Image.Image]]]:
-    key1, key2 = data["key"]
-    instruction = data["instruction"]
-    
-    input_image = data["input_image"].convert("RGB")
-    output_image1 = data["output_images"][0].convert("RGB")
-    output_image2 = data["output_images"][1].convert("RGB")
-
-    return [
-        (key1, (instruction, input_image, output_image1)),
-        (key2, (instruction, input_image, output_image2)),
-    ]
-
-def load_pairs_dataset_multithreaded(dataset: Dataset, max_workers: int = None) -> Dict[str, Tuple[str, Image.Image, Image.Image]]:
-    if max_workers is None:
-        # max_workers = min(32, (os.cpu_count() or 1) * 5)  
-        max_workers = os.cpu_count() or 1
-
-    pairs = {}
-    
-    print(f"Processing dataset (length: {len(dataset)}) with {max_workers} threads", flush=True)
-    
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        results_iterator = tqdm(
-            executor.map(_load_item, dataset), 
-            total=len(dataset), 
-            desc="Processing dataset with multiple threads"
-        )
-        
-        for result_pairs in results_iterator:
-            pairs.update(result_pairs)
-            
-    return pairs
+        for pair_key, output_image in zip((key1, key2), data["output_images"]):
+            if pair_key not in pending_keys:
+                continue
+            pending_keys.discard(pair_key)
+            output_image = output_image.convert("RGB").resize((input_image.size[0], input_image.size[1]))
+            yield pair_key, (instruction, input_image, output_image)
+
 
+def start_decoder(dataset: Dataset, pending_keys: Set[str], max_prefetch: int) -> queue.Queue:
+    """
+    Decode pairs in a background thread into a bounded queue, so that at most `max_prefetch`
+    decoded pairs wait for the scorer. The queue ends with `None`, or with the decoding exception.
+    """
+    decode_queue = queue.Queue(maxsize=max_prefetch)
 
-def process_single_item(key, item, scorer):
-    instruction = item[0]
-    input_image = item[1]
-    output_image = item[2]
-    
-    output_image = output_image.resize((input_image.size[0], input_image.size[1]))
+    def _run():
+        try:
+            for item in decode_pairs(dataset, pending_keys):
+                decode_queue.put(item)
+            decode_queue.put(None)
+        except Exception as e:
+            decode_queue.put(e)
+
+    threading.Thread(target=_run, daemon=True).start()
+    return decode_queue
+
+
+def _next_decoded(decode_queue: queue.Queue):
+    item = decode_queue.get()
+    if isinstance(item, Exception):
+        raise item
+    return item
+
+
+def process_single_item(key, item, scorer, cache_manager):
+    instruction, input_image, output_image = item
 
     score = scorer.evaluate([input_image, output_image], instruction)
+    if score:
+        cache_manager.append(cache_manager.key(key), score)
     return key, score
 
 
+def score_pairs(decode_queue: queue.Queue, scorer, cache_manager, max_workers: int, total: int):
+    """Score decoded pairs on a thread pool as they arrive, with at most 2 * `max_workers` pairs in flight."""
+    in_flight = threading.BoundedSemaphore(2 * max_workers)
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(total=total, unit="pair", desc="Processing") as pbar:
+        def _on_done(future):
+            in_flight.release()
+            pbar.update(1)
+
+        while (item := _next_decoded(decode_queue)) is not None:
+            in_flight.acquire()
+            future = executor.submit(process_single_item, *item, scorer, cache_manager)
+            future.add_done_callback(_on_done)
+            futures.append(future)
+
+    for future in futures:
+        future.result()
+
+
+async def score_pairs_async(decode_queue: queue.Queue, scorer, cache_manager, max_concurrency: int, total: int):
+    """Score decoded pairs with an `AsyncEditScore`, keeping at most `max_concurrency` pairs in flight."""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    with tqdm(total=total, unit="pair", desc="Processing") as pbar:
+        async def _process(pair_key, item):
+            try:
+                instruction, input_image, output_image = item
+                score = await scorer.evaluate([input_image, output_image], instruction)
+                if score:
+                    cache_manager.append(cache_manager.key(pair_key), score)
+            finally:
+                semaphore.release()
+                pbar.update(1)
+
+        tasks = []
+        while (item := await loop.run_in_executor(None, _next_decoded, decode_queue)) is not None:
+            await semaphore.acquire()
+            tasks.append(asyncio.ensure_future(_process(*item)))
+        await asyncio.gather(*tasks)
+
+
+def image_paths(image_dir: str, key1: str, key2: str) -> Tuple[str, str, str]:
+    return (
+        os.path.join(image_dir, f"{key1}_input.png"),
+        os.path.join(image_dir, f"{key1}.png"),
+        os.path.join(image_dir, f"{key2}.png"),
+    )
+
+
+def save_image(image: Image.Image, path: str):
+    # write to a temporary file first, so an interrupted run never leaves a truncated png
+    # that would be skipped as already exported
+    tmp_path = f"{path}.{os.getpid()}.tmp.png"
+    image.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def export_images(dataset: Dataset, row_keys: List[List[str]], image_dir: str, max_workers: int):
+    """
+    Save the input and output images of every row as png, skipping images already on disk or
+    shared with an earlier row. Only the rows with a missing image are decoded, and png
+    encoding runs in a thread pool with at most 2 * `max_workers` images in flight.
+    """
+    os.makedirs(image_dir, exist_ok=True)
+
+    todo_indices = []
+    todo_paths = []
+    claimed = set()
+    for idx, (key1, key2) in enumerate(row_keys):
+        paths = [
+            path if path not in claimed and not os.path.exists(path) else None
+            for path in image_paths(image_dir, key1, key2)
+        ]
+        if any(paths):
+            todo_indices.append(idx)
+            todo_paths.append(paths)
+            claimed.update(path for path in paths if path)
+
+    if not todo_indices:
+        return
+    print(f"Exporting {len(claimed)} images...", flush=True)
+
+    semaphore = threading.BoundedSemaphore(2 * max_workers)
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for data, paths in zip(
+            dataset.select(todo_indices).select_columns(["input_image", "output_images"]), todo_paths
+        ):
+            images = [data["input_image"], *data["output_images"]]
+            for image, path in zip(images, paths):
+                if path is None:
+                    continue
+                semaphore.acquire()
+                future = executor.submit(save_image, image, path)
+                future.add_done_callback(lambda _: semaphore.release())
+                futures.append(future)
+
+        for future in tqdm(futures, desc="Exporting images", unit="image"):
+            future.result()
+
+
+def write_results(dataset: Dataset, cache_manager: CacheManager, save_dir: str, image_dir: Optional[str]):
+    """
+    Write one line per row to `{save_dir}/{task_type}/{dimension}.jsonl` from the image-free
+    columns of the benchmark. Each file is opened once per run and rewritten, so repeated runs
+    do not accumulate duplicate lines. Image paths are recorded only when `image_dir` is given.
+    """
+    handles = {}
+    try:
+        for idx, data in enumerate(dataset):
+            key1, key2 = data["key"]
+            task_type = data["task_type"]
+            dimension = data["dimension"]
+
+            all_scores = {
+                key1: cache_manager.get(cache_manager.key(key1)),
+                key2: cache_manager.get(cache_manager.key(key2)),
+            }
+            score1 = all_scores[key1][dimension]
+            score2 = all_scores[key2][dimension]
+
+            json_line = {
+                "key": (key1, key2),
+                "idx": idx,
+                "score": [score1, score2],
+                "SC_reasoning": [all_scores[key1]["SC_reasoning"], all_scores[key2]["SC_reasoning"]],
+                "PQ_reasoning": [all_scores[key1]["PQ_reasoning"], all_scores[key2]["PQ_reasoning"]],
+            }
+            if image_dir is not None:
+                input_image_path, output_image_path1, output_image_path2 = image_paths(image_dir, key1, key2)
+                json_line["input_image"] = input_image_path
+                json_line["output_images"] = [output_image_path1, output_image_path2]
+
+            if (task_type, dimension) not in handles:
+                save_file = os.path.join(save_dir, task_type, f"{dimension}.jsonl")
+                os.makedirs(os.path.dirname(save_file), exist_ok=True)
+                handles[(task_type, dimension)] = open(save_file, "w", encoding="utf-8")
+            handles[(task_type, dimension)].write(json.dumps(json_line, ensure_ascii=False) + "\n")
+    finally:
+        for f in handles.values():
+            f.close()
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -143,6 +330,7 @@ def parse_args():
     parser.add_argument("--key", type=str, default="PUT YOUR API KEY HERE")
     parser.add_argument("--num_pass", type=int, default=1)
     parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--seed", type=int, default=42)
     parser.add_argument("--max_workers", type=int, default=20)
     parser.add_argument("--score_range", type=int, default=25)
     parser.add_argument("--tensor_parallel_size", type=int, default=1)
@@ -151,118 +339,137 @@ def parse_args():
     parser.add_argument("--max_num_batched_tokens", type=int, default=1536)
     parser.add_argument("--lora_path", type=str, default="EditScore/EditScore-7B")
     parser.add_argument("--cache_dir", type=str, default=None)
-    return parser.parse_args()
+    parser.add_argument(
+        "--async_engine",
+        action="store_true",
+        help="Use AsyncEditScore (vLLM backbones only); --max_workers then bounds the number of pairs in flight.",
+    )
+    parser.add_argument(
+        "--max_prefetch",
+        type=int,
+        default=64,
+        help="Maximum number of decoded pairs waiting to be scored, bounds memory regardless of dataset size.",
+    )
+    parser.add_argument(
+        "--score_expectation",
+        action="store_true",
+        help="Score with the expectation of each score's token distribution instead of the sampled value (vLLM backbones).",
+    )
+    parser.add_argument(
+        "--guided_decoding",
+        action="store_true",
+        help="Constrain generation to the reasoning/score JSON schema (vLLM backbones).",
+    )
+    parser.add_argument(
+        "--merge_lora",
+        action="store_true",
+        help="Merge the LoRA into an on-disk copy of the base model instead of applying it at request time (vLLM backbones).",
+    )
+    parser.add_argument(
+        "--skip_image_export",
+        action="store_true",
+        help="Do not save input/output images as png, the result files then only hold keys, scores and reasoning.",
+    )
+    args = parser.parse_args()
+    if args.async_engine and args.score_expectation:
+        parser.error("--score_expectation is not supported with --async_engine")
+    return args
 
 
 def main(args):
     start_time = time.time()
-    scorer = EditScore(
-        backbone=args.backbone,
-        key=args.key,
-        openai_url=args.openai_url,
-        model_name_or_path=args.model_name_or_path,
-        score_range=args.score_range,
-        temperature=args.temperature,
-        tensor_parallel_size=args.tensor_parallel_size,
-        max_model_len=args.max_model_len,
-        max_num_seqs=args.max_num_seqs,
-        max_num_batched_tokens=args.max_num_batched_tokens,
-        num_pass=args.num_pass,
-        lora_path=args.lora_path,
-        cache_dir=args.cache_dir,
-    )
+    if args.async_engine:
+        scorer = AsyncEditScore(
+            backbone=args.backbone,
+            model_name_or_path=args.model_name_or_path,
+            score_range=args.score_range,
+            temperature=args.temperature,
+            tensor_parallel_size=args.tensor_parallel_size,
+            max_model_len=args.max_model_len,
+            max_num_seqs=args.max_num_seqs,
+            max_num_batched_tokens=args.max_num_batched_tokens,
+            num_pass=args.num_pass,
+            seed=args.seed,
+            lora_path=args.lora_path,
+            cache_dir=args.cache_dir,
+            guided_decoding=args.guided_decoding,
+            merge_lora=args.merge_lora,
+        )
+    else:
+        scorer = EditScore(
+            backbone=args.backbone,
+            key=args.key,
+            openai_url=args.openai_url,
+            model_name_or_path=args.model_name_or_path,
+            score_range=args.score_range,
+            temperature=args.temperature,
+            tensor_parallel_size=args.tensor_parallel_size,
+            max_model_len=args.max_model_len,
+            max_num_seqs=args.max_num_seqs,
+            max_num_batched_tokens=args.max_num_batched_tokens,
+            num_pass=args.num_pass,
+            seed=args.seed,
+            lora_path=args.lora_path,
+            cache_dir=args.cache_dir,
+            score_expectation=args.score_expectation,
+            guided_decoding=args.guided_decoding,
+            merge_lora=args.merge_lora,
+        )
     print(f"Scorer initialized in {time.time() - start_time} seconds", flush=True)
 
     cache_dir = os.path.join(args.result_dir, ".cache")
     os.makedirs(cache_dir, exist_ok=True)
     cache_file = os.path.join(
-        cache_dir, f"{args.backbone}_{args.model_name_or_path.replace('/', '_')}.jsonl"
+        cache_dir, f"{args.backbone}_{args.model_name_or_path.replace('/', '_')}.sqlite"
     )
-    cache_manager = CacheManager(cache_file)
+    scorer_config = {
+        "backbone": args.backbone,
+        "model_name_or_path": args.model_name_or_path,
+        "lora_path": args.lora_path,
+        "score_range": args.score_range,
+        "temperature": args.temperature,
+        "seed": args.seed,
+        "num_pass": args.num_pass,
+        "score_expectation": args.score_expectation,
+        "guided_decoding": args.guided_decoding,
+    }
+    cache_manager = CacheManager(cache_file, scorer_config)
 
     start_time = time.time()
     dataset = load_dataset(args.benchmark_dir, split="train")
     print(f"Dataset loaded in {time.time() - start_time} seconds", flush=True)
 
-    start_time = time.time()
-    unique_pairs = load_pairs_dataset_multithreaded(dataset)
-    print(f"Pairs loaded in {time.time() - start_time} seconds", flush=True)
-
-    all_scores = {}
-    pairs_to_process = [
-        pair_key
-        for pair_key in unique_pairs.keys()
-        if cache_manager.get(generate_cache_key(pair_key)) is None
-    ]
-
-    for pair_key in unique_pairs.keys():
-        if pair_key not in pairs_to_process:
-            all_scores[pair_key] = cache_manager.get(generate_cache_key(pair_key))
-
+    row_keys = dataset.select_columns(["key"])["key"]
+    pending_indices, pending_keys = find_pending_rows(row_keys, cache_manager)
+    num_pairs = len(set(key for keys in row_keys for key in keys))
     print(
-        f"{len(unique_pairs) - len(pairs_to_process)} pairs found in cache. Processing {len(pairs_to_process)} new pairs.",
+        f"{num_pairs - len(pending_keys)} pairs found in cache. Processing {len(pending_keys)} new pairs.",
         flush=True
     )
 
-    if pairs_to_process:
-        with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
-            futures = [
-                executor.submit(process_single_item, pair_key, unique_pairs[pair_key], scorer)
-                for pair_key in pairs_to_process
-            ]
-
-            for future in tqdm(
-                as_completed(futures),
-                total=len(futures),
-                unit="pair",
-                desc="Processing",
-            ):
-                pair_key, result = future.result()
-                if result:
-                    all_scores[pair_key] = result
-                    cache_manager.append(generate_cache_key(pair_key), result)
+    if pending_keys:
+        start_time = time.time()
+        total = len(pending_keys)
+        decode_queue = start_decoder(dataset.select(pending_indices), pending_keys, args.max_prefetch)
+        if args.async_engine:
+            asyncio.run(score_pairs_async(decode_queue, scorer, cache_manager, args.max_workers, total))
+        else:
+            score_pairs(decode_queue, scorer, cache_manager, args.max_workers, total)
+        cache_manager.flush()
+        print(f"Scored {total} pairs in {time.time() - start_time} seconds", flush=True)
 
     print("Writing results...", flush=True)
 
     start_time = time.time()
-    # dataset = dataset.remove_columns(["input_image", "output_images"])
-    for idx, data in enumerate(dataset):
-        key1, key2 = data["key"]
-        task_type = data["task_type"]
-        dimension = data["dimension"]
-
-        score1 = all_scores[key1][dimension]
-        score2 = all_scores[key2][dimension]
-        data["score"] = [score1, score2]
-        
-        input_image_path = os.path.join(args.result_dir, "images", f"{key1}_input.png")
-        output_image_path1 = os.path.join(args.result_dir, "images", f"{key1}.png")
-        output_image_path2 = os.path.join(args.result_dir, "images", f"{key2}.png")
-
-        os.makedirs(os.path.dirname(input_image_path), exist_ok=True)
-
-        data['input_image'].save(input_image_path)
-        data['output_images'][0].save(output_image_path1)
-        data['output_images'][1].save(output_image_path2)
-
-        json_line = {
-            "key": (key1, key2),
-            "idx": idx,
-            "score": [score1, score2],
-            "SC_reasoning": [all_scores[key1]["SC_reasoning"], all_scores[key2]["SC_reasoning"]],
-            "PQ_reasoning": [all_scores[key1]["PQ_reasoning"], all_scores[key2]["PQ_reasoning"]],
-            "input_image": input_image_path,
-            "output_images": [output_image_path1, output_image_path2],
-        }
-
-        save_file = os.path.join(
-            args.result_dir, args.backbone, task_type, f"{dimension}.jsonl"
-        )
-        os.makedirs(os.path.dirname(save_file), exist_ok=True)
-
-        with open(save_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(json_line, ensure_ascii=False) + "\n")
-
+    if not args.skip_image_export:
+        export_images(dataset, row_keys, os.path.join(args.result_dir, "images"), args.max_workers)
+    write_results(
+        dataset.select_columns(["key", "task_type", "dimension"]),
+        cache_manager,
+        os.path.join(args.result_dir, args.backbone),
+        None if args.skip_image_export else os.path.join(args.result_dir, "images"),
+    )
+    cache_manager.close()
     print(f"Results written in {time.time() - start_time} seconds", flush=True)
     print("--- Completed! ---", flush=True)
 
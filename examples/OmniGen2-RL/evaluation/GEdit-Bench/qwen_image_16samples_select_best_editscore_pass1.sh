@@ -80,8 +80,8 @@ for ((i=0; i<num_gpus_per_machine; i++)); do
     --score_range 25 \
     --max_workers 1 \
     --max_model_len 4096 \
-    --max_num_seqs 1 \
-    --max_num_batched_tokens 4096 \
+    --max_num_seqs 64 \
+    --max_num_batched_tokens 32768 \
     --tensor_parallel_size 1 \
     --num_pass 1 \
     --start_index ${start_idx} --end_index ${end_idx} \
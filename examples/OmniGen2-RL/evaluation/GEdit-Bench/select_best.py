@@ -17,11 +17,13 @@ import hashlib  # 新增导入
 import threading # 新增导入
 from tqdm import tqdm
 
-def generate_cache_key(pair):
+def generate_cache_key(pair, scorer_config):
     """为每个样本生成一个唯一的SHA256哈希键。"""
     instruction, input_image, output_image = pair
     # 将三个组件用特殊分隔符连接，确保不会因内容本身包含分隔符而混淆
     key_string = f"{instruction}|||{input_image}|||{output_image}"
+    # the scorer config is part of the key, so a cache file reused with another scorer is not served stale scores
+    key_string += "|||" + json.dumps(scorer_config, sort_keys=True)
     return hashlib.sha256(key_string.encode('utf-8')).hexdigest()
 
 def load_cache(cache_file):
@@ -44,23 +46,38 @@ def append_to_cache(cache_file, key, result, lock):
         with open(cache_file, 'a', encoding='utf-8') as f:
             f.write(json.dumps({'key': key, 'result': result}, ensure_ascii=False) + '\n')
 
-def process_single_item(item, vie_score, args, max_retries=10000):
-    instruction = item[0]
-    input_image = item[1]
-    output_image = item[2]
-    
-    for retry in range(max_retries):
-        # try:
-        pil_image_raw = Image.open(input_image).convert("RGB")
-
-        pil_image_edited = Image.open(output_image).convert("RGB")
-        pil_image_edited = pil_image_edited.resize((pil_image_raw.size[0], pil_image_raw.size[1]))
-
-        text_prompt = instruction
-        score = vie_score.evaluate(
-            [pil_image_raw, pil_image_edited], text_prompt, echo_output=False
-        )
-        return item, score
+def load_item_images(data_item, args):
+    """Source image and candidate output paths of one benchmark item."""
+    task_type = data_item['task_type']
+    instruction_language = data_item['instruction_language']
+    key = data_item['key']
+    input_image_path = f"{args.result_dir}/fullset/{task_type}/{instruction_language}/{key}_SRCIMG.png"
+    output_image_paths = [
+        f"{args.result_dir}/fullset/{task_type}/{instruction_language}/{key}{'_sample' + str(turn) if turn > 0 else ''}.png"
+        for turn in range(args.num_samples)
+    ]
+    return input_image_path, output_image_paths
+
+def score_candidates(scorer, requests):
+    """
+    Score (instruction, input_image_path, output_image_path) requests. Backbones with batched
+    inference score all of them in a single `batch_evaluate` call, where the candidates of an
+    item share the source image prefix; other backbones fall back to `evaluate` per request.
+    """
+    input_images = {}
+    image_prompts = []
+    for _, input_image_path, output_image_path in requests:
+        if input_image_path not in input_images:
+            input_images[input_image_path] = Image.open(input_image_path).convert('RGB')
+        input_image = input_images[input_image_path]
+        output_image = Image.open(output_image_path).convert('RGB')
+        output_image = output_image.resize(input_image.size)
+        image_prompts.append([input_image, output_image])
+
+    instructions = [instruction for instruction, _, _ in requests]
+    if hasattr(scorer.model, "batch_inference"):
+        return [result['O_score'] for result in scorer.batch_evaluate(image_prompts, instructions)]
+    return [scorer.evaluate(image_prompt, instruction)['overall'] for image_prompt, instruction in zip(image_prompts, instructions)]
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -107,9 +124,22 @@ def parse_args():
     parser.add_argument("--max_model_len", type=int, default=1536)
     parser.add_argument("--max_num_seqs", type=int, default=32)
     parser.add_argument("--max_num_batched_tokens", type=int, default=1536)
+    # kept for compatibility with existing scripts, LoRA is enabled by passing --lora_path
     parser.add_argument("--enable_lora", action="store_true")
     parser.add_argument("--lora_path", type=str, default="")
     parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument(
+        "--items_per_batch", type=int, default=32,
+        help="Number of benchmark items whose candidates are scored together in one batch_evaluate call",
+    )
+    parser.add_argument(
+        "--early_stop_score", type=float, default=None,
+        help="Stop scoring more candidates of an item once its best score reaches this value",
+    )
+    parser.add_argument(
+        "--score_cache_file", type=str, default=None,
+        help="JSONL file of already computed scores, defaults to <save_dir>_scores.jsonl; reruns resume from it",
+    )
     return parser.parse_args()
 
 def main(args):
@@ -125,56 +155,94 @@ def main(args):
         max_num_seqs=args.max_num_seqs,
         max_num_batched_tokens=args.max_num_batched_tokens,
         num_pass=args.num_pass,
-        enable_lora=args.enable_lora,
-        lora_path=args.lora_path,
+        lora_path=args.lora_path or None,
         cache_dir=args.cache_dir,
     )
 
+    scorer_config = {
+        "backbone": args.backbone,
+        "model_name_or_path": args.model_name_or_path,
+        "lora_path": args.lora_path,
+        "score_range": args.score_range,
+        "temperature": args.temperature,
+        "num_pass": args.num_pass,
+    }
+
     dataset = load_dataset("stepfun-ai/GEdit-Bench", split='train')
     dataset = dataset.remove_columns(["input_image", "input_image_raw"])
     dataset = dataset.filter(lambda x: x["instruction_language"] == "en", num_proc=4)
 
+    score_cache_file = args.score_cache_file or f"{args.save_dir}_scores.jsonl"
+    os.makedirs(os.path.dirname(os.path.abspath(score_cache_file)), exist_ok=True)
+    score_cache = load_cache(score_cache_file)
+    cache_lock = threading.Lock()
+    print(f"Loaded {len(score_cache)} cached scores from {score_cache_file}")
+
     data_index_list = list(range(args.start_index, args.end_index))
+    best_of = [n for n in range(1, args.num_samples + 1) if n & (n - 1) == 0]
+
     with tqdm(
             total=len(data_index_list),
             desc=f"Processing {len(data_index_list)}/{len(dataset)}",
             unit="image"
         ) as pbar:
-        for idx in data_index_list:
-            data_item = dataset[idx]
-
-            task_type = data_item['task_type']
-            instruction_language = data_item['instruction_language']
-
-            key = data_item['key']
-            instruction = data_item['instruction']
-            input_image_path = f"{args.result_dir}/fullset/{task_type}/{instruction_language}/{key}_SRCIMG.png"
-            input_image = Image.open(input_image_path).convert('RGB')
-
-            best_score = -float('inf')
-            best_output_image_path = None
-
-            for turn in range(args.num_samples):
-                output_image_path = f"{args.result_dir}/fullset/{task_type}/{instruction_language}/{key}{'_sample' + str(turn) if turn > 0 else ''}.png"
-                output_image = Image.open(output_image_path).convert('RGB')
-
-                score = scorer.evaluate(
-                    [input_image, output_image], instruction, echo_output=False
-                )['overall']
-
-                if score > best_score:
-                    best_score = score
-                    best_output_image_path = output_image_path
-                
-                if (turn + 1) & (turn + 1 - 1) == 0:
-                    save_input_image_path = f"{args.save_dir}_best{turn + 1}/fullset/{task_type}/{instruction_language}/{key}_SRCIMG.png"
-                    save_output_image_path = f"{args.save_dir}_best{turn + 1}/fullset/{task_type}/{instruction_language}/{key}.png"
+        for batch_start in range(0, len(data_index_list), args.items_per_batch):
+            items = []
+            for idx in data_index_list[batch_start:batch_start + args.items_per_batch]:
+                data_item = dataset[idx]
+                input_image_path, output_image_paths = load_item_images(data_item, args)
+                items.append({
+                    "data_item": data_item,
+                    "input_image_path": input_image_path,
+                    "output_image_paths": output_image_paths,
+                    "scores": [],
+                })
+
+            # candidates are scored in rounds ending at each best-of-n boundary, so that an item
+            # whose best score already reaches --early_stop_score skips the remaining rounds
+            num_scored = 0
+            for n in best_of + ([args.num_samples] if args.num_samples not in best_of else []):
+                active = [
+                    item for item in items
+                    if args.early_stop_score is None or not item["scores"] or max(item["scores"]) < args.early_stop_score
+                ]
+                requests, owners = [], []
+                for item in active:
+                    for turn in range(num_scored, n):
+                        requests.append((item["data_item"]['instruction'], item["input_image_path"], item["output_image_paths"][turn]))
+                        owners.append(item)
+
+                cache_keys = [generate_cache_key(request, scorer_config) for request in requests]
+                missing = [i for i, cache_key in enumerate(cache_keys) if cache_key not in score_cache]
+                if missing:
+                    scores = score_candidates(scorer, [requests[i] for i in missing])
+                    for i, score in zip(missing, scores):
+                        score_cache[cache_keys[i]] = score
+                        append_to_cache(score_cache_file, cache_keys[i], score, cache_lock)
+
+                for owner, cache_key in zip(owners, cache_keys):
+                    owner["scores"].append(score_cache[cache_key])
+                num_scored = n
+
+            for item in items:
+                data_item = item["data_item"]
+                task_type = data_item['task_type']
+                instruction_language = data_item['instruction_language']
+                key = data_item['key']
+
+                # first candidate with the highest score among the first n, as with serial scoring
+                for n in best_of:
+                    scores = item["scores"][:n]
+                    best_output_image_path = item["output_image_paths"][scores.index(max(scores))]
+
+                    save_input_image_path = f"{args.save_dir}_best{n}/fullset/{task_type}/{instruction_language}/{key}_SRCIMG.png"
+                    save_output_image_path = f"{args.save_dir}_best{n}/fullset/{task_type}/{instruction_language}/{key}.png"
 
                     os.makedirs(os.path.dirname(save_input_image_path), exist_ok=True)
                     if not os.path.exists(save_input_image_path):
-                        copyfile(input_image_path, save_input_image_path)
+                        copyfile(item["input_image_path"], save_input_image_path)
                     copyfile(best_output_image_path, save_output_image_path)
-            pbar.update(1)
+            pbar.update(len(items))
 
 if __name__ == "__main__":
     args = parse_args()
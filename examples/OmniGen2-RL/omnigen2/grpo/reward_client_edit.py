@@ -3,21 +3,28 @@
 Pure Reward Client - Only responsible for data transmission
 """
 
-import pickle
 import requests
 import time
 import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Tuple
 
+from omnigen2.grpo.reward_wire import CONTENT_TYPE, encode_message, decode_message
+
 logger = logging.getLogger(__name__)
 
+_submit_executor = None
+_submit_executor_lock = threading.Lock()
+
 class RewardClient:
     """
     Pure Reward Client - Only responsible for communicating with proxy server
     """
     
     def __init__(self, proxy_host: str = "127.0.0.1", proxy_port: int = 23456, 
-                 timeout: int = 300, max_retries: int = 3):
+                 timeout: int = 300, max_retries: int = 3,
+                 image_codec: str = "raw", image_quality: int = 95):
         """
         Initialize client
         
@@ -26,10 +33,15 @@ class RewardClient:
             proxy_port: Proxy server port
             timeout: Request timeout in seconds
             max_retries: Maximum number of retries
+            image_codec: Wire encoding of images ('raw', 'png', 'jpeg' or 'webp'), raw costs no
+                CPU but the most bandwidth, jpeg/webp trade fidelity for size
+            image_quality: Quality of the jpeg/webp encoding
         """
         self.proxy_url = f"http://{proxy_host}:{proxy_port}"
         self.timeout = timeout
         self.max_retries = max_retries
+        self.image_codec = image_codec
+        self.image_quality = image_quality
         
         logger.info(f"Initialize Reward client: {self.proxy_url}")
     
@@ -39,8 +51,8 @@ class RewardClient:
         Evaluate images and return rewards
         
         Args:
-            input_images: List of input image byte data
-            output_image: List of output image byte data
+            input_images: List of input images (a list of PIL images per sample)
+            output_image: List of output PIL images
             meta_datas: List of metadata
             server_type: Server type ('geneval', 'ocr', etc.)
             
@@ -62,22 +74,23 @@ class RewardClient:
             'server_type': server_type  
         }
         
+        # Serialize once, retries resend the same message
+        encoded_data, _ = encode_message(request_data, codec=self.image_codec, quality=self.image_quality)
+
         # Retry logic
         last_exception = None
         for attempt in range(self.max_retries):
             try:
-                # Serialize and send
-                pickled_data = pickle.dumps(request_data)
                 response = requests.post(
                     self.proxy_url,
-                    data=pickled_data,
-                    headers={'Content-Type': 'application/octet-stream'},
+                    data=encoded_data,
+                    headers={'Content-Type': CONTENT_TYPE},
                     timeout=self.timeout
                 )
                 
                 if response.status_code == 200:
                     # Parse results
-                    result = pickle.loads(response.content)
+                    result = decode_message(response.content)
                     scores = result.get('scores', [])
                     rewards = result.get('rewards', [])
                     reasoning = result.get('reasoning', [])
@@ -118,13 +131,33 @@ class RewardClient:
 # Convenience function
 def evaluate_images(input_images: List[bytes], output_image: List[bytes], meta_datas: List[Dict[str, Any]], 
                    proxy_host: str = "127.0.0.1", proxy_port: int = 23456,
-                   server_type: str = 'vlm') -> Optional[Tuple[List[float], List[float], List[str], List[Dict]]]:
+                   server_type: str = 'vlm', image_codec: str = "raw",
+                   image_quality: int = 95) -> Optional[Tuple[List[float], List[float], List[str], List[Dict]]]:
     """
     Convenience function: directly evaluate images
     """
-    client = RewardClient(proxy_host, proxy_port, timeout=600, max_retries=1)
+    client = RewardClient(proxy_host, proxy_port, timeout=600, max_retries=1,
+                          image_codec=image_codec, image_quality=image_quality)
     return client.evaluate(input_images, output_image, meta_datas, server_type)
 
+def submit_evaluate_images(input_images: List[bytes], output_image: List[bytes], meta_datas: List[Dict[str, Any]],
+                           proxy_host: str = "127.0.0.1", proxy_port: int = 23456,
+                           server_type: str = 'vlm', image_codec: str = "raw",
+                           image_quality: int = 95) -> Future:
+    """
+    Non-blocking `evaluate_images`: sends the request from a background thread and returns a
+    future of its result, so that the caller can keep generating while the batch is scored.
+    """
+    global _submit_executor
+    with _submit_executor_lock:
+        if _submit_executor is None:
+            _submit_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="reward_client")
+    return _submit_executor.submit(
+        evaluate_images, input_images, output_image, meta_datas,
+        proxy_host=proxy_host, proxy_port=proxy_port, server_type=server_type,
+        image_codec=image_codec, image_quality=image_quality,
+    )
+
 # Usage example
 if __name__ == "__main__":
     # Create client
@@ -136,8 +169,9 @@ if __name__ == "__main__":
         exit(1)
     
     # Mock data
-    input_images = [b"fake_input_image"]  # Input images
-    output_images = [b"fake_output_image"]  # Output images
+    from PIL import Image
+    input_images = [[Image.new("RGB", (512, 512))]]  # Input images
+    output_images = [Image.new("RGB", (512, 512))]  # Output images
     meta_datas = [{"tag": "test", "prompt": "a simple test"}]  # Metadata
     
     # Evaluate images
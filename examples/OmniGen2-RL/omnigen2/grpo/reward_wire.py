@@ -0,0 +1,243 @@
+"""
+Binary wire format shared by the reward client, proxy and servers.
+
+A message is laid out as
+
+    MAGIC | uint32 header length | JSON header | image data section
+
+The JSON header holds the payload with every PIL image replaced by `{"__image__": i}`, plus
+an image table whose i-th entry describes where the bytes of image i live in the data
+section: offset, length, codec, mode, size and content hash. Images with the same content
+are stored once and referenced by every sample using them, so a GRPO batch carries each
+source image once instead of once per repeat, and the receiver gets a single image object
+for all its references.
+
+Images are stored either as raw uint8 buffers (`raw`, no encoding cost) or compressed
+(`png`, `jpeg`, `webp`) at the quality chosen by the sender. Nothing is ever unpickled, so
+a message can only carry JSON values and images.
+
+A hop that only routes images (the proxy) decodes with `decode_images=False` and gets
+`EncodedImage` views into the received body, which `encode_message` forwards as-is without
+decoding or re-encoding the pixels.
+
+When sender and receiver share a host, the data section can travel through POSIX shared
+memory instead of the HTTP body: the header then names the segment, the receiver copies the
+images out of it, and the sender unlinks it once the response has arrived. Receivers only
+attach when called with `allow_shm=True`, and only to segments named with `SHM_PREFIX`, so
+a request cannot make them read arbitrary shared memory of the host.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import io
+import json
+import secrets
+import socket
+import struct
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+from PIL import Image
+
+MAGIC = b"RWW1"
+CONTENT_TYPE = "application/x-reward-wire"
+CODECS = ("raw", "png", "jpeg", "webp")
+RAW_MODES = ("RGB", "RGBA", "L")
+# name prefix of the shared memory segments created by `encode_message`
+SHM_PREFIX = "rww_"
+
+_HEADER_LEN = struct.Struct("<I")
+
+
+class EncodedImage:
+    """An image kept in its wire encoding, forwarded between hops without touching pixels."""
+    __slots__ = ("data", "codec", "mode", "size", "key")
+
+    def __init__(self, data, codec: str, mode: str, size: Tuple[int, int], key: Optional[str] = None) -> None:
+        self.data = data
+        self.codec = codec
+        self.mode = mode
+        self.size = tuple(size)
+        self.key = key
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def decode(self, copy: bool = False) -> Image.Image:
+        if self.codec == "raw":
+            if copy:
+                return Image.frombytes(self.mode, self.size, bytes(self.data))
+            return Image.frombuffer(self.mode, self.size, self.data, "raw", self.mode, 0, 1)
+        image = Image.open(io.BytesIO(self.data))
+        image.load()
+        return image
+
+
+def image_key(image: Image.Image) -> str:
+    """
+    Content hash of a PIL image. Must stay identical to `editscore.mllm_tools.utils.image_hash`
+    (copied rather than imported so that the training client does not depend on editscore).
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{image.mode}|{image.size[0]}x{image.size[1]}|".encode())
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+
+def encode_image(image: Image.Image, codec: str = "raw", quality: int = 95, key: Optional[str] = None) -> EncodedImage:
+    if codec not in CODECS:
+        raise ValueError(f"Unknown image codec {codec}, choose from {CODECS}")
+    if codec == "raw":
+        if image.mode not in RAW_MODES:
+            image = image.convert("RGB")
+        return EncodedImage(image.tobytes(), codec, image.mode, image.size, key)
+
+    if codec == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=codec.upper(), quality=quality)
+    return EncodedImage(buffer.getvalue(), codec, image.mode, image.size, key)
+
+
+def is_local_host(host: str) -> bool:
+    """Whether `host` resolves to this machine, i.e. shared memory can reach it."""
+    if host in ("localhost", "::1") or host.startswith("127."):
+        return True
+    try:
+        return socket.gethostbyname(host) in socket.gethostbyname_ex(socket.gethostname())[2]
+    except OSError:
+        return False
+
+
+def _attach_shm(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to a segment created by the sender without registering it with this process's
+    resource tracker, which would otherwise warn about and try to clean up every segment the
+    sender has already unlinked.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def encode_message(
+    payload: Any, codec: str = "raw", quality: int = 95, use_shm: bool = False, dedupe: bool = True
+) -> Tuple[bytes, Optional[shared_memory.SharedMemory]]:
+    """
+    Serialize `payload` (JSON values, PIL images and `EncodedImage`s, nested in dicts, lists
+    and tuples) into a message. Returns the message and, with `use_shm`, the shared memory
+    segment holding the image data, which the caller must `close()` and `unlink()` once the
+    receiver is done with it.
+
+    With `dedupe`, PIL images are hashed and images with the same content are sent once.
+    `EncodedImage`s are deduplicated by the hash they were received with. Without it, only
+    repeated references to the same object are shared.
+    """
+    images: List[EncodedImage] = []
+    image_index: Dict[Any, int] = dict()
+
+    def _replace(value):
+        if isinstance(value, (Image.Image, EncodedImage)):
+            key = id(value)
+            if dedupe:
+                if isinstance(value, EncodedImage):
+                    key = value.key or key
+                else:
+                    key = image_key(value)
+            if key not in image_index:
+                image_index[key] = len(images)
+                if isinstance(value, EncodedImage):
+                    images.append(value)
+                else:
+                    images.append(encode_image(value, codec, quality, key if dedupe else None))
+            return {"__image__": image_index[key]}
+        if isinstance(value, dict):
+            return {k: _replace(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [_replace(v) for v in value]
+        return value
+
+    body = _replace(payload)
+
+    table = []
+    offset = 0
+    for image in images:
+        length = len(image.data)
+        table.append({
+            "offset": offset, "length": length, "codec": image.codec, "mode": image.mode, "size": image.size, "key": image.key,
+        })
+        offset += length
+
+    shm = None
+    if use_shm and offset > 0:
+        shm = shared_memory.SharedMemory(name=f"{SHM_PREFIX}{secrets.token_hex(12)}", create=True, size=offset)
+        for image, entry in zip(images, table):
+            shm.buf[entry["offset"]:entry["offset"] + entry["length"]] = image.data
+
+    header = json.dumps(
+        {"payload": body, "images": table, "shm": shm.name if shm is not None else None},
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+    parts = [MAGIC, _HEADER_LEN.pack(len(header)), header]
+    if shm is None:
+        parts.extend(image.data for image in images)
+    return b"".join(parts), shm
+
+
+def decode_message(data: bytes, decode_images: bool = True, allow_shm: bool = False) -> Any:
+    """
+    Parse a message produced by `encode_message`. Images come back as PIL images, or as
+    `EncodedImage`s with `decode_images=False`. Images received over HTTP are views of `data`;
+    images received through shared memory are copied out of it before it is closed. A message
+    naming a shared memory segment is rejected with ValueError unless `allow_shm` is set and
+    the segment was created by `encode_message`.
+    """
+    view = memoryview(data)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a reward wire message")
+    header_start = len(MAGIC) + _HEADER_LEN.size
+    (header_len,) = _HEADER_LEN.unpack(view[len(MAGIC):header_start])
+    header = json.loads(bytes(view[header_start:header_start + header_len]).decode("utf-8"))
+
+    shm = None
+    if header.get("shm"):
+        if not allow_shm:
+            raise ValueError("Message uses shared memory, which this receiver does not accept")
+        if not isinstance(header["shm"], str) or not header["shm"].startswith(SHM_PREFIX):
+            raise ValueError(f"Refusing to attach to shared memory segment {header['shm']!r}")
+        shm = _attach_shm(header["shm"])
+        section = shm.buf
+    else:
+        section = view[header_start + header_len:]
+
+    try:
+        images = []
+        for entry in header["images"]:
+            image_data = section[entry["offset"]:entry["offset"] + entry["length"]]
+            if shm is not None:
+                image_data = bytes(image_data)
+            image = EncodedImage(image_data, entry["codec"], entry["mode"], entry["size"], entry.get("key"))
+            images.append(image.decode() if decode_images else image)
+    finally:
+        if shm is not None:
+            del section
+            shm.close()
+
+    def _restore(value):
+        if isinstance(value, dict):
+            if len(value) == 1 and "__image__" in value:
+                return images[value["__image__"]]
+            return {k: _restore(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [_restore(v) for v in value]
+        return value
+
+    return _restore(header["payload"])
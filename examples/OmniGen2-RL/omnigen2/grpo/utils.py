@@ -1,8 +1,6 @@
 from typing import List, Dict, Any, Tuple
-from collections import defaultdict
 
 import math
-import numpy as np
 import torch
 
 from accelerate.utils import gather_object
@@ -52,34 +50,43 @@ def process_grpo_rewards(
 
     assert len(gathered_rewards) == len(gathered_prompts), f"{len(gathered_rewards)=} {len(gathered_prompts)=}"
     
-    # 3. Group rewards by prompt
-    prompt_to_rewards = defaultdict(list)
-    for prompt, reward in zip(gathered_prompts, gathered_rewards):
-        prompt_to_rewards[prompt].append(reward.item())
-    
-    # 4. Pre-compute statistical information for each prompt group
-    prompt_stats = {}
-    for prompt, group_rewards in prompt_to_rewards.items():
-        prompt_stats[prompt] = {
-            "min": np.min(group_rewards),
-            "max": np.max(group_rewards),
-            "mean": np.mean(group_rewards),
-            "std": np.std(group_rewards),
-        }
-
-    if std_level == 'batch':
-        batch_std = np.std([reward.item() for reward in gathered_rewards])
-
-    assert set(prompts).issubset(set(prompt_stats.keys())), f"{set(prompts)=} {set(prompt_stats.keys())=}"
-    
-    advantages = torch.zeros_like(rewards, device=rewards.device)
-    for i, prompt in enumerate(prompts):
-        stats = prompt_stats[prompt]
-        if std_level == 'group':
-            advantage = (rewards[i].item() - stats['mean']) / (stats['std'] + 1e-8)
-        elif std_level == 'batch':
-            advantage = (rewards[i].item() - stats['mean']) / (batch_std + 1e-8)
-        advantages[i] = torch.tensor(advantage, device=rewards.device)
+    # 2. Map prompts to integer group ids, in order of first appearance
+    prompt_to_group = {}
+    group_ids = [prompt_to_group.setdefault(prompt, len(prompt_to_group)) for prompt in gathered_prompts]
+    num_groups = len(prompt_to_group)
+
+    assert set(prompts).issubset(prompt_to_group.keys()), f"{set(prompts)=} {set(prompt_to_group.keys())=}"
+
+    # 3. Segment statistics of each prompt group on device, in float64 like the numpy reference
+    device = rewards.device
+    group_ids = torch.tensor(group_ids, dtype=torch.long, device=device)
+    gathered_rewards = gathered_rewards.to(dtype=torch.float64)
+
+    counts = torch.zeros(num_groups, dtype=torch.float64, device=device).index_add_(0, group_ids, torch.ones_like(gathered_rewards))
+    means = torch.zeros(num_groups, dtype=torch.float64, device=device).index_add_(0, group_ids, gathered_rewards) / counts
+    # population std (ddof=0), same as np.std
+    stds = (
+        torch.zeros(num_groups, dtype=torch.float64, device=device).index_add_(0, group_ids, (gathered_rewards - means[group_ids]) ** 2)
+        / counts
+    ).sqrt()
+    mins = torch.full((num_groups,), float("inf"), dtype=torch.float64, device=device).scatter_reduce_(0, group_ids, gathered_rewards, reduce="amin")
+    maxs = torch.full((num_groups,), float("-inf"), dtype=torch.float64, device=device).scatter_reduce_(0, group_ids, gathered_rewards, reduce="amax")
+
+    # 4. Advantages of the local samples
+    local_group_ids = torch.tensor([prompt_to_group[prompt] for prompt in prompts], dtype=torch.long, device=device)
+    if std_level == 'group':
+        scale = stds[local_group_ids]
+    elif std_level == 'batch':
+        scale = gathered_rewards.std(unbiased=False).expand(len(prompts))
+    else:
+        raise ValueError(f"Unknown std_level {std_level}, use 'group' or 'batch'")
+    advantages = ((rewards.to(dtype=torch.float64) - means[local_group_ids]) / (scale + 1e-8)).to(dtype=rewards.dtype)
+
+    stats = torch.stack([mins, maxs, means, stds], dim=1).tolist()
+    prompt_stats = {
+        prompt: dict(zip(("min", "max", "mean", "std"), stats[group_id]))
+        for prompt, group_id in prompt_to_group.items()
+    }
 
     return advantages, prompt_stats
 
@@ -1,28 +1,35 @@
 #!/usr/bin/env python3
 
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Set, Tuple
 import argparse
-import pickle
-import requests
+import asyncio
+import functools
+import os
+import sys
 import json
+import threading
 import time
 import logging
-from flask import Flask, request, jsonify
-from concurrent.futures import ThreadPoolExecutor
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
 from collections import defaultdict
 import math
 import yaml
 
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from omnigen2.grpo.reward_wire import CONTENT_TYPE, encode_message, decode_message, is_local_host
+
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger("RewardProxy")
 
-app = Flask(__name__)
+# Qwen-VL encodes each 28x28 pixel patch into one visual token
+PIXELS_PER_VISUAL_TOKEN = 28 * 28
 
 
 def reorder_results(
-    merged_item_list: List[Dict[str, Any]], original_batch_size: int, app: Flask
+    merged_item_list: List[Dict[str, Any]], original_batch_size: int
 ) -> Dict[str, Any]:
     """
     Reorder the merged result list according to the original indices.
@@ -98,15 +105,233 @@ def reorder_results(
     }
 
 
+def release_encoded_shm(future: asyncio.Future):
+    """Done callback unlinking the shared memory of an `encode_message` job nobody waits for anymore."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, shm = future.result()
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+
+
+def estimate_sample_cost(input_images, output_image) -> int:
+    """Estimated visual tokens of one sample, its input images plus the output image."""
+    images = list(input_images) + [output_image]
+    return sum(image.width * image.height for image in images) // PIXELS_PER_VISUAL_TOKEN
+
+
+class WorkerStats:
+    """Load and latency bookkeeping of one worker server."""
+    def __init__(self, ewma_alpha: float) -> None:
+        self.ewma_alpha = ewma_alpha
+        self.inflight_cost = 0
+        self.inflight_requests = 0
+        # seconds per visual token, unknown until the first request completes
+        self.sec_per_token = None
+        self.num_requests = 0
+        self.num_failures = 0
+        # time of the last failed request, None once a request succeeded again
+        self.failed_at = None
+        self.total_cost = 0
+        self.busy_time = 0.0
+        self._busy_since = None
+
+    def start(self, cost: int, now: float):
+        if self.inflight_requests == 0:
+            self._busy_since = now
+        self.inflight_cost += cost
+        self.inflight_requests += 1
+
+    def finish(self, cost: int, latency: float, success: bool, now: float, cancelled: bool = False):
+        self.inflight_cost -= cost
+        self.inflight_requests -= 1
+        if self.inflight_requests == 0:
+            self.busy_time += now - self._busy_since
+            self._busy_since = None
+
+        if cancelled:
+            # a hedged duplicate that lost the race, says nothing about the worker
+            return
+        self.num_requests += 1
+        self.failed_at = None if success else now
+        if not success:
+            self.num_failures += 1
+            return
+        self.total_cost += cost
+        observed = latency / max(cost, 1)
+        if self.sec_per_token is None:
+            self.sec_per_token = observed
+        else:
+            self.sec_per_token = self.ewma_alpha * observed + (1 - self.ewma_alpha) * self.sec_per_token
+
+
+class LoadAwareScheduler:
+    """
+    Assigns chunks of work to worker servers by estimated finish time instead of round-robin.
+
+    The cost of a chunk is its estimated number of visual tokens. Each worker's expected
+    finish time is its in-flight plus newly assigned cost, times its latency per token. That
+    latency is tracked as an EWMA of completed requests, and workers without history use the
+    mean of the others. Chunks are placed largest first on the worker that would finish
+    earliest. A worker whose last request failed is unhealthy for `unhealthy_cooldown`
+    seconds and only gets work when no healthy worker is left.
+    """
+    def __init__(self, server_urls: List[str], ewma_alpha: float = 0.2, unhealthy_cooldown: float = 30.0) -> None:
+        self.server_urls = server_urls
+        self.unhealthy_cooldown = unhealthy_cooldown
+        self.lock = threading.Lock()
+        self.stats = {server_url: WorkerStats(ewma_alpha) for server_url in server_urls}
+        self.start_time = time.time()
+
+    def _sec_per_token(self) -> Dict[str, float]:
+        known = [stats.sec_per_token for stats in self.stats.values() if stats.sec_per_token is not None]
+        default = sum(known) / len(known) if known else 1.0
+        return {
+            server_url: stats.sec_per_token if stats.sec_per_token is not None else default
+            for server_url, stats in self.stats.items()
+        }
+
+    def _healthy(self, server_url: str) -> bool:
+        failed_at = self.stats[server_url].failed_at
+        return failed_at is None or time.time() - failed_at > self.unhealthy_cooldown
+
+    def _earliest_finish(self, cost: int, load: Dict[str, int], sec_per_token: Dict[str, float], exclude: Set[str] = ()) -> Optional[str]:
+        candidates = [server_url for server_url in self.server_urls if server_url not in exclude]
+        if not candidates:
+            return None
+        candidates = [server_url for server_url in candidates if self._healthy(server_url)] or candidates
+        return min(candidates, key=lambda url: (load[url] + cost) * sec_per_token[url])
+
+    def assign(self, costs: List[int]) -> List[str]:
+        """Pick a worker for each chunk cost and mark the chunks as in flight."""
+        with self.lock:
+            sec_per_token = self._sec_per_token()
+            load = {server_url: stats.inflight_cost for server_url, stats in self.stats.items()}
+
+            assignment = [None] * len(costs)
+            for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+                server_url = self._earliest_finish(costs[i], load, sec_per_token)
+                load[server_url] += costs[i]
+                assignment[i] = server_url
+
+            now = time.time()
+            for server_url, cost in zip(assignment, costs):
+                self.stats[server_url].start(cost, now)
+            return assignment
+
+    def pick(self, cost: int, exclude: Set[str]) -> Optional[str]:
+        """Pick a worker outside `exclude` for one more request (a hedge or a retry) and mark it in flight."""
+        with self.lock:
+            load = {server_url: stats.inflight_cost for server_url, stats in self.stats.items()}
+            server_url = self._earliest_finish(cost, load, self._sec_per_token(), exclude)
+            if server_url is not None:
+                self.stats[server_url].start(cost, time.time())
+            return server_url
+
+    def expected_latency(self, server_url: str, cost: int) -> Optional[float]:
+        """Expected latency of a request of `cost` on `server_url`, None before any request completed."""
+        with self.lock:
+            if all(stats.sec_per_token is None for stats in self.stats.values()):
+                return None
+            return cost * self._sec_per_token()[server_url]
+
+    def complete(self, server_url: str, cost: int, latency: float, success: bool, cancelled: bool = False):
+        with self.lock:
+            self.stats[server_url].finish(cost, latency, success, time.time(), cancelled)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Per-worker utilization (fraction of wall time with a request in flight) and load."""
+        with self.lock:
+            now = time.time()
+            elapsed = max(now - self.start_time, 1e-6)
+            report = dict()
+            for server_url, stats in self.stats.items():
+                busy_time = stats.busy_time
+                if stats._busy_since is not None:
+                    busy_time += now - stats._busy_since
+                report[server_url] = {
+                    "utilization": busy_time / elapsed,
+                    "inflight_requests": stats.inflight_requests,
+                    "inflight_cost": stats.inflight_cost,
+                    "num_requests": stats.num_requests,
+                    "num_failures": stats.num_failures,
+                    "healthy": self._healthy(server_url),
+                    "total_cost": stats.total_cost,
+                    "sec_per_token": stats.sec_per_token,
+                }
+            return report
+
+
+def split_group(indices: List[int], costs: List[int], max_chunk_cost: int) -> List[List[int]]:
+    """
+    Split an instruction group into contiguous chunks of at most `max_chunk_cost`, balanced
+    in size. A group is only split when it alone exceeds the budget, so samples sharing a
+    source image stay together on one worker as far as possible.
+    """
+    total_cost = sum(costs)
+    if total_cost <= max_chunk_cost or len(indices) == 1:
+        return [indices]
+    num_chunks = min(len(indices), -(-total_cost // max_chunk_cost))
+    chunk_size = -(-len(indices) // num_chunks)
+    return [indices[i:i + chunk_size] for i in range(0, len(indices), chunk_size)]
+
+
 class RewardProxy:
-    def __init__(self, worker_configs: List[Dict[str, Any]]):
+    """
+    Fans requests out to the worker servers over keep-alive connections.
+
+    Args:
+        worker_concurrency: Maximum number of concurrent requests (and pooled connections) per worker.
+        request_timeout: Timeout of one worker request in seconds.
+        hedge_factor: A chunk still running after `hedge_factor` times its expected latency
+            (and at least `hedge_min_delay` seconds) is also sent to another worker, and the
+            first answer wins. 0 disables hedging.
+        max_retries: How many times a failed chunk is resent to another worker.
+    """
+    def __init__(
+        self,
+        worker_configs: List[Dict[str, Any]],
+        use_shm: bool = False,
+        max_chunk_cost: int = None,
+        worker_concurrency: int = 4,
+        request_timeout: float = 600,
+        hedge_factor: float = 2.0,
+        hedge_min_delay: float = 10.0,
+        max_retries: int = 1,
+    ):
         self.server_urls = self._build_server_urls(worker_configs)
         print(f"{len(self.server_urls)=}, {worker_configs=}", flush=True)
-        self.executor = ThreadPoolExecutor(max_workers=len(self.server_urls))
+        self.worker_concurrency = worker_concurrency
+        self.request_timeout = request_timeout
+        self.hedge_factor = hedge_factor
+        self.hedge_min_delay = hedge_min_delay
+        self.max_retries = max_retries
+        self.session = None
+        self.scheduler = LoadAwareScheduler(self.server_urls)
+        # groups above this many visual tokens are split across workers, by default a group
+        # is split when it exceeds a fair per-worker share of its batch
+        self.max_chunk_cost = max_chunk_cost
+        # image data for workers on this host goes through shared memory instead of HTTP
+        self.shm_server_urls = {
+            f"http://{conf['host']}:{conf['base_port'] + i}"
+            for conf in worker_configs
+            if use_shm and is_local_host(conf['host'])
+            for i in range(conf['num_servers'])
+        }
 
         logger.info("🚀 Proxy initialized")
         logger.info(f"  -> servers {self.server_urls=} ...")
 
+    async def start(self):
+        self.session = ClientSession(
+            connector=TCPConnector(limit=0, limit_per_host=self.worker_concurrency),
+            timeout=ClientTimeout(total=self.request_timeout),
+        )
+
+    async def close(self):
+        await self.session.close()
+
     @staticmethod
     def _build_server_urls(worker_configs: List[Dict[str, Any]]) -> Dict[str, List[str]]:
         server_urls = []
@@ -115,25 +340,96 @@ class RewardProxy:
 
         return server_urls
 
-    def _send_request_to_worker(
-        self, server_url: str, batch_data: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        """Send request to a single worker server and return the result."""
+    async def _send_request_to_worker(
+        self, server_url: str, batch_data: Dict[str, Any], cost: int = 0
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Send request to a single worker server and return the result, or None on failure."""
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+        success = False
+        cancelled = False
+        shm = None
+        # images arrive as encoded views of the client request and are forwarded untouched
+        encoding = loop.run_in_executor(
+            None, functools.partial(encode_message, batch_data, use_shm=server_url in self.shm_server_urls)
+        )
         try:
-            response = requests.post(
-                server_url,
-                data=pickle.dumps(batch_data),
-                headers={"Content-Type": "application/octet-stream"},
-                timeout=600,  # 300 seconds timeout
-            )
-            response.raise_for_status()  # Raise exception for 4xx or 5xx status codes
-            return pickle.loads(response.content)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request to server {server_url} failed: {e}")
-        except pickle.PickleError as e:
-            logger.error(f"Failed to parse response from {server_url}: {e}")
+            try:
+                # shielded so that a cancelled attempt leaves the job running and can release its segment
+                data, shm = await asyncio.shield(encoding)
+            except Exception as e:
+                logger.error(f"Failed to encode request for {server_url}: {e!r}")
+                return None
+            async with self.session.post(server_url, data=data, headers={"Content-Type": CONTENT_TYPE}) as response:
+                response.raise_for_status()  # Raise exception for 4xx or 5xx status codes
+                body = await response.read()
+            result = await loop.run_in_executor(None, decode_message, body)
+            if not isinstance(result, list) or len(result) != len(batch_data["output_image"]):
+                logger.error(f"Server {server_url} returned an invalid result: {str(result)[:200]}")
+                return None
+            success = True
+            return result
+        except asyncio.CancelledError:
+            cancelled = True
+            if shm is None:
+                encoding.add_done_callback(release_encoded_shm)
+            raise
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Request to server {server_url} failed: {e!r}")
+        except Exception as e:
+            # e.g. a malformed reply: fail this attempt only, so that hedging and retries go on
+            logger.exception(f"Failed to handle response from {server_url}: {e!r}")
+        finally:
+            self.scheduler.complete(server_url, cost, time.time() - start_time, success, cancelled)
+            if shm is not None:
+                shm.close()
+                shm.unlink()
         return None  # Return None to indicate failure
-    
+
+    async def _dispatch_chunk(
+        self, server_url: str, batch_data: Dict[str, Any], cost: int
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Send a chunk to its assigned worker. If it is slow, hedge on another worker; if it
+        fails, retry on another worker up to `max_retries` times. Returns the first successful
+        result, or None once every attempt has failed.
+        """
+        tried = {server_url}
+        attempts = {asyncio.ensure_future(self._send_request_to_worker(server_url, batch_data, cost))}
+        retries = 0
+
+        hedge_deadline = None
+        expected_latency = self.scheduler.expected_latency(server_url, cost)
+        if self.hedge_factor > 0 and expected_latency is not None:
+            hedge_deadline = time.time() + max(self.hedge_min_delay, self.hedge_factor * expected_latency)
+
+        try:
+            while attempts:
+                timeout = None if hedge_deadline is None else max(hedge_deadline - time.time(), 0)
+                done, attempts = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result() is not None:
+                        return task.result()
+
+                next_server_url = None
+                if not done:
+                    hedge_deadline = None
+                    next_server_url = self.scheduler.pick(cost, exclude=tried)
+                    if next_server_url is not None:
+                        logger.info(f"Hedging slow request to {server_url} on {next_server_url}")
+                elif not attempts and retries < self.max_retries:
+                    retries += 1
+                    next_server_url = self.scheduler.pick(cost, exclude=tried)
+                    if next_server_url is not None:
+                        logger.info(f"Retrying failed request on {next_server_url} ({retries}/{self.max_retries})")
+                if next_server_url is not None:
+                    tried.add(next_server_url)
+                    attempts.add(asyncio.ensure_future(self._send_request_to_worker(next_server_url, batch_data, cost)))
+            return None
+        finally:
+            for task in attempts:
+                task.cancel()
+
     def rebatch_with_instruction(
         self,
         input_images,
@@ -157,55 +453,60 @@ class RewardProxy:
         return input_images_group, output_image_group, meta_datas_group, original_index_group
 
 
-    def process_batch(
+    async def process_batch(
         self,
         input_images,
         output_image: List,
         meta_datas: List,
         **kwargs,
-    ) -> Dict[str, List[Any]]:
+    ) -> List[Dict[str, Any]]:
         """
-        Dispatch batch tasks to the specified type of worker servers and merge results.
+        Dispatch batch tasks to the specified type of worker servers and merge results. Chunks
+        that failed on every worker are left out, `reorder_results` fills their slots.
         """
 
         input_images_group, output_image_group, meta_datas_group, original_index_group = self.rebatch_with_instruction(input_images, output_image, meta_datas)
-        
+
         num_workers = len(self.server_urls)
 
-        original_index = []
-        futures = []
-        for i, key in enumerate(input_images_group.keys()):
-            server_url = self.server_urls[i % num_workers]
+        sample_costs = [estimate_sample_cost(_input_images, _output_image) for _input_images, _output_image in zip(input_images, output_image)]
+        max_chunk_cost = self.max_chunk_cost or max(-(-sum(sample_costs) // num_workers), 1)
+
+        # chunks hold positions within their instruction group
+        chunks = []
+        for key in input_images_group.keys():
+            group_costs = [sample_costs[i] for i in original_index_group[key]]
+            for chunk in split_group(list(range(len(group_costs))), group_costs, max_chunk_cost):
+                chunks.append((key, chunk, sum(group_costs[j] for j in chunk)))
+
+        assignment = self.scheduler.assign([cost for _, _, cost in chunks])
+
+        tasks = []
+        for (key, chunk, cost), server_url in zip(chunks, assignment):
             payload = {
-                "input_images": input_images_group[key],
-                "output_image": output_image_group[key],
-                "meta_data": meta_datas_group[key],
+                "input_images": [input_images_group[key][j] for j in chunk],
+                "output_image": [output_image_group[key][j] for j in chunk],
+                "meta_data": [meta_datas_group[key][j] for j in chunk],
                 **kwargs,  # Pass use_flowgrpo, debug, etc.
             }
-            # print(f"{server_url=}, {start_idx + i * size_per_worker}:{min(start_idx + (i + 1) * size_per_worker, end_idx)}: {len(payload['input_images'])=}, {len(payload['output_image'])=}, {len(payload['meta_data'])=}", flush=True)
-            futures.append(
-                self.executor.submit(self._send_request_to_worker, server_url, payload)
-            )
+            tasks.append(self._dispatch_chunk(server_url, payload, cost))
 
-            original_index.extend(original_index_group[key])
-        
-        inverse_original_index = {i: idx for idx, i in enumerate(original_index)}
+        logger.info(f"Dispatched {len(input_images_group)} groups as {len(chunks)} chunks to {len(set(assignment))}/{num_workers} workers")
 
-        # Merge all successful results
+        # Merge all successful results, each item carries its original index in meta_data
         merged_results = []
-        for future in futures:
-            result = future.result()
+        for (key, chunk, cost), result in zip(chunks, await asyncio.gather(*tasks)):
+            if result is None:
+                logger.error(f"Chunk of {len(chunk)} samples for instruction {key[:50]!r} failed on every worker, returning partial results")
+                continue
             merged_results.extend(result)
 
-        # reorder results by original index
-        merged_results = [merged_results[inverse_original_index[i]] for i in range(len(original_index))]
-
         return merged_results
 
 
 def prepare_request_data(request_body: bytes) -> Tuple[List, List, str, Dict]:
-    """Parse request body and add original index to meta data."""
-    data = pickle.loads(request_body)
+    """Parse request body and add original index to meta data. Images are not decoded."""
+    data = decode_message(request_body, decode_images=False)
     input_images = data["input_images"]
     output_image = data["output_image"]
     meta_datas = data["meta_datas"]
@@ -220,12 +521,12 @@ def prepare_request_data(request_body: bytes) -> Tuple[List, List, str, Dict]:
     return input_images, output_image, meta_datas, server_type
 
 
-# Flask route
-@app.route("/", methods=["POST"])
-def evaluate():
+async def evaluate(request: web.Request) -> web.Response:
+    proxy = request.app["proxy"]
+    loop = asyncio.get_running_loop()
     try:
-        input_images, output_image, meta_datas, server_type = prepare_request_data(
-            request.data
+        input_images, output_image, meta_datas, server_type = await loop.run_in_executor(
+            None, prepare_request_data, await request.read()
         )
         original_batch_size = len(output_image)
         logger.info(
@@ -233,28 +534,54 @@ def evaluate():
         )
     except Exception as e:
         logger.error(f"Failed to parse request: {e}", exc_info=True)
-        # Return a JSON error, more universal than pickle
-        return jsonify(
-            {"error": "Failed to parse request data", "details": str(e)}
-        ), 400
+        # Return a JSON error, readable without the wire codec
+        return web.json_response(
+            {"error": "Failed to parse request data", "details": str(e)}, status=400
+        )
 
     start_time = time.time()
 
-    proxy = app.proxy
     # Dispatch processing
-    merged_results = proxy.process_batch(
+    merged_results = await proxy.process_batch(
         input_images, output_image, meta_datas
     )
 
     # Reorder results by index
-    ordered_result = reorder_results(merged_results, original_batch_size, app)
+    ordered_result = reorder_results(merged_results, original_batch_size)
 
     total_time = time.time() - start_time
     logger.info(
         f"Evaluation complete! Total time: {total_time:.3f}s ({total_time / original_batch_size * 1000:.1f} ms/image)"
     )
 
-    return pickle.dumps(ordered_result)
+    utilization = ", ".join(
+        f"{server_url}: {worker['utilization']:.0%}" for server_url, worker in proxy.scheduler.report().items()
+    )
+    logger.info(f"Worker utilization: {utilization}")
+
+    body, _ = await loop.run_in_executor(None, encode_message, ordered_result)
+    return web.Response(body=body, content_type=CONTENT_TYPE)
+
+
+async def stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app["proxy"].scheduler.report())
+
+
+def create_app(proxy: RewardProxy) -> web.Application:
+    app = web.Application(client_max_size=1 << 31)
+    app["proxy"] = proxy
+    app.router.add_post("/", evaluate)
+    app.router.add_get("/stats", stats)
+
+    async def start_proxy(app: web.Application):
+        await proxy.start()
+
+    async def close_proxy(app: web.Application):
+        await proxy.close()
+
+    app.on_startup.append(start_proxy)
+    app.on_cleanup.append(close_proxy)
+    return app
 
 
 def main():
@@ -266,6 +593,22 @@ def main():
         default="server_configs/editscore_7B.yml",
         help="Configuration file path",
     )
+    parser.add_argument(
+        "--use_shm",
+        action="store_true",
+        help="Hand images to workers on this host through shared memory instead of the HTTP body, the workers must run with --allow_shm",
+    )
+    parser.add_argument(
+        "--max_chunk_cost",
+        type=int,
+        default=None,
+        help="Visual token budget above which an instruction group is split across workers, defaults to a per-worker share of the batch",
+    )
+    parser.add_argument("--worker_concurrency", type=int, default=4, help="Concurrent requests and keep-alive connections per worker")
+    parser.add_argument("--request_timeout", type=float, default=600, help="Timeout of one worker request in seconds")
+    parser.add_argument("--hedge_factor", type=float, default=2.0, help="Hedge a request on another worker after this many times its expected latency, 0 disables hedging")
+    parser.add_argument("--hedge_min_delay", type=float, default=10.0, help="Minimum seconds before a request is hedged")
+    parser.add_argument("--max_retries", type=int, default=1, help="Times a failed request is resent to another worker")
     # parser.add_argument("--port", type=int, default=23456, help="Proxy server port")
 
     # parser.add_argument("--worker_host", type=str, default="127.0.0.1")
@@ -294,14 +637,20 @@ def main():
             }
         )
 
-    proxy_instance = RewardProxy(worker_configs)
-    app.proxy = proxy_instance
+    proxy_instance = RewardProxy(
+        worker_configs,
+        use_shm=args.use_shm,
+        max_chunk_cost=args.max_chunk_cost,
+        worker_concurrency=args.worker_concurrency,
+        request_timeout=args.request_timeout,
+        hedge_factor=args.hedge_factor,
+        hedge_min_delay=args.hedge_min_delay,
+        max_retries=args.max_retries,
+    )
 
     logger.info(f"Starting proxy server at {worker_configs=}")
 
-    app.run(
-        host=args.host, port=proxy_port, debug=False, threaded=True, use_reloader=False
-    )
+    web.run_app(create_app(proxy_instance), host=args.host, port=proxy_port, print=None)
 
 
 if __name__ == "__main__":
@@ -4,29 +4,34 @@ dotenv.load_dotenv(override=True)
 
 from typing import List, Optional
 import argparse
-import pickle
+import asyncio
+import hashlib
 import json
 import os
-import warnings
+import sys
 import threading
-from queue import Queue
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Tuple
 import uuid
 import time
 
-from flask import Flask, request, jsonify
+from aiohttp import web
 from PIL import Image
 
 from editscore import EditScore
+from editscore.mllm_tools.utils import image_hash
 import yaml
 
-warnings.filterwarnings("ignore")
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-app = Flask(__name__)
+from omnigen2.grpo.reward_wire import CONTENT_TYPE, encode_message, decode_message
 
-# --- Global queue and result storage ---
-request_queue = Queue()
-results = {} # Use a dict to store results, associated by unique ID
+warnings.filterwarnings("ignore")
+
+# Qwen-VL encodes each 28x28 pixel patch into one visual token
+PIXELS_PER_VISUAL_TOKEN = 28 * 28
 
 def apply_chat_template(prompt, num_images: int = 2):
     """
@@ -37,9 +42,65 @@ def apply_chat_template(prompt, num_images: int = 2):
     template += f"{prompt}<|im_end|>\n<|im_start|>assistant\n"
     return template
 
+class ResultCache:
+    """
+    LRU cache of scoring outputs keyed by the content of a sample, bounded in number of entries
+    and expiring entries older than `ttl` seconds.
+    """
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
 class VLMScorer:
-    """Encapsulates vLLM model and scoring logic."""
-    def __init__(self, config: Dict[str, any]):
+    """
+    Encapsulates vLLM model and scoring logic.
+
+    With `result_cache_size` > 0, outputs are cached by the content hashes of the instruction,
+    the input images and the output image together with the scorer config, so re-evaluating an
+    identical sample skips the model. Samples whose meta data sets `bypass_cache` are always
+    scored, and their result is not cached.
+    """
+    def __init__(self, config: Dict[str, any], result_cache_size: int = 0, result_cache_ttl: float = 3600):
         print("🔧 Initializing VLMScorer...")
         self.scorer = EditScore(
             backbone=config["backbone"],
@@ -53,10 +114,60 @@ class VLMScorer:
             num_pass=config["num_pass"],
             lora_path=config["lora_path"],
             seed=config["seed"],
+            adaptive_pass=config.get("adaptive_pass", False),
+            min_pass=config.get("min_pass", 2),
+            pass_std_threshold=config.get("pass_std_threshold", 0.5),
+            guided_decoding=config.get("guided_decoding", False),
+            merge_lora=config.get("merge_lora", False),
         )
+        self.result_cache = ResultCache(result_cache_size, result_cache_ttl) if result_cache_size > 0 else None
+        self.config_hash = hashlib.blake2b(json.dumps(config, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
         print("✅ VLMScorer initialization complete.")
 
+    def _cache_keys(self, input_images: List[List[Image.Image]], output_image: List[Image.Image], metadata: Dict[str, any]) -> List[str]:
+        # source images are shared by the samples of a group, hash each object once
+        hashes = dict()
+        def _hash(image):
+            if id(image) not in hashes:
+                hashes[id(image)] = image_hash(image)
+            return hashes[id(image)]
+
+        keys = []
+        for _input_images, _output_image, _metadata in zip(input_images, output_image, metadata):
+            key_string = json.dumps([
+                self.config_hash,
+                _metadata['instruction'],
+                [_hash(image) for image in _input_images],
+                _hash(_output_image),
+            ])
+            keys.append(hashlib.blake2b(key_string.encode(), digest_size=16).hexdigest())
+        return keys
+
     def score(self, input_images: List[List[Image.Image]], output_image: List[Image.Image], metadata: Dict[str, any]) -> float:
+        """Score a batch of samples, serving repeated samples from the result cache when enabled."""
+        if self.result_cache is None:
+            return self._score(input_images, output_image, metadata)
+
+        keys = self._cache_keys(input_images, output_image, metadata)
+        outputs = [
+            None if _metadata.get('bypass_cache', False) else self.result_cache.get(key)
+            for key, _metadata in zip(keys, metadata)
+        ]
+        misses = [i for i, output in enumerate(outputs) if output is None]
+        if misses:
+            miss_outputs = self._score(
+                [input_images[i] for i in misses], [output_image[i] for i in misses], [metadata[i] for i in misses]
+            )
+            for i, output in zip(misses, miss_outputs):
+                outputs[i] = output
+                if not metadata[i].get('bypass_cache', False):
+                    self.result_cache.put(keys[i], output)
+
+        result_cache_stats = self.result_cache.stats()
+        print(f"📊 Result cache: {len(outputs) - len(misses)}/{len(outputs)} samples served from cache, hit rate {result_cache_stats['hit_rate']:.2%}, {result_cache_stats['entries']} entries, {result_cache_stats['expirations']} expired, {result_cache_stats['evictions']} evicted", flush=True)
+        return outputs
+
+    def _score(self, input_images: List[List[Image.Image]], output_image: List[Image.Image], metadata: Dict[str, any]) -> float:
         """Score a batch of samples."""
         
         image_prompts = []
@@ -65,6 +176,16 @@ class VLMScorer:
             
         results = self.scorer.batch_evaluate(image_prompts, [_metadata['instruction'] for _metadata in metadata])
 
+        prefix_stats = self.scorer.prefix_cache_stats()
+        if prefix_stats:
+            print(f"📊 Prefix cache hit rate: {prefix_stats['prefix_hit_rate']:.2%} ({prefix_stats['num_cached_tokens']}/{prefix_stats['num_prompt_tokens']} prompt tokens)", flush=True)
+        image_cache_stats = self.scorer.image_cache_stats()
+        if image_cache_stats:
+            print(f"📊 Image cache hit rate: {image_cache_stats['hit_rate']:.2%}, {image_cache_stats['entries']} entries, {image_cache_stats['bytes'] / 2**20:.1f} MiB, {image_cache_stats['evictions']} evictions", flush=True)
+        if self.scorer.adaptive_pass:
+            pass_stats = self.scorer.pass_stats()
+            print(f"📊 Adaptive passes: {pass_stats['mean_passes']:.2f} passes per sample (cap {self.scorer.num_pass}) over {pass_stats['num_samples']} samples", flush=True)
+
         outputs = []
         for result in results:
             reward = result['O_score'] / 10
@@ -77,45 +198,117 @@ class VLMScorer:
             outputs.append((reward, reasoning))
         return outputs
 
-def vlm_worker(scorer: VLMScorer):
-    """Background worker thread, continuously fetches and processes tasks from the queue."""
-    print("🚀 VLM background worker thread started, waiting for tasks...")
+def build_result_payload(outputs, meta_data):
+    result_payload = []
+    for (reward, reasoning), _meta_data in zip(outputs, meta_data):
+        result_payload.append(
+            {
+                "score": 1.0 if reward >= 0.5 else 0.0,
+                "reward": reward,
+                "reasoning": reasoning,
+                "strict_reward": reward,
+                "meta_data": _meta_data,
+                "group_reward": {_meta_data.get("tag", "vlm"): reward},
+                "group_strict_reward": {_meta_data.get("tag", "vlm"): reward},
+            }
+        )
+    return result_payload
+
+def estimate_visual_tokens(input_images: List[List[Image.Image]], output_image: List[Image.Image]) -> int:
+    """Rough number of visual tokens of a request, used to budget coalesced batches."""
+    num_pixels = sum(image.width * image.height for images in input_images for image in images)
+    num_pixels += sum(image.width * image.height for image in output_image)
+    return num_pixels // PIXELS_PER_VISUAL_TOKEN
+
+class Task:
+    """A parsed request waiting in the queue, resolved through `future` by the batcher."""
+    def __init__(self, input_images, output_image, meta_data, future: asyncio.Future):
+        self.task_id = str(uuid.uuid4())
+        self.input_images = input_images
+        self.output_image = output_image
+        self.meta_data = meta_data
+        self.future = future
+        self.num_samples = len(output_image)
+        self.num_tokens = estimate_visual_tokens(input_images, output_image)
+
+async def vlm_worker(
+    scorer: VLMScorer,
+    request_queue: asyncio.Queue,
+    max_batch_size: int,
+    max_batch_tokens: Optional[int],
+    coalesce_ms: float,
+):
+    """
+    Background batcher: takes the oldest queued request, coalesces the requests queued behind
+    it (waiting up to `coalesce_ms` for more) while the batch stays within `max_batch_size`
+    samples and `max_batch_tokens` estimated visual tokens, and scores them with a single
+    `batch_evaluate` call. The model runs in a dedicated thread so the event loop keeps
+    accepting requests meanwhile.
+    """
+    print("🚀 VLM background worker started, waiting for tasks...")
+    loop = asyncio.get_running_loop()
+    model_executor = ThreadPoolExecutor(max_workers=1)
+    pending = None
     while True:
-        try:
-            task_id, input_images, output_image, meta_data = request_queue.get()
-            
-            # print(f"🔩 Start processing task {task_id[:8]}...")
-            outputs = scorer.score(input_images, output_image, meta_data)
-            result_payload = []
-            for (reward, reasoning), _meta_data in zip(outputs, meta_data):
-                result_payload.append(
-                    {
-                        "score": 1.0 if reward >= 0.5 else 0.0,
-                        "reward": reward,
-                        "reasoning": reasoning,
-                        "strict_reward": reward,
-                        "meta_data": _meta_data,
-                        "group_reward": {_meta_data.get("tag", "vlm"): reward},
-                        "group_strict_reward": {_meta_data.get("tag", "vlm"): reward},
-                    }
-                )
-            results[task_id] = pickle.dumps(result_payload)
+        batch = [pending if pending is not None else await request_queue.get()]
+        pending = None
+        num_samples = batch[0].num_samples
+        num_tokens = batch[0].num_tokens
+
+        deadline = loop.time() + coalesce_ms / 1000
+        while num_samples < max_batch_size:
+            try:
+                task = request_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    task = await asyncio.wait_for(request_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if num_samples + task.num_samples > max_batch_size or (
+                max_batch_tokens is not None and num_tokens + task.num_tokens > max_batch_tokens
+            ):
+                pending = task
+                break
+            batch.append(task)
+            num_samples += task.num_samples
+            num_tokens += task.num_tokens
 
+        # requests whose handler already gave up are not worth scoring
+        batch = [task for task in batch if not task.future.done()]
+        if not batch:
+            continue
+
+        input_images = [images for task in batch for images in task.input_images]
+        output_image = [image for task in batch for image in task.output_image]
+        meta_data = [_meta_data for task in batch for _meta_data in task.meta_data]
+        print(f"🔩 Scoring {len(batch)} coalesced requests, {len(output_image)} samples, ~{num_tokens} visual tokens, {request_queue.qsize()} requests still queued", flush=True)
+
+        try:
+            outputs = await loop.run_in_executor(model_executor, scorer.score, input_images, output_image, meta_data)
+            result_payload = build_result_payload(outputs, meta_data)
+            start = 0
+            for task in batch:
+                if not task.future.done():
+                    task.future.set_result(encode_message(result_payload[start:start + task.num_samples])[0])
+                start += task.num_samples
         except Exception as e:
-            print(f"❌ Worker thread error while processing task {task_id[:8]}: {e}")
+            print(f"❌ Worker error while processing tasks {[task.task_id[:8] for task in batch]}: {e}")
             import traceback
             traceback.print_exc()
-            error_result = {"error": f"Internal server error: {e}"}
-            results[task_id] = pickle.dumps(error_result)
-        finally:
-            request_queue.task_done()
+            error_result = encode_message({"error": f"Internal server error: {e}"})[0]
+            for task in batch:
+                if not task.future.done():
+                    task.future.set_result(error_result)
 
-# --- Web layer (Flask App) ---
+# --- Web layer (aiohttp) ---
 
-def parse_and_validate_request(raw_data: bytes) -> Tuple[List[Image.Image], Image.Image, Dict, str]:
+def parse_and_validate_request(raw_data: bytes, allow_shm: bool = False) -> Tuple[List[Image.Image], Image.Image, Dict, str]:
     """Parse request data, validate and convert to required format."""
     try:
-        data = pickle.loads(raw_data)
+        data = decode_message(raw_data, allow_shm=allow_shm)
         input_images_datas = data['input_images']
         output_image_datas = data['output_image']
         meta_data = data['meta_data']
@@ -123,15 +316,23 @@ def parse_and_validate_request(raw_data: bytes) -> Tuple[List[Image.Image], Imag
         print(f"Failed to parse request data: {e}")
         return None, None, None, f"Failed to parse request data: {e}"
     
+    # images sent once for several samples decode to one object, convert it once so that the
+    # samples keep sharing it and its preprocessing is cached by the scorer
+    converted = dict()
+    def _convert(image):
+        if id(image) not in converted:
+            converted[id(image)] = image.convert('RGB')
+        return converted[id(image)]
+
     batch_output_image = []
     for output_image_data in output_image_datas:
-        batch_output_image.append(output_image_data.convert('RGB'))
+        batch_output_image.append(_convert(output_image_data))
 
     batch_input_images = []
     for input_image_data in input_images_datas:
         batch_input_images.append([])
         for _input_image_data in input_image_data:
-            batch_input_images[-1].append(_input_image_data.convert('RGB'))
+            batch_input_images[-1].append(_convert(_input_image_data))
     
     batch_meta_data = []
     for _meta_data in meta_data:
@@ -146,64 +347,96 @@ def parse_and_validate_request(raw_data: bytes) -> Tuple[List[Image.Image], Imag
         batch_meta_data.append(_meta_data)
     return batch_input_images, batch_output_image, batch_meta_data, None
 
-@app.route('/', methods=['POST'])
-def evaluate_batch_samples():
-    """Receive request, put it into the queue, and wait for the result to return."""
-    
-    input_images, output_image, meta_data, error_msg = parse_and_validate_request(request.data)
+async def evaluate_batch_samples(request: web.Request) -> web.Response:
+    """Receive request, put it into the queue, and await its result."""
+    app = request.app
+    loop = asyncio.get_running_loop()
+    raw_data = await request.read()
+    # unpickling and converting images is CPU bound, keep it off the event loop
+    input_images, output_image, meta_data, error_msg = await loop.run_in_executor(
+        None, parse_and_validate_request, raw_data, app["allow_shm"]
+    )
     if error_msg:
         print(f"❌ Request validation failed: {error_msg}")
-        return jsonify({"error": error_msg}), 400
-    
-    task_id = str(uuid.uuid4())
-    request_queue.put((task_id, input_images, output_image, meta_data))
-    print(f"📥 Task {task_id[:8]} enqueued, {len(input_images)=}, {len(output_image)=}, {len(meta_data)=}, current queue size: {request_queue.qsize()}", flush=True)
+        return web.json_response({"error": error_msg}, status=400)
 
-    timeout_seconds = 600
+    request_queue = app["request_queue"]
+    timeout_seconds = app["request_timeout"]
     start_time = time.time()
+    task = Task(input_images, output_image, meta_data, loop.create_future())
 
-    while True:
-        if task_id in results:
-            result_data = results.pop(task_id)
-            print(f"📤 Task {task_id[:8]} result returned. Time elapsed: {time.time() - start_time:.2f}s")
-            return result_data, 200, {'Content-Type': 'application/octet-stream'}
-        
-        if time.time() - start_time > timeout_seconds:
-            print(f"⌛️ Task {task_id[:8]} timed out waiting.")
-            return jsonify({"error": "Request timed out"}), 504
-            
-        time.sleep(0.05)
+    # backpressure: once `max_queue_depth` requests are queued, new requests wait here
+    # instead of growing the queue, and are rejected if no slot frees up in time
+    try:
+        await asyncio.wait_for(request_queue.put(task), timeout_seconds)
+    except asyncio.TimeoutError:
+        print(f"⌛️ Task {task.task_id[:8]} rejected, queue full ({request_queue.qsize()} requests).")
+        return web.json_response({"error": "Server overloaded"}, status=503)
+    print(f"📥 Task {task.task_id[:8]} enqueued, {len(input_images)=}, {len(output_image)=}, {len(meta_data)=}, current queue size: {request_queue.qsize()}", flush=True)
+
+    try:
+        result_data = await asyncio.wait_for(
+            asyncio.shield(task.future), timeout_seconds - (time.time() - start_time)
+        )
+    except asyncio.TimeoutError:
+        task.future.cancel()
+        print(f"⌛️ Task {task.task_id[:8]} timed out waiting.")
+        return web.json_response({"error": "Request timed out"}, status=504)
+
+    print(f"📤 Task {task.task_id[:8]} result returned. Time elapsed: {time.time() - start_time:.2f}s")
+    return web.Response(body=result_data, content_type=CONTENT_TYPE)
+
+def create_app(scorer: VLMScorer, args) -> web.Application:
+    app = web.Application(client_max_size=args.client_max_size)
+    app.router.add_post('/', evaluate_batch_samples)
+    app["request_timeout"] = args.request_timeout
+    app["allow_shm"] = args.allow_shm
+
+    async def start_worker(app: web.Application):
+        app["request_queue"] = asyncio.Queue(maxsize=args.max_queue_depth)
+        app["worker"] = asyncio.create_task(
+            vlm_worker(scorer, app["request_queue"], args.max_batch_size, args.max_batch_tokens, args.coalesce_ms)
+        )
+
+    async def stop_worker(app: web.Application):
+        app["worker"].cancel()
+
+    app.on_startup.append(start_worker)
+    app.on_cleanup.append(stop_worker)
+    return app
 
 
 def arg_parser():
-    parser = argparse.ArgumentParser(description='VLM Reward Server - High concurrency optimized (Flask native server)')
+    parser = argparse.ArgumentParser(description='VLM Reward Server - High concurrency optimized (asyncio server with request coalescing)')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Server host (0.0.0.0 means listen on all interfaces)')
     parser.add_argument('--port', type=int, default=18096, help='Server port')
     parser.add_argument('--config_path', type=str, default='examples/OmniGen2-RL/reward_server/server_configs/editscore_7B.yml', help='Configuration file path')
+    parser.add_argument('--max_batch_size', type=int, default=512, help='Maximum number of samples scored by one coalesced batch_evaluate call')
+    parser.add_argument('--max_batch_tokens', type=int, default=None, help='Maximum estimated visual tokens of one coalesced batch, unlimited by default')
+    parser.add_argument('--coalesce_ms', type=float, default=5.0, help='How long the worker waits for more requests to join a batch')
+    parser.add_argument('--max_queue_depth', type=int, default=64, help='Maximum number of queued requests before new requests are held back')
+    parser.add_argument('--request_timeout', type=float, default=600, help='Seconds a request may wait for its result')
+    parser.add_argument('--allow_shm', action='store_true', help='Accept images through shared memory from a proxy on this host (proxy --use_shm)')
+    parser.add_argument('--client_max_size', type=int, default=1 << 30, help='Maximum request body size in bytes')
+    parser.add_argument('--result_cache_size', type=int, default=0, help='Maximum number of cached scoring results, 0 disables the result cache')
+    parser.add_argument('--result_cache_ttl', type=float, default=3600, help='Seconds after which a cached scoring result expires')
     args = parser.parse_args()
     return args
 
 def main(args):
-    """Main function, loads model, starts background worker thread and web server."""
+    """Main function, loads model, starts background worker and web server."""
 
     # 1. Load model
     print("⚡ Preloading VLM model...")
     config = yaml.load(open(args.config_path, "r"), Loader=yaml.FullLoader)
-    scorer = VLMScorer(config["reward"])
+    scorer = VLMScorer(config["reward"], result_cache_size=args.result_cache_size, result_cache_ttl=args.result_cache_ttl)
     
-    # 2. Start background worker thread
-    worker_thread = threading.Thread(target=vlm_worker, args=(scorer,), daemon=True)
-    worker_thread.start()
-
-    # 3. Start Flask web server
+    # 2. Start asyncio web server, the batching worker is started with the event loop
     print(f"🔥 Starting VLM reward server at http://{args.host}:{args.port}")
-    print("🚀 Mode: High concurrency single-sample requests (queue-based processing)")
-    
-    # Use Flask's built-in development server with threading enabled
+    print("🚀 Mode: High concurrency requests (coalesced into batched scoring)")
+
     try:
-        # threaded=True allows the server to handle multiple HTTP requests simultaneously
-        # use_reloader=False is necessary when using background threads to prevent the reloader from creating duplicate threads and model instances
-        app.run(host=args.host, port=args.port, debug=False, threaded=True, use_reloader=False)
+        web.run_app(create_app(scorer, args), host=args.host, port=args.port, print=None)
     except KeyboardInterrupt:
         print("\n👋 VLM server stopped.")
     except Exception as e:
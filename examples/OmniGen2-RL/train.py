@@ -57,7 +57,7 @@ from omnigen2.utils.tensor_util import pad_to_length, expand_as
 from omnigen2.dataset.omnigen2_train_dataset import OmniGen2TrainDataset, OmniGen2Collator, RepeatedDistributedBatchSampler
 from omnigen2.models.transformers.transformer_omnigen2 import OmniGen2Transformer2DModel
 from omnigen2.models.transformers.repo import OmniGen2RotaryPosEmbed
-from omnigen2.grpo.reward_client_edit import evaluate_images
+from omnigen2.grpo.reward_client_edit import evaluate_images, submit_evaluate_images
 from omnigen2.grpo.utils import forward_logprob, process_grpo_rewards, compute_single_step_ppo_loss
 from omnigen2.pipelines.omnigen2.pipeline_omnigen2 import FMPipelineOutput
 
@@ -228,6 +228,18 @@ def disabled_adapters(model):
                     module.disable_adapters = False
 
 
+def unpack_reward_result(result, num_samples: int):
+    """
+    (rewards, reasoning, meta_data) of a reward client result. A request that failed for good
+    (None) scores its samples 0 so that this rank keeps up with the collectives of the others.
+    """
+    if result is None:
+        logger.warning(f"Reward request for {num_samples} samples failed, using zero rewards", main_process_only=False)
+        return [0.0] * num_samples, [""] * num_samples, [{} for _ in range(num_samples)]
+    _, rewards, reasoning, meta_data = result
+    return rewards, reasoning, meta_data
+
+
 def main(args):
     accelerator_project_config = ProjectConfiguration(project_dir=args.output_dir, logging_dir=Path(args.output_dir, 'logs'))
 
@@ -595,6 +607,11 @@ def main(args):
         ref_latents_N, ref_img_mask_N, l_effective_ref_img_len_N, ref_img_sizes_N = pipeline.transformer.flat_and_pad_to_seq_ref_img(None, args.train.rl.batch_size_per_forward, weight_dtype, accelerator.device)
 
     reward_server_config = OmegaConf.load(args.reward_server_config)
+    reward_client_kwargs = dict(
+        proxy_host=reward_server_config.server.hosts[0],
+        proxy_port=reward_server_config.server.proxy_port,
+        server_type=args.train.rl.get('server_type', 'vlm'),
+    )
     
     for epoch in range(first_epoch, args.train.num_train_epochs):
         if 'max_train_steps' in args.train and global_step >= args.train.max_train_steps:
@@ -611,6 +628,20 @@ def main(args):
             total_results = None
             total_text_feats = None
 
+            for i in range(len(batch['meta_data'])):
+                json_data = json.loads(batch['meta_data'][i])
+                json_data['id'] = f"{global_step * args.train.global_batch_size + accelerator.process_index * args.train.batch_size + i}"
+                batch['meta_data'][i] = json.dumps(json_data)
+
+            # with pipelined_reward, each chunk is sent to the reward server as soon as it is
+            # generated, so that scoring overlaps with sampling the remaining chunks
+            pipelined_reward = args.train.rl.get('pipelined_reward', False)
+            # with per_rank_reward, every rank sends its own samples to the reward proxy instead of
+            # gathering all images on rank 0; GRPO groups are still formed across ranks by
+            # process_grpo_rewards, which gathers rewards and prompts
+            per_rank_reward = args.train.rl.get('per_rank_reward', False)
+            reward_futures = []
+
             batch_size_per_forward = args.train.rl.batch_size_per_forward
             for i in range(args.train.batch_size // batch_size_per_forward):
                 with torch.no_grad():
@@ -640,6 +671,35 @@ def main(args):
                         do_normalize=False
                     )
 
+                    if pipelined_reward and per_rank_reward:
+                        chunk = slice(i * batch_size_per_forward, (i + 1) * batch_size_per_forward)
+                        # copies: the reward thread may still be encoding while results.images
+                        # grows into total_results.images below
+                        reward_futures.append((
+                            submit_evaluate_images(
+                                input_images=list(input_images_pil[chunk]),
+                                output_image=list(results.images),
+                                meta_datas=list(batch['meta_data'][chunk]),
+                                **reward_client_kwargs
+                            ),
+                            len(results.images),
+                        ))
+                    elif pipelined_reward:
+                        chunk = slice(i * batch_size_per_forward, (i + 1) * batch_size_per_forward)
+                        gathered_chunk_input_images_pil = gather_object(input_images_pil[chunk])
+                        gathered_chunk_output_images = gather_object(results.images)
+                        gathered_chunk_meta_data = gather_object(batch['meta_data'][chunk])
+                        if accelerator.is_main_process:
+                            reward_futures.append((
+                                submit_evaluate_images(
+                                    input_images=gathered_chunk_input_images_pil,
+                                    output_image=gathered_chunk_output_images,
+                                    meta_datas=gathered_chunk_meta_data,
+                                    **reward_client_kwargs
+                                ),
+                                len(gathered_chunk_output_images),
+                            ))
+
                     if i == 0:
                         total_text_feats = text_feats
                         total_results = results
@@ -657,45 +717,72 @@ def main(args):
                         for i in range(len(results.log_probs)):
                             total_results.log_probs[i] = torch.cat([total_results.log_probs[i], results.log_probs[i]], dim=0)
 
-            for i in range(len(batch['meta_data'])):
-                json_data = json.loads(batch['meta_data'][i])
-                json_data['id'] = f"{global_step * args.train.global_batch_size + accelerator.process_index * args.train.batch_size + i}"
-                batch['meta_data'][i] = json.dumps(json_data)
-            
             local_batch_size = len(input_images_pil)
-            gathered_input_images_pil = gather_object(input_images_pil)
-            gathered_output_images = gather_object(total_results.images)
-            gathered_meta_data = gather_object(batch['meta_data'])
-
-            if accelerator.is_main_process:
-                scores, rewards, reasoning, meta_data = evaluate_images(
-                    input_images=gathered_input_images_pil,
-                    output_image=gathered_output_images,
-                    meta_datas=gathered_meta_data,
-                    proxy_host=reward_server_config.server.hosts[0],
-                    proxy_port=reward_server_config.server.proxy_port,
-                    server_type=args.train.rl.get('server_type', 'vlm')
+            if per_rank_reward and pipelined_reward:
+                rewards, reasoning, meta_data = [], [], []
+                for reward_future, num_samples in reward_futures:
+                    chunk_rewards, chunk_reasoning, chunk_meta_data = unpack_reward_result(reward_future.result(), num_samples)
+                    rewards.extend(chunk_rewards)
+                    reasoning.extend(chunk_reasoning)
+                    meta_data.extend(chunk_meta_data)
+            elif per_rank_reward:
+                rewards, reasoning, meta_data = unpack_reward_result(
+                    evaluate_images(
+                        input_images=input_images_pil,
+                        output_image=total_results.images,
+                        meta_datas=batch['meta_data'],
+                        **reward_client_kwargs
+                    ),
+                    len(total_results.images),
                 )
-
-                rewards_to_scatter = [rewards[i:i + local_batch_size] for i in range(0, len(rewards), local_batch_size)]
-                reasoning_to_scatter = [reasoning[i:i + local_batch_size] for i in range(0, len(reasoning), local_batch_size)]
-                meta_data_to_scatter = [meta_data[i:i + local_batch_size] for i in range(0, len(meta_data), local_batch_size)]
             else:
-                rewards_to_scatter = [None for _ in range(accelerator.num_processes)]
-                reasoning_to_scatter = [None for _ in range(accelerator.num_processes)]
-                meta_data_to_scatter = [None for _ in range(accelerator.num_processes)]
-
-            accelerator.wait_for_everyone()
-            # Extract the current process’s own rewards, reasoning, and meta_data.
-            rewards = [None]
-            reasoning = [None]
-            meta_data = [None]
-            torch.distributed.scatter_object_list(rewards, rewards_to_scatter)
-            torch.distributed.scatter_object_list(reasoning, reasoning_to_scatter)
-            torch.distributed.scatter_object_list(meta_data, meta_data_to_scatter)
-            rewards = rewards[0]
-            reasoning = reasoning[0]
-            meta_data = meta_data[0]
+                if not pipelined_reward:
+                    gathered_input_images_pil = gather_object(input_images_pil)
+                    gathered_output_images = gather_object(total_results.images)
+                    gathered_meta_data = gather_object(batch['meta_data'])
+
+                if accelerator.is_main_process and pipelined_reward:
+                    # every chunk request holds batch_size_per_forward samples of each rank, in rank order
+                    rewards_to_scatter = [[] for _ in range(accelerator.num_processes)]
+                    reasoning_to_scatter = [[] for _ in range(accelerator.num_processes)]
+                    meta_data_to_scatter = [[] for _ in range(accelerator.num_processes)]
+                    for reward_future, num_samples in reward_futures:
+                        rewards, reasoning, meta_data = unpack_reward_result(reward_future.result(), num_samples)
+                        for rank in range(accelerator.num_processes):
+                            rank_chunk = slice(rank * batch_size_per_forward, (rank + 1) * batch_size_per_forward)
+                            rewards_to_scatter[rank].extend(rewards[rank_chunk])
+                            reasoning_to_scatter[rank].extend(reasoning[rank_chunk])
+                            meta_data_to_scatter[rank].extend(meta_data[rank_chunk])
+                elif accelerator.is_main_process:
+                    rewards, reasoning, meta_data = unpack_reward_result(
+                        evaluate_images(
+                            input_images=gathered_input_images_pil,
+                            output_image=gathered_output_images,
+                            meta_datas=gathered_meta_data,
+                            **reward_client_kwargs
+                        ),
+                        len(gathered_output_images),
+                    )
+
+                    rewards_to_scatter = [rewards[i:i + local_batch_size] for i in range(0, len(rewards), local_batch_size)]
+                    reasoning_to_scatter = [reasoning[i:i + local_batch_size] for i in range(0, len(reasoning), local_batch_size)]
+                    meta_data_to_scatter = [meta_data[i:i + local_batch_size] for i in range(0, len(meta_data), local_batch_size)]
+                else:
+                    rewards_to_scatter = [None for _ in range(accelerator.num_processes)]
+                    reasoning_to_scatter = [None for _ in range(accelerator.num_processes)]
+                    meta_data_to_scatter = [None for _ in range(accelerator.num_processes)]
+
+                accelerator.wait_for_everyone()
+                # Extract the current process’s own rewards, reasoning, and meta_data.
+                rewards = [None]
+                reasoning = [None]
+                meta_data = [None]
+                torch.distributed.scatter_object_list(rewards, rewards_to_scatter)
+                torch.distributed.scatter_object_list(reasoning, reasoning_to_scatter)
+                torch.distributed.scatter_object_list(meta_data, meta_data_to_scatter)
+                rewards = rewards[0]
+                reasoning = reasoning[0]
+                meta_data = meta_data[0]
 
             assert len(rewards) == len(reasoning) == len(meta_data) == local_batch_size
 
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+from editscore import AsyncEditScore
+from editscore.mllm_tools.fake_engine import FakeAsyncEngine
+
+
+def make_images():
+    return [Image.new("RGB", (16, 16), (255, 0, 0)), Image.new("RGB", (16, 16), (0, 0, 255))]
+
+
+def test_evaluate_returns_scores():
+    engine = FakeAsyncEngine(score_range=25)
+    scorer = AsyncEditScore(engine=engine, num_pass=2)
+
+    result = asyncio.run(scorer.evaluate(make_images(), "make it blue"))
+
+    for key in ("prompt_following", "consistency", "perceptual_quality", "overall"):
+        assert 0 <= result[key] <= 10
+    assert result["num_pass_used"] == 2
+
+
+def test_concurrent_evaluates_are_batched():
+    engine = FakeAsyncEngine(score_range=25, step_latency=0.05)
+    scorer = AsyncEditScore(engine=engine)
+
+    async def _run():
+        return await asyncio.gather(*[scorer.evaluate(make_images(), f"edit {i}") for i in range(8)])
+
+    results = asyncio.run(_run())
+
+    assert len(results) == 8
+    assert max(engine.batch_sizes) > 2
+
+
+def test_batch_evaluate_gathers_evaluate():
+    engine = FakeAsyncEngine(score_range=25, step_latency=0.05)
+    scorer = AsyncEditScore(engine=engine)
+
+    results = asyncio.run(scorer.batch_evaluate([make_images()] * 4, [f"edit {i}" for i in range(4)]))
+
+    assert len(results) == 4
+    assert all(0 <= result["overall"] <= 10 for result in results)
+    assert max(engine.batch_sizes) > 2
+
+
+def test_logprob_modes_are_not_inherited():
+    pytest.importorskip("vllm")
+    from editscore.mllm_tools import qwen3vl_vllm
+
+    assert not hasattr(qwen3vl_vllm.AsyncQwen3VL, "warm_prefix")
+    assert not hasattr(qwen3vl_vllm.AsyncQwen3VL, "next_token_logprobs")
@@ -0,0 +1,62 @@
+import pytest
+
+from editscore.score_parser import parse_score_output
+from editscore.utils import mllm_output_to_dict
+
+SCORE_RANGE = 25
+
+# recorded scorer malformations the single-pass parser must read like the cascade
+MALFORMED_OUTPUTS = [
+    '{\n"reasoning" : "The background was replaced by a glass wall as requested.",\n"score" : [21, 19]\n}',
+    '```json\n{"reasoning": "Clean edit, no artifacts.", "score": [23, 22]}\n```',
+    '{"reasoning": "The sign now reads "OPEN" as instructed.", "score": [20, 18]}',
+    "{'reasoning': 'Colors match the instruction.', 'score': [18, 20]}",
+    '{reasoning: "Unquoted keys but otherwise fine.", score: [12, 15]}',
+    '{“reasoning”: “Smart quotes around keys and value.”, “score”: [9, 11]}',
+    '{"reasoning": "Trailing comma after the list.", "score": [17, 16],}',
+    '{"reasoning": "Scores are quoted.", "score": ["15", "10"]}',
+    '{"reasoning": "Escaped \\"quotes\\" and a\\nnewline.", "score": [25, 24]}',
+    '{"score": [6, 8], "reasoning": "Keys in the other order."}',
+    '{"reasoning": "Python literal fields.", "confident": True, "score": [11, 12]}',
+    '{"reasoning": "Fractional scores.", "score": [7.5, 8.0]}',
+]
+
+REJECTED_OUTPUTS = [
+    '{"reasoning": "Score given as a single number.", "score": 7}',
+    '{"reasoning": "Only one score in the list.", "score": [7]}',
+    '{"reasoning": "Three scores.", "score": [9, 3, 4]}',
+    '{"reasoning": "Above the range.", "score": [99, 4]}',
+    '{"reasoning": "A negative score.", "score": [-3, 4]}',
+    '{"reasoning": "No score at all."}',
+    "no json here",
+]
+
+
+def normalize_reasoning(reasoning):
+    reasoning = "".join(str(reasoning).split())
+    return reasoning.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+
+
+@pytest.mark.parametrize("output", MALFORMED_OUTPUTS)
+def test_agrees_with_cascade(output):
+    expected = mllm_output_to_dict(output, score_range=SCORE_RANGE)
+    actual = parse_score_output(output, SCORE_RANGE)
+
+    assert actual is not None
+    assert actual["score"] == [float(score) for score in expected["score"]]
+    assert normalize_reasoning(actual["reasoning"]) == normalize_reasoning(expected["reasoning"])
+
+
+def test_reads_output_missing_closing_brace():
+    output = '{"reasoning": "Closing brace is missing.", "score": [14, 13]'
+    assert parse_score_output(output, SCORE_RANGE) == {"score": [14.0, 13.0], "reasoning": "Closing brace is missing."}
+
+
+@pytest.mark.parametrize("output", REJECTED_OUTPUTS)
+def test_rejects_wrong_count_or_range(output):
+    assert parse_score_output(output, SCORE_RANGE) is None
+
+
+def test_score_range_bounds_are_inclusive():
+    assert parse_score_output('{"reasoning": "x", "score": [0, 10]}', 10)["score"] == [0.0, 10.0]
+    assert parse_score_output('{"reasoning": "x", "score": [0, 11]}', 10) is None